@@ -0,0 +1,261 @@
+"""
+Benchmarks for the wflogger hot paths
+
+Measures:
+    insert_events_per_s     - events/s written one at a time, as insert_record does
+    ingest_lines_per_s      - log lines/s scanned by LogIngestor.ingest_log
+    ingest_mb_per_s         - MB/s scanned by LogIngestor.ingest_log
+    add_duration_rows_per_s - rows/s processed by analysis.add_duration_column
+    get_results_latency_s   - seconds taken to query and post-process one workflow/tag
+    cli_startup_s           - seconds taken to start the wflogger command-line
+
+Results can be saved as a baseline; later runs are compared against the stored baseline
+and the script exits with a non-zero status if any hot path has become slower than the
+allowed threshold.
+
+Some example usages (from the top-level directory of the repository):
+
+(1) run the benchmarks against a temporary sqlite3 database and print the results
+
+python -m benchmarks.run_benchmarks
+
+(2) run the benchmarks and store the results as the baseline
+
+python -m benchmarks.run_benchmarks --save-baseline
+
+(3) run the benchmarks against a local postgres database (using the credentials in
+    $HOME/.wflogger), failing if anything is more than 10% slower than the baseline
+
+python -m benchmarks.run_benchmarks --postgres --threshold 0.1
+
+Note:
+    the postgres benchmarks write (and then delete) rows belonging to the workflows
+    named "bench-workflow-*" - only point them at a local or test database
+"""
+
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from wflogger import analysis
+from wflogger.backends import SQLiteBackend, PostgresBackend
+from wflogger.credentials import user_id
+from wflogger.db_mngr import create_db
+from wflogger.log_ingestor import LogIngestor
+from wflogger.wflogger import insert_record
+
+from .synthetic import generate_records, generate_dataframe, write_log_file
+
+DEFAULT_BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+DEFAULT_THRESHOLD = 0.2
+
+BENCH_WORKFLOW = "bench-workflow-00"
+BENCH_TAG = "v0.0"
+
+DELETE_BENCH_ROWS_SQL = "DELETE FROM workflow_logs WHERE workflow LIKE 'bench-workflow-%'"
+
+
+class Benchmarks:
+    """Runs each hot path benchmark against either a sqlite3 or a postgres database"""
+
+    def __init__(self, work_dir, postgres=False, repeat=3, scale=1):
+        """
+        Constructor
+
+        :param work_dir: directory in which to write the synthetic log files and databases
+        :param postgres: run against the postgres database in $HOME/.wflogger instead of sqlite3
+        :param repeat: the number of times each benchmark is run, the median is reported
+        :param scale: multiplier applied to the default problem sizes
+        """
+        self.work_dir = work_dir
+        self.postgres = postgres
+        self.repeat = repeat
+        self.scale = scale
+        self.results = {}
+
+    def run(self):
+        """
+        Run all the benchmarks
+
+        :return: dictionary mapping benchmark name to a result dictionary
+        """
+        self.bench_insert(500 * self.scale)
+        self.bench_ingest(50000 * self.scale)
+        self.bench_add_duration_column(100000 * self.scale)
+        self.bench_get_results(20000 * self.scale)
+        self.bench_cli_startup()
+        return self.results
+
+    def _record(self, name, timings, unit, higher_is_better, work=None):
+        elapsed = statistics.median(timings)
+        value = work / elapsed if work is not None else elapsed
+        self.results[name] = {"value": value, "unit": unit, "higher_is_better": higher_is_better}
+
+    def _new_backend(self, name):
+        """Get the postgres backend (cleaned of benchmark rows) or a new, empty sqlite backend"""
+        if self.postgres:
+            backend = PostgresBackend()
+            self._cleanup(backend)
+            return backend
+
+        path = os.path.join(self.work_dir, name)
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        backend = SQLiteBackend(path)
+        create_db(backend)
+        return backend
+
+    def _cleanup(self, backend):
+        if self.postgres:
+            conn = backend.connect()
+            with conn:
+                conn.cursor().execute(DELETE_BENCH_ROWS_SQL)
+            conn.close()
+
+    def bench_insert(self, n_events):
+        records = generate_records(n_events, user_id=user_id, n_workflows=1)
+        timings = []
+
+        for _ in range(self.repeat):
+            backend = self._new_backend("insert.db")
+            start = time.perf_counter()
+            for record in records:
+                insert_record(*record[2:7], backend=backend)
+            timings.append(time.perf_counter() - start)
+            self._cleanup(backend)
+
+        self._record("insert_events_per_s", timings, "events/s", True, work=n_events)
+
+    def bench_ingest(self, n_entries):
+        log_path = os.path.join(self.work_dir, "bench.log")
+        n_lines = write_log_file(log_path, n_entries)
+        n_mb = os.path.getsize(log_path) / 1e6
+        timings = []
+
+        for _ in range(self.repeat):
+            backend = self._new_backend("ingest.db")
+            ingestor = LogIngestor(backend=backend)
+            start = time.perf_counter()
+            if not ingestor.ingest_log(log_path):
+                raise RuntimeError("Failed to ingest synthetic log file %s" % log_path)
+            timings.append(time.perf_counter() - start)
+            self._cleanup(backend)
+
+        self._record("ingest_lines_per_s", timings, "lines/s", True, work=n_lines)
+        self._record("ingest_mb_per_s", timings, "MB/s", True, work=n_mb)
+
+    def bench_add_duration_column(self, n_rows):
+        df = generate_dataframe(n_rows)
+        timings = []
+
+        for _ in range(self.repeat):
+            start = time.perf_counter()
+            analysis.add_duration_column(df)
+            timings.append(time.perf_counter() - start)
+
+        self._record("add_duration_rows_per_s", timings, "rows/s", True, work=n_rows)
+
+    def bench_get_results(self, n_records):
+        records = generate_records(n_records, user_id=user_id, n_workflows=1, n_tags=1)
+        backend = self._new_backend("results.db")
+        ingestor = LogIngestor(backend=backend)
+        backend.write_records(ingestor.conn, ingestor.insert_sql, records)
+        timings = []
+
+        for _ in range(self.repeat):
+            start = time.perf_counter()
+            df = analysis.get_results(BENCH_WORKFLOW, tag=BENCH_TAG, backend=backend)
+            timings.append(time.perf_counter() - start)
+
+        self._cleanup(backend)
+        self._record("get_results_latency_s", timings, "s", False)
+        self.results["get_results_bytes_per_row"] = {"value": analysis.memory_usage_mb(df) * 1e6 / n_records,
+                                                     "unit": "bytes", "higher_is_better": False}
+
+    def bench_cli_startup(self):
+        timings = []
+
+        for _ in range(max(self.repeat, 5)):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, "-m", "wflogger.cli", "--help"],
+                           check=True, stdout=subprocess.DEVNULL)
+            timings.append(time.perf_counter() - start)
+
+        self._record("cli_startup_s", timings, "s", False)
+
+
+def compare_to_baseline(results, baseline, threshold):
+    """
+    Compare benchmark results against a baseline
+
+    :param results: dictionary of results from Benchmarks.run
+    :param baseline: dictionary of results from a previous run
+    :param threshold: the fractional slow-down allowed before a benchmark counts as a regression
+    :return: list of (name, baseline-value, new-value) for each benchmark that regressed
+    """
+    regressions = []
+
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        old, new = baseline[name]["value"], result["value"]
+        if result["higher_is_better"]:
+            regressed = new < old * (1 - threshold)
+        else:
+            regressed = new > old * (1 + threshold)
+        if regressed:
+            regressions.append((name, old, new))
+
+    return regressions
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--postgres", action="store_true",
+                        help="Benchmark against the postgres database in $HOME/.wflogger instead of sqlite3")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of repeats of each benchmark")
+    parser.add_argument("--scale", type=int, default=1, help="Multiplier applied to the problem sizes")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE_PATH, help="Path of the baseline results file")
+    parser.add_argument("--save-baseline", action="store_true", help="Store the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Fractional slow-down allowed before failing, e.g. 0.2 for 20%%")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    backend_name = "postgres" if args.postgres else "sqlite"
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        results = Benchmarks(work_dir, postgres=args.postgres, repeat=args.repeat, scale=args.scale).run()
+
+    for name, result in results.items():
+        print("%-26s %14.4f %s" % (name, result["value"], result["unit"]))
+
+    baselines = {}
+    if os.path.isfile(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+
+    if args.save_baseline:
+        baselines[backend_name] = results
+        with open(args.baseline, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        print("Saved %s baseline to %s" % (backend_name, args.baseline))
+        sys.exit(0)
+
+    if backend_name not in baselines:
+        print("No %s baseline found in %s, nothing to compare against" % (backend_name, args.baseline))
+        sys.exit(0)
+
+    regressions = compare_to_baseline(results, baselines[backend_name], args.threshold)
+    for name, old, new in regressions:
+        print("REGRESSION: %s changed from %.4f to %.4f" % (name, old, new))
+    sys.exit(1 if regressions else 0)
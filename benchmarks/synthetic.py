@@ -0,0 +1,112 @@
+"""
+Synthetic data generators for the wflogger benchmarks
+
+Generates workflow log records, WFL_START log files and DataFrames shaped like the
+contents of the workflow_logs table, so that the hot paths can be exercised without
+access to real workflow data.
+"""
+
+import datetime
+import random
+
+import pandas as pd
+
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+STAGES = [(1, "start"), (2, "read"), (3, "process"), (4, "summarise"), (5, "publish")]
+
+NOISE_LINES = [
+    "INFO Reading input file /gws/nopw/j04/project/data/input_%06d.nc\n",
+    "DEBUG Allocated chunk of %d bytes for regridding\n",
+    "WARNING Retrying transfer of block %d after timeout\n",
+]
+
+
+def generate_records(n_records, user_id="bench", n_workflows=4, n_tags=3, n_hosts=50, seed=0,
+                     start=datetime.datetime(2022, 1, 1)):
+    """
+    Generate synthetic workflow log records
+
+    :param n_records: the number of records to generate
+    :param user_id: the user_id to write in each record
+    :param n_workflows: the number of distinct workflow names to use
+    :param n_tags: the number of distinct tags per workflow
+    :param n_hosts: the number of distinct hostnames to use
+    :param seed: random seed, so that runs are repeatable
+    :param start: the date-time of the first record
+    :return: list of 14-tuples in workflow_logs column order
+    """
+    rnd = random.Random(seed)
+    records = []
+    date_time = start
+    iteration = 0
+
+    while len(records) < n_records:
+        iteration += 1
+        workflow = "bench-workflow-%02d" % rnd.randrange(n_workflows)
+        tag = "v%d.0" % rnd.randrange(n_tags)
+        hostname = "host%03d.jc.rl.ac.uk" % rnd.randrange(n_hosts)
+
+        for stage_number, stage in STAGES:
+            date_time += datetime.timedelta(seconds=rnd.uniform(0.001, 30))
+            records.append((user_id, hostname, workflow, tag, stage_number, stage,
+                            iteration, date_time, "", -999, None, None, None, None))
+            if len(records) == n_records:
+                break
+
+    return records
+
+
+def format_log_line(record):
+    """
+    Format a record as a WFL_START log line, as read by the LogIngestor
+
+    :param record: a 14-tuple in workflow_logs column order
+    :return: the log line, including a trailing newline
+    """
+    # the duration and work counter fields are optional
+    fields = list(record)
+    while len(fields) > 10 and fields[-1] is None:
+        fields.pop()
+    fields = ["" if field is None else field for field in fields]
+    fields[7] = fields[7].strftime(DATETIME_FORMAT)
+    return "%s INFO WFL_START %s\n" % (fields[7], " | ".join(str(field) for field in fields))
+
+
+def write_log_file(path, n_entries, noise_ratio=3, seed=0):
+    """
+    Write a synthetic log file containing WFL_START entries interleaved with other lines
+
+    :param path: the filesystem path to write to
+    :param n_entries: the number of WFL_START entries to write
+    :param noise_ratio: the number of non-workflow lines written per entry
+    :param seed: random seed, so that runs are repeatable
+    :return: the total number of lines written
+    """
+    rnd = random.Random(seed)
+    n_lines = 0
+
+    with open(path, "w") as f:
+        for record in generate_records(n_entries, seed=seed):
+            for _ in range(noise_ratio):
+                f.write(rnd.choice(NOISE_LINES) % rnd.randrange(1000000))
+            f.write(format_log_line(record))
+            n_lines += noise_ratio + 1
+
+    return n_lines
+
+
+def generate_dataframe(n_rows, seed=0):
+    """
+    Generate a DataFrame shaped like the result of querying the workflow_logs table
+
+    :param n_rows: the number of rows to generate
+    :param seed: random seed, so that runs are repeatable
+    :return: pandas.DataFrame with the workflow_logs columns
+    """
+    columns = ["user_id", "hostname", "workflow", "tag", "stage_number", "stage",
+               "iteration", "date_time", "comment", "flag", "duration_ns",
+               "work_bytes", "work_files", "work_items"]
+    df = pd.DataFrame(generate_records(n_rows, seed=seed), columns=columns)
+    df.insert(0, "id", range(1, n_rows + 1))
+    return df
@@ -79,7 +79,9 @@ setup(
     test_suite='tests',
     tests_require=test_requirements,
     extras_require={"docs": docs_requirements,
-                    "dev": dev_requirements},
+                    "dev": dev_requirements,
+                    "archive": ["pyarrow"],
+                    "zstd": ["zstandard"]},
     url='https://github.com/cedadev/wflogger',
     zip_safe=False,
 )
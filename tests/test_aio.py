@@ -0,0 +1,85 @@
+import unittest
+import tempfile
+import asyncio
+import os
+import logging
+
+"""Basic unit tests for the asyncio API, writing to sqlite3"""
+
+from wflogger.backends import SQLiteBackend
+from wflogger.db_mngr import create_db
+from wflogger.aio import AsyncLogSession
+
+
+class AsyncLogSessionTests(unittest.TestCase):
+
+    def setUp(self):
+        logging.basicConfig(level=logging.CRITICAL)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.backend = SQLiteBackend(os.path.join(self.tmp_dir.name, "test.db"))
+        create_db(self.backend)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def count_rows(self):
+        conn = self.backend.connect()
+        count = conn.execute("SELECT COUNT(*) FROM workflow_logs").fetchall()[0][0]
+        conn.close()
+        return count
+
+    def test_log_concurrently(self):
+        async def job(session, iteration):
+            for stage_number, stage in enumerate(["start", "model", "end"], 1):
+                await session.log("my-workflow", "v1", stage_number, stage, iteration)
+                await asyncio.sleep(0)
+
+        async def main():
+            async with AsyncLogSession(backend=self.backend, max_batch=50) as session:
+                await asyncio.gather(*[job(session, iteration) for iteration in range(100)])
+
+        asyncio.run(main())
+        self.assertEqual(self.count_rows(), 300)
+
+    def test_flush_raises_write_errors(self):
+        async def main():
+            async with AsyncLogSession(backend=self.backend) as session:
+                await session.log("my-workflow", "v1", 1, "start", date_time="2022-01-01 12:00:00")
+                await session.flush()
+                self.assertEqual(self.count_rows(), 1)
+
+                # a NOT NULL column
+                await session.log("my-workflow", "v1", None, "start")
+                with self.assertRaises(Exception):
+                    await session.flush()
+
+        asyncio.run(main())
+        self.assertEqual(self.count_rows(), 1)
+
+    def test_bad_record_only_loses_itself(self):
+        async def main():
+            async with AsyncLogSession(backend=self.backend, max_batch=1000) as session:
+                # buffered without yielding to the writer, so all in one batch
+                for iteration in range(100):
+                    await session.log("my-workflow", "v1", None if iteration == 50 else 1, "start", iteration)
+                with self.assertRaises(Exception):
+                    await session.flush()
+
+        asyncio.run(main())
+        self.assertEqual(self.count_rows(), 99)
+
+    def test_unclosed_session_written_at_shutdown(self):
+        # the session (and its queue) may be created outside the event loop
+        session = AsyncLogSession(backend=self.backend)
+
+        async def main():
+            for iteration in range(10):
+                await session.log("my-workflow", "v1", 1, "start", iteration)
+
+        with self.assertLogs("AsyncLogSession", level="WARNING"):
+            asyncio.run(main())
+        self.assertEqual(self.count_rows(), 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
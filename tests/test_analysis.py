@@ -0,0 +1,113 @@
+import unittest
+import tempfile
+import datetime
+import os
+import logging
+
+"""Basic unit tests for the analysis functions, using sqlite3"""
+
+import matplotlib
+matplotlib.use("Agg")
+
+from wflogger.backends import SQLiteBackend
+from wflogger.db_mngr import create_db
+from wflogger.wflogger import INSERT_SQL
+from wflogger.credentials import user_id
+from wflogger import analysis
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+class AnalysisTests(unittest.TestCase):
+
+    def setUp(self):
+        logging.basicConfig(level=logging.CRITICAL)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.backend = SQLiteBackend(os.path.join(self.tmp_dir.name, "test.db"))
+        create_db(self.backend)
+
+        start = datetime.datetime(2022, 1, 1)
+        rows = []
+        for tag in ("v1", "v2"):
+            for iteration in range(1, 51):
+                for stage_number, stage in enumerate(["start", "read", "model", "end"], 1):
+                    date_time = start + datetime.timedelta(minutes=iteration, seconds=stage_number * stage_number)
+                    # reading runs at 1 MB/s and modelling at 10 items/s
+                    work_bytes = 3000000 if stage == "read" else None
+                    work_items = 50 if stage == "model" else None
+                    rows.append((user_id, "host%d" % (iteration % 3), "wf", tag, stage_number, stage, iteration,
+                                 date_time, "", -999, None, work_bytes, None, work_items))
+        conn = self.backend.connect()
+        self.backend.write_records(conn, INSERT_SQL, rows)
+        conn.close()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_compact_dtypes(self):
+        with self.assertLogs("analysis", level=logging.INFO) as logs:
+            df = analysis.get_results("wf", tag="v1", backend=self.backend)
+        self.assertIn("for 200 records", logs.output[0])
+        self.assertEqual(len(df), 200)
+        self.assertEqual(df["stage"].dtype, "category")
+        self.assertEqual(df["iteration"].dtype, "int8")
+        self.assertEqual(list(df[df["iteration"] == 1]["duration"]), [0, 3, 5, 7])
+
+        df_inferred = analysis.get_results("wf", tag="v1", backend=self.backend, compact_dtypes=False)
+        self.assertEqual(list(df_inferred["duration"]), list(df["duration"]))
+        self.assertLess(analysis.memory_usage_mb(df), analysis.memory_usage_mb(df_inferred))
+
+    def test_float32(self):
+        df = analysis.get_results("wf", tag="v1", backend=self.backend, float32=True)
+        self.assertEqual(df["duration"].dtype, "float32")
+
+    @unittest.skipIf(pyarrow is None, "pyarrow is required for Arrow-backed columns")
+    def test_arrow(self):
+        df = analysis.get_results("wf", tag="v1", backend=self.backend, arrow=True)
+        self.assertEqual(str(df["duration"].dtype), "double[pyarrow]")
+        self.assertEqual(df["stage"].dtype, "category")
+        self.assertEqual(analysis.combine_stage_statistics(df)["n_records"].tolist(), [50, 50, 50, 50])
+
+    def test_throughput(self):
+        df = analysis.get_results("wf", tag="v1", backend=self.backend)
+        df_rates = analysis.add_throughput_columns(df)
+        self.assertEqual(df_rates[df_rates["iteration"] == 1]["mb_per_s"].tolist()[1], 1.0)
+        self.assertEqual(df_rates["items_per_s"].notnull().sum(), 50)
+        self.assertNotIn("mb_per_s", df.columns)
+
+        stats = analysis.stage_throughput(df).set_index("stage")
+        self.assertEqual(stats.loc["read", "mb_per_s"], 1.0)
+        self.assertEqual(stats.loc["model", "items_per_s"], 10.0)
+        self.assertTrue(stats.loc["start", "mb_per_s"] != stats.loc["start", "mb_per_s"])
+        self.assertNotIn("files_per_s", stats.columns)
+
+    def test_fit_scaling(self):
+        df = analysis.get_results("wf", backend=self.backend)
+        # 2 s of overhead then 4 MB/s, twice as fast for v2
+        read = df["stage"] == "read"
+        df.loc[read, "work_bytes"] = df.loc[read, "iteration"].astype("int64") * 4000000
+        df.loc[read, "duration"] = 2 + df.loc[read, "iteration"] / df.loc[read, "tag"].astype(str).map({"v1": 1, "v2": 2})
+        fits = analysis.fit_scaling(df, 2).set_index("tag")
+        self.assertEqual(fits["n_records"].tolist(), [50, 50])
+        self.assertAlmostEqual(fits.loc["v1", "overhead"], 2)
+        self.assertAlmostEqual(fits.loc["v1", "mb_per_s"], 4)
+        self.assertAlmostEqual(fits.loc["v2", "mb_per_s"], 8)
+        analysis.plot_scaling_curve(df, 2)
+        matplotlib.pyplot.close("all")
+
+    def test_plots(self):
+        df1 = analysis.get_results("wf", tag="v1", backend=self.backend)
+        df2 = analysis.get_results("wf", tag="v2", backend=self.backend)
+        self.assertEqual(analysis.get_stage_labels(df1), ["01: start", "02: read", "03: model", "04: end"])
+        analysis.plot_stage_durations_by_iteration(df1)
+        analysis.plot_comparison_of_two_workflow_tags(df1, df2)
+        analysis.plot_bar_chart_comparing_tags(df1, df2)
+        analysis.plot_throughput_by_iteration(df1)
+        matplotlib.pyplot.close("all")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+import unittest
+import tempfile
+import os
+import logging
+
+"""Basic unit tests for the storage backends, running the full log -> ingest -> analyse cycle on sqlite3"""
+
+from wflogger.backends import SQLiteBackend
+from wflogger.wflogger import insert_record, timed_stage
+from wflogger.log_ingestor import LogIngestor
+from wflogger.analysis import get_results
+from wflogger.db_mngr import create_db, upgrade_db, CREATE_TABLE_SQL
+from wflogger.credentials import user_id
+
+loglines = """
+WFL_START {user_id} | compute1 | modeler.py | v14.3 | 1 | prep | 1 | 2022-01-01 12:00:00.000000 ||
+WFL_START {user_id} | compute1 | modeler.py | v14.3 | 2 | model | 1 | 2022-01-01 12:00:10.500000 ||
+WFL_START {user_id} | compute1 | modeler.py | v14.3 | 3 | write | 1 | 2022-01-01 12:00:11.000000 ||| 250000
+WFL_START {user_id} | compute1 | modeler.py | v14.3 | 4 | publish | 1 | 2022-01-01 12:00:13.000000 |||| 4000000 | 2
+"""
+
+
+class SQLiteBackendTests(unittest.TestCase):
+
+    def setUp(self):
+        logging.basicConfig(level=logging.CRITICAL)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.backend = SQLiteBackend(os.path.join(self.tmp_dir.name, "test.db"))
+        create_db(self.backend)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_pragmas(self):
+        conn = self.backend.connect()
+        self.assertEqual(conn.execute("PRAGMA journal_mode").fetchall()[0][0], "wal")
+        self.assertEqual(conn.execute("PRAGMA synchronous").fetchall()[0][0], 1)
+        conn.close()
+
+    def test_insert_and_analyse(self):
+        insert_record("my-workflow", "v1", 1, "start", 1, date_time="2022-01-01 12:00:00", backend=self.backend)
+        insert_record("my-workflow", "v1", 2, "end", 1, date_time="2022-01-01 12:00:02.25", backend=self.backend)
+        insert_record("my-workflow", "v2", 1, "start", 1, backend=self.backend)
+
+        df = get_results("my-workflow", tag="v1", backend=self.backend)
+        self.assertEqual(list(df["stage"]), ["start", "end"])
+        self.assertEqual(list(df["duration"]), [0, 2.25])
+
+    def test_ingest_and_analyse(self):
+        log_path = os.path.join(self.tmp_dir.name, "test.log")
+        with open(log_path, "w") as f:
+            f.write(loglines.format(user_id=user_id))
+        ls = LogIngestor(backend=self.backend)
+        self.assertTrue(ls.ingest_log(log_path))
+
+        df = get_results("modeler.py", tag="v14.3", backend=self.backend).set_index("stage")
+        self.assertEqual(df.loc["model", "duration"], 10.5)
+        self.assertEqual(df.loc["write", "duration"], 0.00025)
+        self.assertEqual(df.loc["publish", "duration"], 2)
+        self.assertEqual((df.loc["publish", "work_bytes"], df.loc["publish", "work_files"]), (4000000, 2))
+
+    def test_measured_durations(self):
+        insert_record("my-workflow", "v1", 1, "start", 1, date_time="2022-01-01 12:00:00", backend=self.backend)
+        insert_record("my-workflow", "v1", 2, "read", 1, date_time="2022-01-01 12:00:01", backend=self.backend,
+                      duration_ns=1234)
+        with timed_stage("my-workflow", "v1", 3, "model", 1, backend=self.backend):
+            pass
+
+        df = get_results("my-workflow", tag="v1", backend=self.backend).set_index("stage")
+        self.assertEqual(df.loc["start", "duration"], 0)
+        self.assertEqual(df.loc["read", "duration"], 1.234e-6)
+        self.assertTrue(0 < df.loc["model", "duration"] < 1)
+
+    def test_upgrade(self):
+        conn = self.backend.connect()
+        conn.execute("DROP TABLE workflow_logs")
+        conn.execute(self.backend.ddl(CREATE_TABLE_SQL.split(",\n  duration_ns")[0] + "\n);"))
+        conn.close()
+
+        # a table created before the optional columns were added can be written until they are used
+        insert_record("my-workflow", "v1", 1, "start", 1, backend=self.backend)
+        log_path = os.path.join(self.tmp_dir.name, "test.log")
+        with open(log_path, "w") as f:
+            f.write("".join(line + "\n" for line in loglines.format(user_id=user_id).splitlines()[:3]))
+        self.assertTrue(LogIngestor(backend=self.backend).ingest_log(log_path))
+        with self.assertRaises(Exception):
+            insert_record("my-workflow", "v1", 2, "model", 1, backend=self.backend, duration_ns=10)
+
+        self.assertEqual(upgrade_db(self.backend), ["duration_ns", "work_bytes", "work_files", "work_items"])
+        self.assertEqual(upgrade_db(self.backend), [])
+        insert_record("my-workflow", "v1", 1, "start", 1, backend=self.backend, duration_ns=10, work_items=3)
+
+    def test_write_records(self):
+        rows = [("fred", "compute1", "wf", "v1", 1, "start", i, None, "", -999, None, None, None, None) for i in range(25)]
+        conn = self.backend.connect()
+        self.assertEqual(self.backend.write_records(conn, LogIngestor(backend=self.backend).insert_sql,
+                                                    rows, batch_size=10), 25)
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM workflow_logs").fetchall()[0][0], 25)
+        conn.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
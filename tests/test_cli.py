@@ -0,0 +1,90 @@
+import unittest
+import tempfile
+import os
+import logging
+
+"""Basic unit tests for the command-line interface, writing to sqlite3"""
+
+from click.testing import CliRunner
+
+from wflogger.backends import SQLiteBackend
+from wflogger.db_mngr import create_db
+from wflogger.cli import main
+
+text_batch = """
+my-workflow | v1 | 1 | start | 1 | 2022-01-01 12:00:00.000000 | |
+my-workflow | v1 | 2 | end | 1 | | done | 0
+# a comment
+my-workflow | v1 | 1 | start
+WFL_START someone | compute1 | my-workflow | v2 | 1 | start | 1 | 2022-01-01 12:00:00.000000 ||
+"""
+
+csv_batch = """workflow,tag,stage_number,stage,iteration,date_time,comment,flag
+my-workflow,v1,1,start,1,2022-01-01 12:00:00.000000,"a, comment",
+my-workflow,v1,2,end,1,,,
+"""
+
+jsonl_batch = """{"workflow": "my-workflow", "tag": "v1", "stage_number": 1, "stage": "start", "iteration": 1}
+{"workflow": "my-workflow", "tag": "v1", "stage_number": 2, "stage": "end", "iteration": 1, "flag": 3}
+"""
+
+invalid_batch = """my-workflow | v1 | 1 | start | 1
+my-workflow | v1 | two | end | 1
+"""
+
+
+class LogBatchTests(unittest.TestCase):
+
+    def setUp(self):
+        logging.basicConfig(level=logging.CRITICAL)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, "test.db")
+        self.backend = SQLiteBackend(self.db_path)
+        create_db(self.backend)
+        self.runner = CliRunner()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def log_batch(self, batch, *args):
+        return self.runner.invoke(main, ["log-batch", "--sqlite-path", self.db_path] + list(args), input=batch)
+
+    def select(self, columns):
+        conn = self.backend.connect()
+        rows = conn.execute(f"SELECT {columns} FROM workflow_logs ORDER BY id").fetchall()
+        conn.close()
+        return rows
+
+    def test_text(self):
+        result = self.log_batch(text_batch)
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(self.select("tag, stage_number, iteration, comment, flag"),
+                         [("v1", 1, 1, "", -999), ("v1", 2, 1, "done", 0), ("v1", 1, 0, "", -999),
+                          ("v2", 1, 1, "", -999)])
+        self.assertEqual(self.select("user_id")[3], ("someone",))
+
+    def test_csv(self):
+        result = self.log_batch(csv_batch, "--format", "csv")
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(self.select("stage, comment"), [("start", "a, comment"), ("end", "")])
+
+    def test_jsonl(self):
+        result = self.log_batch(jsonl_batch, "--format", "jsonl")
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(self.select("stage_number, iteration, flag"), [(1, 1, -999), (2, 1, 3)])
+
+    def test_invalid(self):
+        result = self.log_batch(invalid_batch)
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn("line 2", result.output)
+        self.assertEqual(self.select("id"), [])
+
+    def test_invalid_lenient(self):
+        result = self.log_batch(invalid_batch, "--lenient")
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Logged 1 records, skipped 1", result.output)
+        self.assertEqual(self.select("stage"), [("start",)])
+
+
+if __name__ == "__main__":
+    unittest.main()
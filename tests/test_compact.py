@@ -0,0 +1,84 @@
+import unittest
+import tempfile
+import sqlite3
+import os
+import logging
+
+"""Basic unit tests for the compact (dictionary-encoded) schema, using sqlite3"""
+
+from wflogger.log_ingestor import LogIngestor
+from wflogger.analysis import _get_select_statement
+from wflogger.db_mngr import migrate_to_compact_schema
+from wflogger.backends import SQLiteBackend
+
+loglines = """
+Lorem Ipsum WFL_START fred | compute1 | modeler.py | v14.3 | 1 | prep | 0 | 2022-01-01 12:23:04.342912 ||
+Lorem Ipsum WFL_START fred | compute1 | modeler.py | v14.3 | 2 | model | 1 | 2022-01-01 12:23:05.927111 ||
+WFL_START fred | compute2 | modeler.py | v14.3 | 2 | model | 2 | 2022-01-01 12:25:02.891922 ||
+||| WFL_START fred | compute1 | modeler.py | v14.4 | 3 | publish | 0 | 2022-01-01 12:31:01.124212 |done|1
+"""
+
+SELECT_ALL_SQL = "SELECT user_id, hostname, workflow, tag, stage_number, stage, iteration, date_time, comment, flag " \
+                 "FROM workflow_logs ORDER BY date_time"
+
+
+class CompactSchemaTests(unittest.TestCase):
+
+    def setUp(self):
+        logging.basicConfig(level=logging.CRITICAL)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, "test.db")
+        self.log_path = os.path.join(self.tmp_dir.name, "test.log")
+        with open(self.log_path, "w") as f:
+            f.write(loglines)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _count(self, conn, table):
+        return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchall()[0][0]
+
+    def test_ingest_compact(self):
+        ls = LogIngestor(sqlite_database_path=self.db_path, compact_schema=True)
+        ls.prepare_database()
+        self.assertTrue(ls.ingest_log(self.log_path))
+        self.assertTrue(ls.ingest_log(self.log_path))
+        self.assertEqual(ls.workflow_logs_table_size(), 8)
+
+        conn = sqlite3.connect(self.db_path)
+        self.assertEqual(self._count(conn, "wfl_hostnames"), 2)
+        self.assertEqual(self._count(conn, "wfl_tags"), 2)
+        self.assertEqual(self._count(conn, "wfl_stages"), 3)
+        rows = conn.execute(_get_select_statement("modeler.py", tag="v14.3", user_id="fred")).fetchall()
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(rows[0][1:7], ("fred", "compute1", "modeler.py", "v14.3", 1, "prep"))
+
+        ls.reset_database()
+        self.assertEqual(ls.workflow_logs_table_size(), 0)
+
+    def test_migrate_to_compact(self):
+        ls = LogIngestor(sqlite_database_path=self.db_path)
+        ls.prepare_database()
+        self.assertTrue(ls.ingest_log(self.log_path))
+
+        conn = sqlite3.connect(self.db_path)
+        before = conn.execute(SELECT_ALL_SQL).fetchall()
+        migrate_to_compact_schema(SQLiteBackend(self.db_path))
+        self.assertEqual(conn.execute(SELECT_ALL_SQL).fetchall(), before)
+        self.assertEqual(self._count(conn, "workflow_logs_legacy"), 4)
+
+        # writes through the view are redirected to the entries table
+        conn.execute(ls.insert_sql, ("fred", "compute3", "modeler.py", "v14.3", 4, "tidy", 0,
+                                     "2022-01-01 12:40:00.000000", "", -999, 1500, 2048, 1, None))
+        conn.commit()
+        self.assertEqual(self._count(conn, "workflow_log_entries"), 5)
+        self.assertEqual(conn.execute("SELECT duration_ns, work_bytes, work_files, work_items FROM workflow_logs "
+                                      "WHERE stage = 'tidy'").fetchall(), [(1500, 2048, 1, None)])
+        self.assertEqual(self._count(conn, "wfl_hostnames"), 3)
+        conn.execute("DELETE FROM workflow_logs WHERE hostname = 'compute3'")
+        conn.commit()
+        self.assertEqual(self._count(conn, "workflow_log_entries"), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import unittest
+import tempfile
+import bz2
+import gzip
+import lzma
+import os
+import logging
+
+"""Basic unit tests for compressed and recursive log discovery"""
+
+from wflogger.log_ingestor import LogIngestor, open_log
+from wflogger.discovery import Manifest, discover_logs
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+loglines = """
+Lorem Ipsum WFL_START fred | compute1 | modeler.py | v14.3 | 1 | prep | 0 | 2022-01-01 12:23:04.342912 ||
+Lorem Ipsum WFL_START fred | compute1 | modeler.py | v14.3 | 2 | model | 1 | 2022-01-01 12:23:05.927111 ||
+"""
+
+
+class DiscoveryTests(unittest.TestCase):
+
+    def setUp(self):
+        logging.basicConfig(level=logging.CRITICAL)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.tmp_dir.name, "logs")
+        os.makedirs(os.path.join(self.root, "a", "b"))
+
+        openers = {"a/job1.log": open, "a/job2.log.gz": gzip.open, "a/b/job3.log.bz2": bz2.open,
+                   "job4.log.xz": lzma.open}
+        for name, opener in openers.items():
+            with opener(os.path.join(self.root, name), "wt") as f:
+                f.write(loglines)
+        with open(os.path.join(self.root, "a", "notes.txt"), "w") as f:
+            f.write("not a log")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_open_compressed(self):
+        for path in discover_logs([self.root], "*.log*"):
+            with open_log(path) as f:
+                self.assertEqual(f.read(), loglines)
+
+    @unittest.skipIf(zstandard is None, "zstandard is required to read zstd files")
+    def test_open_zstd(self):
+        path = os.path.join(self.root, "job5.log.zst")
+        with open(path, "wb") as f:
+            f.write(zstandard.ZstdCompressor().compress(loglines.encode()))
+        with open_log(path) as f:
+            self.assertEqual(f.read(), loglines)
+
+    def test_discover_with_manifest(self):
+        manifest_path = os.path.join(self.tmp_dir.name, "manifest.json")
+        ls = LogIngestor(sqlite_database_path=os.path.join(self.tmp_dir.name, "test.db"))
+        ls.prepare_database()
+
+        manifest = Manifest(manifest_path)
+        ls.ingest_logs(discover_logs([self.root], "*.log*", manifest), manifest)
+        manifest.save()
+        self.assertEqual(ls.workflow_logs_table_size(), 8)
+
+        # nothing has changed, so nothing is found
+        manifest = Manifest(manifest_path)
+        self.assertEqual(list(discover_logs([self.root], "*.log*", manifest)), [])
+
+        with open(os.path.join(self.root, "a", "job1.log"), "a") as f:
+            f.write("Lorem Ipsum\n")
+        self.assertEqual(list(discover_logs([self.root], "*.log*", manifest)),
+                         [os.path.join(self.root, "a", "job1.log")])
+
+    def test_resume_grown_file(self):
+        manifest_path = os.path.join(self.tmp_dir.name, "manifest.json")
+        log_path = os.path.join(self.root, "a", "job1.log")
+        ls = LogIngestor(sqlite_database_path=os.path.join(self.tmp_dir.name, "test.db"))
+        ls.prepare_database()
+
+        def run():
+            manifest = Manifest(manifest_path)
+            ls.ingest_logs(discover_logs([self.root], "job1.log", manifest), manifest)
+            manifest.save()
+            return ls.workflow_logs_table_size()
+
+        self.assertEqual(run(), 2)
+
+        # the job is still running: only the new lines are ingested, and a line being written waits
+        with open(log_path, "a") as f:
+            f.write("WFL_START fred | compute1 | modeler.py | v14.3 | 3 | publish | 0 | 2022-01-01 12:24:00.000000 ||\n")
+            f.write("WFL_START fred | compute1 | modeler.py | v14.3 | 4 | end | 0 | 2022-01-01")
+        self.assertEqual(run(), 3)
+        with open(log_path, "a") as f:
+            f.write(" 12:25:00.000000 ||\n")
+        self.assertEqual(run(), 4)
+        self.assertEqual(run(), 4)
+
+        # a file which has been replaced is ingested in full
+        os.remove(log_path)
+        with open(log_path, "w") as f:
+            f.write(loglines)
+        self.assertEqual(run(), 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
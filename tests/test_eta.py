@@ -0,0 +1,178 @@
+import unittest
+import tempfile
+import datetime
+import os
+import logging
+
+"""Basic unit tests for the runtime predictions, using sqlite3"""
+
+from click.testing import CliRunner
+
+from wflogger.backends import SQLiteBackend
+from wflogger.db_mngr import create_db
+from wflogger.wflogger import INSERT_SQL
+from wflogger.credentials import user_id
+from wflogger.eta import prepare_eta, refresh_stage_stats, stage_profile, predict_eta
+from wflogger.cli import main
+
+START = datetime.datetime(2022, 1, 1)
+
+# (stage_number, stage, durations cycled through by iteration)
+STAGES = [(1, "start", [0]), (2, "read", [8, 10, 12]), (3, "model", [50, 60, 70]), (4, "end", [5])]
+
+
+def history(tag, iterations):
+    rows = []
+    for iteration in iterations:
+        date_time = START + datetime.timedelta(hours=iteration)
+        for stage_number, stage, durations in STAGES:
+            date_time += datetime.timedelta(seconds=durations[iteration % len(durations)])
+            rows.append((user_id, "host1", "wf", tag, stage_number, stage, iteration, date_time, "", -999,
+                         None, None, None, None))
+    return rows
+
+
+class ETATests(unittest.TestCase):
+
+    def setUp(self):
+        logging.basicConfig(level=logging.CRITICAL)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, "test.db")
+        self.backend = SQLiteBackend(self.db_path)
+        create_db(self.backend)
+        prepare_eta(self.backend)
+        self.write(history("v1", range(1, 31)))
+
+        # iteration 31 has read its inputs, iteration 32 has only started
+        self.now = START + datetime.timedelta(hours=31, seconds=10 + 20)
+        self.write([(user_id, "host1", "wf", "v1", 1, "start", 31, START + datetime.timedelta(hours=31),
+                     "", -999, None, None, None, None),
+                    (user_id, "host1", "wf", "v1", 2, "read", 31, START + datetime.timedelta(hours=31, seconds=10),
+                     "", -999, None, None, None, None),
+                    (user_id, "host2", "wf", "v1", 1, "start", 32, self.now - datetime.timedelta(minutes=5),
+                     "", -999, None, None, None, None)])
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, rows):
+        conn = self.backend.connect()
+        self.backend.write_records(conn, INSERT_SQL, rows)
+        conn.close()
+
+    def stats(self):
+        conn = self.backend.connect()
+        rows = conn.execute("SELECT tag, stage, n_records, duration_sum, duration_min, duration_max "
+                            "FROM workflow_stage_stats ORDER BY tag, stage_number").fetchall()
+        conn.close()
+        return rows
+
+    def test_refresh(self):
+        self.assertEqual(refresh_stage_stats(self.backend), 123)
+        self.assertEqual(refresh_stage_stats(self.backend), 0)
+        self.assertEqual(self.stats(), [("v1", "read", 31, 310.0, 8.0, 12.0), ("v1", "model", 30, 1800.0, 50.0, 70.0),
+                                        ("v1", "end", 30, 150.0, 5.0, 5.0)])
+
+    def test_incremental_refresh(self):
+        # batches which split iterations, and rows arriving after a refresh, count the same as one full pass
+        refresh_stage_stats(self.backend, batch_size=7)
+        self.write(history("v1", range(33, 36)))
+        self.assertEqual(refresh_stage_stats(self.backend, batch_size=5), 12)
+        incremental = self.stats()
+
+        conn = self.backend.connect()
+        conn.execute("DELETE FROM workflow_stage_stats")
+        conn.execute("DELETE FROM workflow_stage_stats_progress")
+        conn.commit()
+        conn.close()
+        refresh_stage_stats(self.backend)
+        self.assertEqual(incremental, self.stats())
+
+    def insert_id(self, row_id, stage_number, stage, seconds):
+        conn = self.backend.connect()
+        conn.execute("INSERT INTO workflow_logs (id, user_id, hostname, workflow, tag, stage_number, stage, "
+                     "iteration, date_time, flag) VALUES (?, ?, 'host2', 'wf', 'v1', ?, ?, 32, ?, -999)",
+                     (row_id, user_id, stage_number, stage, str(self.now + datetime.timedelta(seconds=seconds))))
+        conn.commit()
+        conn.close()
+
+    def test_refresh_waits_for_missing_ids(self):
+        # id 125 is committed while id 124 is still being written (as can happen on postgres)
+        self.insert_id(125, 3, "model", 60)
+        self.assertEqual(refresh_stage_stats(self.backend, lookback=100), 123)
+        self.insert_id(124, 2, "read", 0)
+        self.assertEqual(refresh_stage_stats(self.backend, lookback=100), 2)
+        self.assertEqual(self.stats()[0][:3], ("v1", "read", 32))
+
+        # ids missing further back than the lookback are given up
+        self.insert_id(127, 4, "end", 65)
+        self.assertEqual(refresh_stage_stats(self.backend, lookback=1), 1)
+
+    def test_refresh_gives_up_missing_ids(self):
+        # id 124 is never committed (its transaction was rolled back)
+        self.insert_id(125, 3, "model", 60)
+        self.assertEqual(refresh_stage_stats(self.backend, lookback=100), 123)
+        self.assertEqual(refresh_stage_stats(self.backend, lookback=100), 0)
+
+        # the gap is given up once the timeout has passed since it was first seen
+        self.assertEqual(refresh_stage_stats(self.backend, lookback=100, gap_timeout=0), 1)
+        conn = self.backend.connect()
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM workflow_stage_stats_gaps").fetchone()[0], 0)
+        conn.close()
+
+    def test_refresh_sqlite_ignores_missing_ids(self):
+        # sqlite commits in id order, so a missing id was rolled back
+        self.insert_id(125, 3, "model", 60)
+        self.assertEqual(refresh_stage_stats(self.backend), 124)
+
+    def test_profile(self):
+        refresh_stage_stats(self.backend)
+        profile = stage_profile("wf", "v1", backend=self.backend)
+        self.assertEqual(list(profile.index), [2, 3, 4])
+        self.assertEqual(round(profile["mean"].sum()), 75)
+        self.assertTrue(50 < profile.loc[3, "p50"] < profile.loc[3, "p90"] <= profile.loc[3, "p99"] <= 70)
+        self.assertEqual(profile.loc[4, "p99"], 5)
+
+        # a tag without history of its own is predicted from the workflow's other tags
+        self.assertEqual(list(stage_profile("wf", "v2", backend=self.backend)["n_records"]), [31, 30, 30])
+
+    def test_predict(self):
+        refresh_stage_stats(self.backend)
+        df = predict_eta("wf", "v1", backend=self.backend, now=self.now).set_index("iteration")
+        self.assertEqual(list(df.index), [31, 32])
+
+        # 20 s into the model stage
+        self.assertEqual(df.loc[31, "next_stage"], "model")
+        self.assertAlmostEqual(df.loc[31, "eta"], 40 + 5)
+        self.assertFalse(df.loc[31, "stuck"])
+
+        # 5 minutes into a read stage which has never taken more than 12 s
+        self.assertEqual(df.loc[32, "next_stage"], "read")
+        self.assertAlmostEqual(df.loc[32, "eta"], 60 + 5)
+        self.assertGreaterEqual(df.loc[32, "eta_p90"], df.loc[32, "eta"])
+        self.assertTrue(df.loc[32, "stuck"])
+
+        self.assertEqual(list(predict_eta("wf", "v1", iterations=[32], backend=self.backend, now=self.now)
+                              ["iteration"]), [32])
+        with self.assertRaises(ValueError):
+            predict_eta("wf", "v1", backend=self.backend, stuck_quantile=0.95)
+
+        # iterations left untouched for longer than max_age_days are abandoned, not stuck
+        later = self.now + datetime.timedelta(days=8)
+        self.assertTrue(predict_eta("wf", "v1", backend=self.backend, now=later).empty)
+        self.assertEqual(list(predict_eta("wf", "v1", backend=self.backend, now=later, max_age_days=None)
+                              ["iteration"]), [31, 32])
+
+    def test_cli(self):
+        result = CliRunner().invoke(main, ["eta", "wf", "v1", "--stuck-only", "--max-age-days", "0",
+                                           "--sqlite-path", self.db_path])
+        self.assertEqual(result.exit_code, 0, result.output)
+        # both in-progress iterations stopped long ago
+        lines = [line for line in result.output.splitlines() if " | " in line]
+        self.assertEqual(len(lines), 3)
+        self.assertEqual([line.split(" | ")[0] for line in lines[1:]], ["31", "32"])
+        self.assertTrue(all(line.endswith("STUCK") for line in lines[1:]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -73,7 +73,7 @@ def test_load_workflows_faking_date_times():
                 comment, flag = "", -999
                 curs.execute(INSERT_SQL, 
                     (user_id, hostname, workflow, tag, stage_number,
-                     stage, iteration, date_time, comment, flag))
+                     stage, iteration, date_time, comment, flag, None, None, None, None))
 
     conn.commit()
     curs.close()
@@ -0,0 +1,51 @@
+import unittest
+import tempfile
+import sqlite3
+import os
+import logging
+
+"""Basic unit tests for the load generator, using a sqlite3 stand-in database"""
+
+from wflogger.loadgen import run_load
+
+
+class LoadGeneratorTests(unittest.TestCase):
+
+    def setUp(self):
+        logging.basicConfig(level=logging.CRITICAL)
+        self.db_path = tempfile.mktemp(suffix=".db")
+
+    def tearDown(self):
+        if os.path.exists(self.db_path):
+            os.remove(self.db_path)
+        self.db_path = None
+
+    def _table_size(self):
+        conn = sqlite3.connect(self.db_path)
+        size = conn.execute("SELECT COUNT(*) FROM workflow_logs").fetchall()[0][0]
+        conn.close()
+        return size
+
+    def test_insert_mode(self):
+        report = run_load(nodes=2, jobs=2, stages=3, iterations=2, sqlite_path=self.db_path)
+        self.assertEqual(report.events, 24)
+        self.assertEqual(report.error_rate, 0)
+        self.assertEqual(sum(count for _, count in report.histogram()), 24)
+        self.assertEqual(self._table_size(), 24)
+
+    def test_ingest_mode(self):
+        report = run_load(nodes=2, jobs=2, stages=3, iterations=2, mode="ingest", sqlite_path=self.db_path)
+        self.assertEqual(report.events, 24)
+        self.assertEqual(len(report.latencies), 4)
+        self.assertEqual(self._table_size(), 24)
+
+    def test_refuses_default_database(self):
+        # the default database is postgres (from the credentials file) unless WFLOGGER_SQLITE_PATH is set
+        if os.environ.get("WFLOGGER_SQLITE_PATH"):
+            self.skipTest("the default database is a SQLite file")
+        with self.assertRaises(ValueError):
+            run_load(nodes=1, jobs=1, stages=1, iterations=1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,6 @@
 import unittest
 import tempfile
+import json
 import os
 import logging
 
@@ -109,5 +110,89 @@ class LogIngestorTests(unittest.TestCase):
         finally:
             os.remove(log_path)
 
+    def test_load_lenient_quarantine_and_reingest(self):
+        try:
+            log_path = tempfile.mktemp(suffix=".log")
+            quarantine_path = tempfile.mktemp(suffix=".jsonl")
+            with open(log_path, "w") as f:
+                f.write(loglines_load_error2)
+            ls = LogIngestor(sqlite_database_path=self.db_path, lenient=True, quarantine_path=quarantine_path)
+            ls.prepare_database()
+            self.assertTrue(ls.ingest_log(log_path))
+            self.assertEqual(ls.workflow_logs_table_size(), 4)
+            self.assertEqual(ls.stats(), (1, 0, 4, 1))
+
+            with open(quarantine_path) as f:
+                records = [json.loads(line) for line in f]
+            self.assertEqual(len(records), 1)
+            self.assertEqual(records[0]["line_nr"], 4)
+            self.assertEqual(records[0]["reason"], "datetime")
+
+            # correct the quarantined line and re-ingest only that line
+            records[0]["line"] = records[0]["line"].replace("202-01-01", "2022-01-01")
+            with open(quarantine_path, "w") as f:
+                f.write(json.dumps(records[0]) + "\n")
+            self.assertEqual(ls.reingest_quarantine(quarantine_path), (1, 0))
+            self.assertEqual(ls.workflow_logs_table_size(), 5)
+            self.assertFalse(os.path.exists(quarantine_path))
+        finally:
+            os.remove(log_path)
+
+    def test_load_lenient4(self):
+        try:
+            log_path = tempfile.mktemp(suffix=".log")
+            quarantine_path = tempfile.mktemp(suffix=".jsonl")
+            with open(log_path, "w") as f:
+                f.write(loglines_load_error4)
+            ls = LogIngestor(sqlite_database_path=self.db_path, lenient=True, quarantine_path=quarantine_path)
+            ls.prepare_database()
+            self.assertTrue(ls.ingest_log(log_path))
+            self.assertEqual(ls.workflow_logs_table_size(), 4)
+
+            # still invalid, so stays in quarantine
+            self.assertEqual(ls.reingest_quarantine(quarantine_path), (0, 1))
+            # the line is counted as rejected once, not again when it is re-ingested
+            self.assertEqual(ls.stats()[3], 1)
+            self.assertTrue(os.path.exists(quarantine_path))
+
+            # rejected lines must go somewhere
+            with self.assertRaises(ValueError):
+                LogIngestor(sqlite_database_path=self.db_path, lenient=True)
+        finally:
+            os.remove(log_path)
+            os.remove(quarantine_path)
+
+    def test_load_lenient_quarantine_after_commit(self):
+        try:
+            log_path = tempfile.mktemp(suffix=".log")
+            quarantine_path = tempfile.mktemp(suffix=".jsonl")
+            with open(log_path, "w") as f:
+                f.write(loglines_load_error2)
+            ls = LogIngestor(sqlite_database_path=self.db_path, lenient=True, quarantine_path=quarantine_path)
+
+            # the table does not exist yet, so nothing is committed and nothing is quarantined
+            with self.assertRaises(Exception):
+                ls.ingest_log(log_path)
+            self.assertFalse(os.path.exists(quarantine_path))
+
+            ls.prepare_database()
+            self.assertTrue(ls.ingest_log(log_path))
+            with open(quarantine_path) as f:
+                self.assertEqual(len(f.readlines()), 1)
+            self.assertEqual(ls.stats()[3], 1)
+
+            # a file whose entries are all rejected has been handled, so it is recorded in a manifest
+            with open(log_path, "w") as f:
+                f.write(loglines_load_error2.splitlines()[3] + "\n")
+            self.assertTrue(ls.ingest_log(log_path))
+            with open(quarantine_path) as f:
+                self.assertEqual(len(f.readlines()), 2)
+            self.assertEqual(ls.workflow_logs_table_size(), 4)
+        finally:
+            os.remove(log_path)
+            if os.path.exists(quarantine_path):
+                os.remove(quarantine_path)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,73 @@
+import unittest
+import tempfile
+import json
+import os
+import logging
+
+"""Basic unit tests for wflogger's self-instrumentation"""
+
+from wflogger.metrics import metrics
+from wflogger.log_ingestor import LogIngestor
+
+loglines = """
+Lorem Ipsum WFL_START fred | compute1 | modeler.py | v14.3 | 1 | prep | 0 | 2022-01-01 12:23:04.342912 ||
+Lorem Ipsum WFL_START fred | compute1 | modeler.py | v14.3 | 2 | model | 1 | 2022-01-01 12:23:05.927111 ||
+"""
+
+loglines_error = """
+WFL_START fred | compute1 | modeler.py | v14.3 | s2 | model | 2 | 2022-01-01 12:25:02.891922 ||
+"""
+
+
+class MetricsTests(unittest.TestCase):
+
+    def setUp(self):
+        logging.basicConfig(level=logging.CRITICAL)
+        metrics.reset()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _write(self, name, content):
+        path = os.path.join(self.tmp_dir.name, name)
+        with open(path, "w") as f:
+            f.write(content)
+        return path
+
+    def test_ingest_metrics(self):
+        ls = LogIngestor(sqlite_database_path=os.path.join(self.tmp_dir.name, "test.db"))
+        ls.prepare_database()
+        self.assertTrue(ls.ingest_log(self._write("ok.log", loglines)))
+        self.assertFalse(ls.ingest_log(self._write("bad.log", loglines_error)))
+
+        snapshot = metrics.snapshot()
+        counters = {name: series[0]["value"] for name, series in snapshot["counters"].items()}
+        self.assertEqual(counters["wflogger_records_inserted_total"], 2)
+        self.assertEqual(counters["wflogger_files_scanned_total"], 2)
+        self.assertEqual(counters["wflogger_lines_scanned_total"], 5)
+        self.assertEqual(counters["wflogger_bytes_scanned_total"], len(loglines) + len(loglines_error))
+        self.assertEqual(snapshot["counters"]["wflogger_parse_errors_total"][0]["labels"], {"reason": "integer"})
+        self.assertEqual(snapshot["histograms"]["wflogger_batch_rows"][0]["count"], 1)
+
+    def test_export(self):
+        metrics.observe("wflogger_insert_seconds", 0.003)
+        metrics.inc("wflogger_parse_errors_total", reason="datetime")
+
+        prom_path = os.path.join(self.tmp_dir.name, "wflogger.prom")
+        metrics.write(prom_path)
+        with open(prom_path) as f:
+            content = f.read()
+        self.assertIn('wflogger_parse_errors_total{reason="datetime"} 1', content)
+        self.assertIn('wflogger_insert_seconds_bucket{le="0.005"} 1', content)
+        self.assertIn('wflogger_insert_seconds_bucket{le="+Inf"} 1', content)
+
+        json_path = os.path.join(self.tmp_dir.name, "wflogger.json")
+        metrics.write(json_path)
+        with open(json_path) as f:
+            snapshot = json.load(f)
+        self.assertEqual(snapshot["histograms"]["wflogger_insert_seconds"][0]["count"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import unittest
+import tempfile
+import sqlite3
+import datetime
+import os
+import logging
+
+"""Basic unit tests for retention, rollup and archival, using sqlite3"""
+
+import pandas as pd
+
+from wflogger.log_ingestor import LogIngestor
+from wflogger.retention import prepare_retention, apply_retention
+from wflogger.backends import SQLiteBackend
+
+try:
+    import pyarrow
+    import pyarrow.parquet as pq
+except ImportError:
+    pyarrow = None
+
+loglines = """
+WFL_START fred | compute1 | modeler.py | v14.3 | 1 | prep | 1 | 2022-01-01 12:00:00.000000 ||
+WFL_START fred | compute1 | modeler.py | v14.3 | 2 | model | 1 | 2022-01-01 12:00:10.000000 ||
+WFL_START fred | compute1 | modeler.py | v14.3 | 1 | prep | 2 | 2022-01-01 12:01:00.000000 ||
+WFL_START fred | compute1 | modeler.py | v14.3 | 2 | model | 2 | 2022-01-01 12:01:30.000000 ||
+WFL_START fred | compute1 | modeler.py | v14.3 | 1 | prep | 3 | 2022-03-01 12:00:00.000000 ||
+WFL_START fred | compute1 | modeler.py | v14.3 | 2 | model | 3 | 2022-03-01 12:00:05.000000 ||
+"""
+
+
+@unittest.skipIf(pyarrow is None, "pyarrow is required to write parquet archives")
+class RetentionTests(unittest.TestCase):
+
+    def setUp(self):
+        logging.basicConfig(level=logging.CRITICAL)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, "test.db")
+        self.archive_dir = os.path.join(self.tmp_dir.name, "archive")
+        log_path = os.path.join(self.tmp_dir.name, "test.log")
+        with open(log_path, "w") as f:
+            f.write(loglines)
+        ls = LogIngestor(sqlite_database_path=self.db_path)
+        ls.prepare_database()
+        ls.ingest_log(log_path)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_retention(self):
+        backend = SQLiteBackend(self.db_path)
+        prepare_retention(backend)
+        now = datetime.datetime(2022, 3, 2)
+        n_deleted, _ = apply_retention(30, self.archive_dir, backend=backend, batch_size=3, now=now)
+        conn = sqlite3.connect(self.db_path)
+        self.assertEqual(n_deleted, 4)
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM workflow_logs").fetchall()[0][0], 2)
+
+        rollups = conn.execute("SELECT stage, n_records, duration_sum, duration_min, duration_max "
+                               "FROM workflow_stage_rollups ORDER BY stage_number").fetchall()
+        self.assertEqual(rollups, [("prep", 2, 0.0, 0.0, 0.0), ("model", 2, 40.0, 10.0, 30.0)])
+
+        archives = os.listdir(self.archive_dir)
+        self.assertEqual(len(archives), 1)
+        archived = pd.read_parquet(os.path.join(self.archive_dir, archives[0]))
+        self.assertEqual(len(archived), 4)
+        self.assertEqual(sorted(archived["iteration"].unique()), [1, 2])
+
+        # nothing left to do on a second run
+        self.assertEqual(apply_retention(30, self.archive_dir, backend=backend, now=now), (0, 0))
+
+    def test_retention_in_chunks(self):
+        backend = SQLiteBackend(self.db_path)
+        prepare_retention(backend)
+        now = datetime.datetime(2022, 3, 2)
+        self.assertEqual(apply_retention(30, self.archive_dir, backend=backend, dry_run=True, now=now), (4, 0))
+
+        # the durations of rows whose iteration started in the previous chunk are still computed
+        n_deleted, _ = apply_retention(30, self.archive_dir, backend=backend, batch_size=3, now=now, chunk_size=1)
+        self.assertEqual(n_deleted, 4)
+        conn = sqlite3.connect(self.db_path)
+        rollups = conn.execute("SELECT stage, n_records, duration_sum FROM workflow_stage_rollups "
+                               "ORDER BY stage_number").fetchall()
+        self.assertEqual(rollups, [("prep", 2, 0.0), ("model", 2, 40.0)])
+
+        archive_path = os.path.join(self.archive_dir, os.listdir(self.archive_dir)[0])
+        self.assertEqual(pq.ParquetFile(archive_path).num_row_groups, 4)
+        self.assertEqual(pd.read_parquet(archive_path)["duration"].tolist(), [0, 10, 0, 30])
+
+
+if __name__ == '__main__':
+    unittest.main()
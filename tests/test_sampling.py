@@ -0,0 +1,77 @@
+import unittest
+import tempfile
+import json
+import os
+import logging
+
+"""Basic unit tests for client-side sampling and pre-aggregation, using sqlite3"""
+
+from wflogger.backends import SQLiteBackend
+from wflogger.db_mngr import create_db
+from wflogger.sampling import SampledLogger, StageAggregator
+from wflogger.analysis import get_summaries, stage_statistics
+from wflogger.wflogger import insert_record
+
+
+class SamplingTests(unittest.TestCase):
+
+    def setUp(self):
+        logging.basicConfig(level=logging.CRITICAL)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.backend = SQLiteBackend(os.path.join(self.tmp_dir.name, "test.db"))
+        create_db(self.backend)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_sampled_logger(self):
+        logger = SampledLogger(sample_every=10, rates={("wf", "v1", "outer"): 1}, backend=self.backend)
+        for iteration in range(1, 101):
+            logger.log("wf", "v1", 1, "outer", iteration)
+            logger.log("wf", "v1", 2, "inner", iteration)
+
+        conn = self.backend.connect()
+        counts = dict(conn.execute("SELECT stage, COUNT(*) FROM workflow_logs GROUP BY stage").fetchall())
+        conn.close()
+        self.assertEqual(counts, {"outer": 100, "inner": 10})
+
+    def test_aggregator(self):
+        with StageAggregator(backend=self.backend) as aggregator:
+            for duration_ns in (1000, 2000, 3000, 2_000_000):
+                aggregator.observe("wf", "v1", 2, "inner", duration_ns)
+            aggregator.observe("wf", "v1", 3, "outer", 5_000_000_000)
+
+        summaries = get_summaries("wf", tag="v1", backend=self.backend).set_index("stage")
+        self.assertEqual(list(summaries["n_records"]), [4, 1])
+        self.assertAlmostEqual(summaries.loc["inner", "duration_sum"], 0.002006)
+        self.assertEqual(summaries.loc["inner", "duration_min"], 1e-6)
+        self.assertEqual(summaries.loc["inner", "duration_max"], 0.002)
+        histogram = json.loads(summaries.loc["inner", "histogram"])
+        self.assertEqual(sum(histogram["counts"]), 4)
+        self.assertEqual(len(histogram["counts"]), len(histogram["le"]) + 1)
+
+    def test_aggregator_interval(self):
+        aggregator = StageAggregator(interval=0, backend=self.backend)
+        aggregator.observe("wf", "v1", 2, "inner", 1000)
+        aggregator.observe("wf", "v1", 2, "inner", 1000)
+        self.assertEqual(aggregator.flush(), 0)
+        self.assertEqual(len(get_summaries("wf", backend=self.backend)), 2)
+
+    def test_stage_statistics(self):
+        insert_record("wf", "v1", 1, "start", 1, date_time="2022-01-01 12:00:00", backend=self.backend)
+        insert_record("wf", "v1", 2, "inner", 1, date_time="2022-01-01 12:00:03", backend=self.backend)
+        with StageAggregator(backend=self.backend) as aggregator:
+            aggregator.observe("wf", "v1", 2, "inner", 1_000_000_000)
+            aggregator.observe("wf", "v1", 2, "inner", 2_000_000_000)
+
+        stats = stage_statistics("wf", tag="v1", backend=self.backend).set_index("stage")
+        self.assertEqual(stats.loc["inner", "n_records"], 3)
+        self.assertEqual(stats.loc["inner", "duration_sum"], 6)
+        self.assertEqual(stats.loc["inner", "duration_min"], 1)
+        self.assertEqual(stats.loc["inner", "duration_max"], 3)
+        self.assertEqual(stats.loc["inner", "duration_mean"], 2)
+        self.assertEqual(stats.loc["start", "n_records"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,139 @@
+import unittest
+import tempfile
+import sqlite3
+import zlib
+import datetime
+import os
+import logging
+
+"""Basic unit tests for hash-sharded storage, using several sqlite3 files as the shards"""
+
+from wflogger.backends import SQLiteBackend
+from wflogger.sharding import ShardedBackend, load_shards, shard_index
+from wflogger.db_mngr import create_db, upgrade_db
+from wflogger.wflogger import insert_record
+from wflogger.log_ingestor import LogIngestor
+from wflogger.batch import read_batch, write_batch
+from wflogger.analysis import get_results
+from wflogger.credentials import user_id
+from wflogger.retention import prepare_retention, apply_retention
+from wflogger.tail import LogTail, prepare_tail
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+WORKFLOWS = ["wf-%d" % i for i in range(8)]
+
+
+class ShardingTests(unittest.TestCase):
+
+    def setUp(self):
+        logging.basicConfig(level=logging.CRITICAL)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.paths = [os.path.join(self.tmp_dir.name, "shard%d.db" % i) for i in range(3)]
+        self.backend = ShardedBackend([SQLiteBackend(path) for path in self.paths])
+        create_db(self.backend)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _shard_workflows(self, index):
+        conn = sqlite3.connect(self.paths[index])
+        workflows = set(row[0] for row in conn.execute("SELECT workflow FROM workflow_logs"))
+        conn.close()
+        return workflows
+
+    def _assert_routed(self):
+        for index in range(len(self.paths)):
+            for workflow in self._shard_workflows(index):
+                self.assertEqual(shard_index(workflow, 3), index)
+
+    def test_shard_index(self):
+        self.assertEqual(shard_index("wf-0", 3), zlib.crc32(b"wf-0") % 3)
+        # the workflows used here are spread over every shard
+        self.assertEqual(set(shard_index(workflow, 3) for workflow in WORKFLOWS), {0, 1, 2})
+
+    def test_load_shards(self):
+        shards_path = os.path.join(self.tmp_dir.name, "shards")
+        with open(shards_path, "w") as f:
+            f.write("# shards\nsqlite:%s\n\nsqlite:%s\n" % tuple(self.paths[:2]))
+        self.assertEqual([shard.path for shard in load_shards(shards_path)], self.paths[:2])
+
+    def test_insert_and_federate(self):
+        for workflow in WORKFLOWS:
+            insert_record(workflow, "v1", 1, "start", 1, date_time="2022-01-01 12:00:00", backend=self.backend)
+            insert_record(workflow, "v1", 2, "end", 1, date_time="2022-01-01 12:00:02", backend=self.backend)
+        self._assert_routed()
+
+        self.assertIs(self.backend.for_workflow("wf-3"), self.backend.shards[shard_index("wf-3", 3)])
+        self.assertIs(self.backend.for_workflow(None), self.backend)
+        df = get_results("wf-3", tag="v1", backend=self.backend)
+        self.assertEqual(list(df["duration"]), [0, 2])
+
+        df = get_results(None, tag="v1", backend=self.backend)
+        self.assertEqual(len(df), 16)
+        self.assertEqual(sorted(df["workflow"].unique()), WORKFLOWS)
+
+    def test_ingest_and_batch(self):
+        log_path = os.path.join(self.tmp_dir.name, "test.log")
+        with open(log_path, "w") as f:
+            for workflow in WORKFLOWS:
+                f.write(f"WFL_START {user_id} | compute1 | {workflow} | v1 | 1 | start | 1 | "
+                        f"2022-01-01 12:00:00.000000 ||\n")
+        ls = LogIngestor(backend=self.backend)
+        self.assertTrue(ls.ingest_log(log_path))
+        self.assertEqual(ls.workflow_logs_table_size(), 8)
+
+        rows, errors = read_batch([f"{workflow} | v1 | 2 | end | 1" for workflow in WORKFLOWS], "text", False)
+        self.assertEqual(write_batch(rows, backend=self.backend), 8)
+        self.assertEqual(ls.workflow_logs_table_size(), 16)
+        self._assert_routed()
+
+        with self.assertRaises(ValueError):
+            LogIngestor(backend=self.backend, compact_schema=True)
+
+    @unittest.skipIf(pyarrow is None, "pyarrow is required to write parquet archives")
+    def test_retention(self):
+        # the ids of the shards overlap, so each shard must only delete its own old rows
+        for workflow in WORKFLOWS:
+            insert_record(workflow, "v1", 1, "start", 1, date_time="2022-01-01 12:00:00", backend=self.backend)
+            insert_record(workflow, "v1", 2, "end", 1, date_time="2022-01-01 12:00:02", backend=self.backend)
+            insert_record(workflow, "v1", 1, "start", 2, date_time="2022-03-01 12:00:00", backend=self.backend)
+
+        prepare_retention(self.backend)
+        archive_dir = os.path.join(self.tmp_dir.name, "archive")
+        now = datetime.datetime(2022, 3, 2)
+        self.assertEqual(apply_retention(30, archive_dir, backend=self.backend, dry_run=True, now=now), (16, 0))
+        self.assertEqual(apply_retention(30, archive_dir, backend=self.backend, now=now), (16, 16))
+        self.assertEqual(len(os.listdir(archive_dir)), 8)
+
+        for index, path in enumerate(self.paths):
+            conn = sqlite3.connect(path)
+            remaining = conn.execute("SELECT workflow, iteration FROM workflow_logs ORDER BY workflow").fetchall()
+            rollups = conn.execute("SELECT DISTINCT workflow FROM workflow_stage_rollups ORDER BY workflow").fetchall()
+            conn.close()
+            workflows = sorted(workflow for workflow in WORKFLOWS if shard_index(workflow, 3) == index)
+            self.assertEqual(remaining, [(workflow, 2) for workflow in workflows])
+            self.assertEqual([row[0] for row in rollups], workflows)
+
+    def test_tail_refused(self):
+        with self.assertRaises(ValueError):
+            LogTail(backend=self.backend)
+        with self.assertRaises(ValueError):
+            prepare_tail(self.backend)
+
+    def test_upgrade(self):
+        self.assertEqual(upgrade_db(self.backend), [])
+
+    def test_mixed_dialects(self):
+        class OtherBackend(SQLiteBackend):
+            dialect = "postgres"
+
+        with self.assertRaises(ValueError):
+            ShardedBackend([SQLiteBackend(self.paths[0]), OtherBackend(self.paths[1])])
+
+
+if __name__ == '__main__':
+    unittest.main()
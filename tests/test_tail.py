@@ -0,0 +1,97 @@
+import unittest
+import tempfile
+import os
+import logging
+
+"""Basic unit tests for following new workflow log rows, using sqlite3"""
+
+from wflogger.backends import SQLiteBackend
+from wflogger.db_mngr import create_db, create_compact_schema
+from wflogger.tail import LogTail, tail
+from wflogger.wflogger import insert_record
+
+
+class LogTailTests(unittest.TestCase):
+
+    def setUp(self):
+        logging.basicConfig(level=logging.CRITICAL)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.backend = SQLiteBackend(os.path.join(self.tmp_dir.name, "test.db"))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def insert(self, tag, stage_number, stage):
+        insert_record("my-workflow", tag, stage_number, stage, 1, backend=self.backend)
+
+    def test_poll(self):
+        create_db(self.backend)
+        self.insert("v1", 1, "start")
+
+        log_tail = LogTail("my-workflow", tag="v1", backend=self.backend)
+        self.assertEqual(log_tail.poll(), [])
+
+        self.insert("v1", 2, "model")
+        self.insert("v2", 2, "model")
+        self.insert("v1", 3, "end")
+        self.assertEqual([(row["stage_number"], row["stage"]) for row in log_tail.poll()],
+                         [(2, "model"), (3, "end")])
+        self.assertEqual(log_tail.poll(), [])
+
+        # rows which do not match the filter still advance the high-water mark
+        self.insert("v2", 3, "end")
+        self.assertEqual(log_tail.poll(), [])
+        self.assertEqual(log_tail.high_water, 5)
+        log_tail.close()
+
+    def insert_id(self, row_id, stage_number, stage):
+        conn = self.backend.connect()
+        conn.execute("INSERT INTO workflow_logs (id, user_id, hostname, workflow, tag, stage_number, stage) "
+                     "VALUES (?, 'fred', 'compute1', 'my-workflow', 'v1', ?, ?)", (row_id, stage_number, stage))
+        conn.commit()
+        conn.close()
+
+    def test_late_commit(self):
+        create_db(self.backend)
+        self.insert("v1", 1, "start")
+        log_tail = LogTail("my-workflow", user_id=None, backend=self.backend)
+
+        # id 3 is committed while id 2 is still being written (as can happen on postgres)
+        self.insert_id(3, 3, "end")
+        self.assertEqual([row["id"] for row in log_tail.poll()], [3])
+        self.assertEqual(list(log_tail.gaps), [2])
+        self.insert_id(2, 2, "model")
+        self.assertEqual([row["id"] for row in log_tail.poll()], [2])
+        self.assertEqual(log_tail.gaps, {})
+        self.assertEqual(log_tail.poll(), [])
+
+        # ids which never appear (e.g. rolled back) are given up after the gap timeout
+        self.insert_id(6, 4, "publish")
+        self.assertEqual([row["id"] for row in log_tail.poll()], [6])
+        self.assertEqual(sorted(log_tail.gaps), [4, 5])
+        log_tail.gaps = {gap: 0 for gap in log_tail.gaps}
+        self.insert("v1", 5, "end")
+        self.assertEqual([row["id"] for row in log_tail.poll()], [7])
+        self.assertEqual(log_tail.gaps, {})
+        log_tail.close()
+
+    def test_from_id_compact(self):
+        create_compact_schema(self.backend)
+        self.insert("v1", 1, "start")
+        self.insert("v1", 2, "model")
+
+        log_tail = LogTail("my-workflow", stage="model", backend=self.backend, compact_schema=True, from_id=0)
+        self.assertEqual([row["id"] for row in log_tail.poll()], [2])
+        log_tail.close()
+
+    def test_iterator(self):
+        create_db(self.backend)
+        rows = tail("my-workflow", backend=self.backend, poll_interval=0.01)
+        self.insert("v1", 1, "start")
+        self.assertEqual(next(rows)["stage"], "start")
+        self.insert("v1", 2, "model")
+        self.assertEqual(next(rows)["stage"], "model")
+
+
+if __name__ == "__main__":
+    unittest.main()
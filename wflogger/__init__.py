@@ -5,5 +5,15 @@ __contact__ = 'ag.stephens@stfc.ac.uk'
 __copyright__ = "Copyright 2020 United Kingdom Research and Innovation"
 __license__ = "BSD - see LICENSE file in top-level package directory"
 
-from .wflogger import insert_record
+from .wflogger import insert_record, timed_stage
 
+
+_AIO_NAMES = ("alog", "aflush", "aclose", "AsyncLogSession")
+
+
+def __getattr__(name):
+    # asyncio is slow to import, so only load the asyncio API when it is used
+    if name in _AIO_NAMES:
+        from . import aio
+        return getattr(aio, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
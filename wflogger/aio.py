@@ -0,0 +1,247 @@
+"""
+Asyncio API for logging from async workflows
+
+Records are buffered in memory and written in batches by a background task, so logging never
+blocks the event loop on a database round trip:
+
+    async with AsyncLogSession() as session:
+        await session.log("my-workflow", "v1", 1, "start", iteration)
+
+or, using a shared session for the running event loop:
+
+    await wflogger.alog("my-workflow", "v1", 1, "start", iteration)
+    ...
+    await wflogger.aclose()
+
+The database driver calls (psycopg2 or sqlite3) are blocking, so the session keeps one persistent
+connection on a dedicated worker thread and hands each batch to that thread.
+
+A session which is not closed before its event loop shuts down (e.g. at the end of asyncio.run)
+writes the records still buffered when its background task is cancelled, and logs a warning.
+"""
+
+import asyncio
+import datetime as dt
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from dateutil import parser
+
+from .backends import get_backend
+from .credentials import user_id, hostname
+from .metrics import metrics
+from .wflogger import INSERT_SQL, DEFAULT_FLAG
+
+logger = logging.getLogger("AsyncLogSession")
+
+
+class AsyncLogSession:
+    """Buffers workflow log records and writes them in batches from a background task"""
+
+    def __init__(self, backend=None, max_batch=1000, max_queue=100000):
+        """
+        Constructor
+
+        :param backend: write to this wflogger.backends.Backend, defaults to get_backend()
+        :param max_batch: maximum number of records written per transaction
+        :param max_queue: maximum number of buffered records, after which log() waits for space
+        """
+        self.backend = backend or get_backend()
+        self.max_batch = max_batch
+        self.max_queue = max_queue
+        # created by start(), as before python 3.10 a queue binds to the event loop current when it is created
+        self.queue = None
+        self.error = None
+        self._executor = None
+        self._conn = None
+        self._task = None
+        self._starting = None
+        self._closing = False
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def start(self):
+        """Connect to the database and start the background writer"""
+        if self._task is not None:
+            return
+        if self._starting is not None:
+            # another task is starting the session, retry if that fails
+            await self._starting
+            return await self.start()
+
+        loop = asyncio.get_running_loop()
+        self._starting = loop.create_future()
+        try:
+            # a single thread, so that the connection is only ever used from the thread that created it
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="wflogger-aio")
+            self._conn = await self._run(self.backend.connect)
+            self.queue = asyncio.Queue(maxsize=self.max_queue)
+            self._closing = False
+            self._task = loop.create_task(self._writer())
+            # let the writer start, so that it handles being cancelled when the loop shuts down
+            await asyncio.sleep(0)
+        finally:
+            self._starting.set_result(None)
+            self._starting = None
+
+    async def log(self, workflow, tag, stage_number, stage, iteration=0,
+                  date_time=None, comment="", flag=DEFAULT_FLAG, duration_ns=None,
+                  work_bytes=None, work_files=None, work_items=None):
+        """
+        Buffer a record, taking its date-time now (unless given)
+
+        Arguments are as for wflogger.insert_record.
+        """
+        if self._task is None:
+            await self.start()
+
+        if date_time:
+            date_time = parser.parse(date_time) if isinstance(date_time, str) else date_time
+        else:
+            date_time = dt.datetime.now()
+
+        await self.queue.put((user_id, hostname, workflow, tag, stage_number,
+                              stage, iteration, date_time, comment, flag, duration_ns,
+                              work_bytes, work_files, work_items))
+
+    def _targets(self, batch):
+        """
+        :return: list of (backend, connection, rows), one per shard written to by a sharded backend
+        """
+        if hasattr(self.backend, "partition"):
+            return [(self.backend.shards[index], self._conn.shard(index), rows)
+                    for index, rows in self.backend.partition(batch).items()]
+        return [(self.backend, self._conn, batch)]
+
+    def _write(self, batch):
+        """
+        Write a batch in one transaction (per shard). If that fails, write its rows one at a time,
+        so that a bad record only loses itself and not the rest of its batch.
+
+        :return: the last exception raised writing a row, or None
+        """
+        error = None
+        for backend, conn, rows in self._targets(batch):
+            try:
+                backend.write_records(conn, INSERT_SQL, rows)
+                continue
+            except Exception:
+                conn.rollback()
+            for row in rows:
+                try:
+                    backend.write_records(conn, INSERT_SQL, [row])
+                except Exception as ex:
+                    logger.exception("Failed to write workflow log record %r" % (row,))
+                    metrics.inc("wflogger_async_write_errors_total")
+                    conn.rollback()
+                    error = ex
+        return error
+
+    async def _write_batch(self, batch):
+        future = asyncio.get_running_loop().run_in_executor(self._executor, self._write, batch)
+        try:
+            error = await asyncio.shield(future)
+            if error is not None:
+                self.error = error
+        except asyncio.CancelledError:
+            # cancelling the executor's future would drop the batch if it has not started yet
+            await future
+            raise
+        except Exception as ex:
+            logger.exception("Failed to write %d workflow log records" % len(batch))
+            metrics.inc("wflogger_async_write_errors_total")
+            self.error = ex
+        finally:
+            for _ in batch:
+                self.queue.task_done()
+
+    async def _writer(self):
+        try:
+            while True:
+                batch = [await self.queue.get()]
+                while len(batch) < self.max_batch and not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                await self._write_batch(batch)
+        except asyncio.CancelledError:
+            if self._closing:
+                raise
+            # the event loop is shutting down without the session having been closed
+            batch = []
+            while not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            logger.warning("The session was not closed before its event loop shut down, so its buffered records "
+                           "are written as it stops (close the session, or call aclose(), to write them sooner)")
+            if batch:
+                await self._write_batch(batch)
+            await self._run(self._conn.close)
+            self._executor.shutdown()
+            self._task = None
+            raise
+
+    async def flush(self):
+        """
+        Wait until all buffered records have been written
+
+        :raises the last exception raised while writing records, if any (only the records which
+                failed are lost)
+        """
+        if self.queue is not None:
+            await self.queue.join()
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error.with_traceback(None)
+
+    async def close(self):
+        """Flush the buffered records, then stop the background writer and close the connection"""
+        if self._task is None:
+            return
+        try:
+            await self.flush()
+        finally:
+            self._closing = True
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            await self._run(self._conn.close)
+            self._executor.shutdown()
+            self._task = None
+
+
+_sessions = {}
+
+
+def _default_session():
+    loop = asyncio.get_running_loop()
+    if loop not in _sessions:
+        _sessions[loop] = AsyncLogSession()
+    return _sessions[loop]
+
+
+async def alog(workflow, tag, stage_number, stage, iteration=0,
+               date_time=None, comment="", flag=DEFAULT_FLAG, duration_ns=None,
+               work_bytes=None, work_files=None, work_items=None):
+    """Buffer a record in the shared session of the running event loop, see AsyncLogSession.log"""
+    await _default_session().log(workflow, tag, stage_number, stage, iteration, date_time, comment, flag,
+                                 duration_ns, work_bytes, work_files, work_items)
+
+
+async def aflush():
+    """Wait until all records buffered in the shared session have been written"""
+    await _default_session().flush()
+
+
+async def aclose():
+    """Flush and close the shared session of the running event loop"""
+    session = _sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None:
+        await session.close()
@@ -1,9 +1,21 @@
+import logging
+
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 
-from .credentials import creds, user_id
+from .backends import get_backend
+from .credentials import user_id
 from .wflogger import DEFAULT_ITERATION, DEFAULT_FLAG
 
+logger = logging.getLogger("analysis")
+
+# repeated strings, stored as categoricals by optimise_dtypes
+CATEGORY_COLUMNS = ["user_id", "hostname", "workflow", "tag", "stage", "comment"]
+
+# integer columns, downcast to the smallest integer type which holds their values by optimise_dtypes
+INTEGER_COLUMNS = ["id", "stage_number", "iteration", "flag"]
+
 
 def _get_select_statement(workflow, tag=None, stage_number=None, stage=None, iteration=None,
                           user_id=user_id, hostname=None, comment="", flag=DEFAULT_FLAG):
@@ -23,18 +35,134 @@ def _get_select_statement(workflow, tag=None, stage_number=None, stage=None, ite
 
 
 def get_results(workflow, tag=None, stage_number=None, stage=None, iteration=None,
-                hostname=None, comment="", flag=DEFAULT_FLAG):
-    creds_dict = dict([item.split("=") for item in creds.split()])
-
-    pg_url = "postgresql://{user}:{password}@{host}:{port}/{dbname}" \
-             .format(**creds_dict)
+                hostname=None, comment="", flag=DEFAULT_FLAG, backend=None,
+                compact_dtypes=True, float32=False, arrow=False):
+    backend = backend or get_backend()
 
     query = _get_select_statement(workflow, tag=tag, stage_number=stage_number, stage=stage, iteration=iteration,
                                   hostname=hostname, comment=comment, flag=flag)
-    df = pd.read_sql(query, pg_url)
-    
+    # a sharded backend reads only the shard holding the workflow (or every shard in parallel)
+    df = backend.for_workflow(workflow).read_sql(query, parse_dates=["date_time"])
+    if compact_dtypes:
+        df = optimise_dtypes(df)
+
     # Add duration column
-    return add_duration_column(df)
+    df = add_duration_column(df)
+    if float32 or arrow:
+        df = optimise_dtypes(df, float32=float32, arrow=arrow)
+
+    logger.info("Using %.1f MB for %d records." % (memory_usage_mb(df), len(df)))
+    return df
+
+
+def optimise_dtypes(df, float32=False, arrow=False):
+    """
+    Convert the columns of a DataFrame of workflow log rows to compact dtypes
+
+    :param df: pandas.DataFrame, e.g. as read from the workflow_logs table
+    :param float32: store the duration column as 32-bit floats
+    :param arrow: store the columns (other than the categoricals) as Arrow arrays, requires pyarrow
+        and pandas 2.0 or later
+    :return: pandas.DataFrame (the original is not modified)
+    """
+    df = df.copy(deep=False)
+
+    for column in CATEGORY_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column].astype("category")
+
+    for column in INTEGER_COLUMNS:
+        if column in df.columns and pd.api.types.is_integer_dtype(df[column]):
+            df[column] = pd.to_numeric(df[column], downcast="integer")
+
+    if float32 and "duration" in df.columns:
+        df["duration"] = df["duration"].astype("float32")
+
+    if arrow:
+        if not hasattr(pd, "ArrowDtype"):
+            raise ImportError(f"Arrow-backed columns require pandas 2.0 or later (found {pd.__version__})")
+        import pyarrow as pa
+
+        # convert_dtypes would turn durations which happen to be whole numbers into integers
+        if "duration" in df.columns:
+            df["duration"] = df["duration"].astype(pd.ArrowDtype(pa.from_numpy_dtype(df["duration"].dtype)))
+        df = df.convert_dtypes(dtype_backend="pyarrow")
+
+    return df
+
+
+def memory_usage_mb(df):
+    """
+    :param df: pandas.DataFrame
+    :return: the memory used by the DataFrame (including the contents of strings) in MB
+    """
+    return df.memory_usage(deep=True).sum() / 1e6
+
+
+def _get_summaries_statement(workflow, tag=None, stage_number=None, stage=None,
+                             user_id=user_id, hostname=None):
+    query = f"SELECT * FROM workflow_log_summaries WHERE user_id = '{user_id}'"
+
+    for str_arg in "workflow tag stage hostname".split():
+        value = eval(str_arg)
+        if value is not None:
+            query += f" AND {str_arg} = '{value}'"
+
+    if stage_number is not None:
+        query += f" AND stage_number = {stage_number}"
+
+    return f"{query} ;"
+
+
+def get_summaries(workflow, tag=None, stage_number=None, stage=None, hostname=None, backend=None):
+    """
+    Get the summary rows written by sampling.StageAggregator
+
+    :return: pandas.DataFrame of workflow_log_summaries rows
+    """
+    backend = backend or get_backend()
+
+    query = _get_summaries_statement(workflow, tag=tag, stage_number=stage_number, stage=stage,
+                                     hostname=hostname)
+    return backend.for_workflow(workflow).read_sql(query, parse_dates=["start_time", "end_time"])
+
+
+def combine_stage_statistics(df, summaries=None):
+    """
+    Compute the duration statistics of each stage from raw rows and (optionally) summary rows
+
+    :param df: pandas.DataFrame of workflow_logs rows, including a duration column
+    :param summaries: pandas.DataFrame of workflow_log_summaries rows
+    :return: pandas.DataFrame with one row per stage_number/stage and the columns n_records,
+             duration_sum, duration_min, duration_max and duration_mean (in seconds)
+    """
+    stats = df.groupby(["stage_number", "stage"], observed=True)["duration"].agg(
+        n_records="size", duration_sum="sum", duration_min="min", duration_max="max")
+
+    if summaries is not None and len(summaries):
+        summary_stats = summaries.groupby(["stage_number", "stage"]).agg(
+            n_records=("n_records", "sum"), duration_sum=("duration_sum", "sum"),
+            duration_min=("duration_min", "min"), duration_max=("duration_max", "max"))
+        stats = pd.concat([stats, summary_stats]).groupby(level=["stage_number", "stage"]).agg(
+            {"n_records": "sum", "duration_sum": "sum", "duration_min": "min", "duration_max": "max"})
+
+    stats["duration_mean"] = stats["duration_sum"] / stats["n_records"]
+    return stats.reset_index()
+
+
+def stage_statistics(workflow, tag=None, stage_number=None, stage=None, hostname=None,
+                     comment="", flag=DEFAULT_FLAG, backend=None):
+    """
+    Get the duration statistics of each stage, combining the raw workflow_logs rows with the
+    summary rows written by sampling.StageAggregator
+
+    :return: pandas.DataFrame, see combine_stage_statistics
+    """
+    df = get_results(workflow, tag=tag, stage_number=stage_number, stage=stage, hostname=hostname,
+                     comment=comment, flag=flag, backend=backend)
+    summaries = get_summaries(workflow, tag=tag, stage_number=stage_number, stage=stage,
+                              hostname=hostname, backend=backend)
+    return combine_stage_statistics(df, summaries)
 
 
 def rows_match(row1, row2, compare_columns=None):
@@ -47,23 +175,104 @@ def rows_match(row1, row2, compare_columns=None):
 def add_duration_column(df, sort_by=None):
     if sort_by is None:
         sort_by = ["iteration", "stage_number"]
-        
-    previous_row = None
-    new_rows = []
-    
-    for i, row in df.sort_values(sort_by).iterrows():
 
-        if previous_row is not None and rows_match(previous_row, row):
-            duration = (row["date_time"] - previous_row["date_time"]).total_seconds()
+    df = df.sort_values(sort_by, kind="stable").reset_index(drop=True)
+
+    # a row's duration is the time since the previous row, if that row is of the same job (see rows_match)
+    compare_columns = ["user_id", "hostname", "workflow", "tag", "iteration"]
+    same_job = (df[compare_columns] == df[compare_columns].shift()).all(axis=1)
+    duration = df["date_time"].diff().dt.total_seconds().where(same_job, 0.0)
+
+    # prefer the durations measured by the clients (with a monotonic clock), where they were recorded
+    if "duration_ns" in df.columns and df["duration_ns"].notnull().any():
+        duration = (pd.to_numeric(df["duration_ns"]) / 1e9).fillna(duration)
+
+    df["duration"] = duration
+    print(f"Converted {len(df)} records.")
+    return df
+
+
+# work counter columns, and the name and scale (to MB, files or items) of the throughput of each
+WORK_COLUMNS = {
+    "work_bytes": ("mb_per_s", 1e-6),
+    "work_files": ("files_per_s", 1),
+    "work_items": ("items_per_s", 1),
+}
+
+
+def add_throughput_columns(df):
+    """
+    Add the throughput of each row (mb_per_s, files_per_s and items_per_s) from its work counters
+
+    Rows without a work counter, or without a (positive) duration, have a throughput of NaN.
+
+    :param df: pandas.DataFrame of workflow_logs rows, including a duration column
+    :return: pandas.DataFrame (the original is not modified)
+    """
+    df = df.copy(deep=False)
+    duration = df["duration"].astype("float64")
+    duration = duration.where(duration > 0)
+
+    for column, (rate, scale) in WORK_COLUMNS.items():
+        if column in df.columns:
+            df[rate] = pd.to_numeric(df[column]).astype("float64") * scale / duration
+
+    return df
+
+
+def stage_throughput(df, by=("tag",)):
+    """
+    Compute the overall throughput of each stage: the total work divided by the total duration of
+    the rows which recorded that work
+
+    :param df: pandas.DataFrame of workflow_logs rows, including a duration column
+    :param by: further columns to group by, e.g. ("tag",) or ("tag", "hostname")
+    :return: pandas.DataFrame with one row per group and stage, and the columns n_records and
+             mb_per_s, files_per_s and items_per_s (for the work counters that were recorded)
+    """
+    keys = list(by) + ["stage_number", "stage"]
+    duration = df["duration"].astype("float64")
+    columns = {"n_records": duration.groupby([df[key] for key in keys], observed=True).size()}
+
+    for column, (rate, scale) in WORK_COLUMNS.items():
+        if column in df.columns and df[column].notnull().any():
+            work = pd.to_numeric(df[column]).astype("float64")
+            grouped = pd.DataFrame({"work": work, "duration": duration.where(work.notnull())}) \
+                .groupby([df[key] for key in keys], observed=True).sum()
+            columns[rate] = grouped["work"] * scale / grouped["duration"].where(grouped["duration"] > 0)
+
+    return pd.DataFrame(columns).reset_index()
+
+
+def fit_scaling(df, stage_number, work="work_bytes", by="tag"):
+    """
+    Fit duration = overhead + work / throughput to the rows of one stage, per group
+
+    This is the scaling curve used to size allocations: the expected duration of the stage for a
+    given amount of work.
+
+    :param df: pandas.DataFrame of workflow_logs rows, including a duration column
+    :param stage_number: the stage to fit
+    :param work: the work counter column, one of WORK_COLUMNS
+    :param by: the column to group by, e.g. "tag" or "hostname"
+    :return: pandas.DataFrame with one row per group and the columns n_records, overhead (s) and
+             the throughput (e.g. mb_per_s, NaN if the duration does not grow with the work)
+    """
+    rate, scale = WORK_COLUMNS[work]
+    rows = df[(df["stage_number"] == stage_number) & df[work].notnull()]
+    fits = []
+
+    for key, grp in rows.groupby(by, observed=True):
+        x = pd.to_numeric(grp[work]).astype("float64").to_numpy() * scale
+        y = grp["duration"].astype("float64").to_numpy()
+        if len(grp) > 1 and x.min() < x.max():
+            slope, overhead = np.polyfit(x, y, 1)
         else:
-            duration = 0
-            
-        previous_row = row.copy()
-        row["duration"] = duration
-        new_rows.append(row)
-        
-    print(f"Converted {len(new_rows)} records.")
-    return pd.DataFrame(new_rows, columns=list(df.columns) + ["duration"]).reset_index(drop=True)
+            slope, overhead = float("nan"), float("nan")
+        fits.append({by: key, "n_records": len(grp), "overhead": overhead,
+                     rate: 1 / slope if slope > 0 else float("nan")})
+
+    return pd.DataFrame(fits, columns=[by, "n_records", "overhead", rate])
 
 
 def get_stage_numbers(df):
@@ -148,3 +357,39 @@ def plot_bar_chart_comparing_tags(df1, df2, legend_position=None):
     if legend_position:
         ax.legend(loc=legend_position)
 
+
+def plot_throughput_by_iteration(df, rate="mb_per_s"):
+    df = add_throughput_columns(df)
+    fig, ax = plt.subplots(figsize=(9, 6))
+
+    for (stage_number, stage), grp in df[df[rate].notnull()].groupby(["stage_number", "stage"], observed=True):
+        ax.plot(grp["iteration"], grp[rate], marker=".", label=f"{stage_number:02d}: {stage}")
+
+    ax.legend()
+    ax.set_ylabel({"mb_per_s": "MB/s", "files_per_s": "Files/s", "items_per_s": "Items/s"}[rate])
+    ax.set_xlabel("Iteration")
+
+    r1 = df.iloc[0]
+    plt.title(f"{r1.workflow} - {r1.tag} - Throughput per stage by iteration")
+    plt.show()
+
+
+def plot_scaling_curve(df, stage_number, work="work_bytes", by="tag"):
+    rate, scale = WORK_COLUMNS[work]
+    fits = fit_scaling(df, stage_number, work=work, by=by).set_index(by)
+    rows = df[(df["stage_number"] == stage_number) & df[work].notnull()]
+    fig, ax = plt.subplots(figsize=(9, 6))
+
+    for key, grp in rows.groupby(by, observed=True):
+        x = pd.to_numeric(grp[work]).astype("float64") * scale
+        points = ax.scatter(x, grp["duration"], label=f"{key}: {fits.loc[key, rate]:.3g} {rate}")
+        x_fit = np.array([0, x.max()])
+        ax.plot(x_fit, fits.loc[key, "overhead"] + x_fit / fits.loc[key, rate], color=points.get_facecolor()[0])
+
+    ax.legend()
+    ax.set_ylabel("Duration (s)")
+    ax.set_xlabel({"work_bytes": "MB", "work_files": "Files", "work_items": "Items"}[work])
+
+    r1 = rows.iloc[0]
+    plt.title(f"{r1.workflow} - {r1.stage_number:02d}: {r1.stage} - Duration by work done")
+    plt.show()
@@ -0,0 +1,348 @@
+"""
+Storage backends for the workflow logs
+
+A backend knows how to connect to a database and how to adapt the (postgres-flavoured) SQL used
+throughout wflogger to its dialect. All of insert_record, the LogIngestor, db_mngr and
+analysis.get_results go through a backend, so the full log -> ingest -> analyse cycle can run
+either against the shared postgres database or against a local SQLite file.
+
+The default backend is chosen by get_backend():
+    - a SQLite database, if a path is given or the environment variable WFLOGGER_SQLITE_PATH is set
+    - several databases sharded by workflow (see wflogger.sharding), if the environment variable
+      WFLOGGER_SHARDS names a shards file
+    - otherwise the postgres database described by the credentials file ($HOME/.wflogger)
+"""
+
+import functools
+import os
+import re
+import sqlite3
+import threading
+
+from .metrics import metrics
+
+SQLITE_PATH_ENV_VAR = "WFLOGGER_SQLITE_PATH"
+
+SHARDS_ENV_VAR = "WFLOGGER_SHARDS"
+
+# number of rows written per transaction by write_records
+DEFAULT_BATCH_SIZE = 10000
+
+CREATE_INDEX_SQL = "CREATE INDEX {concurrently}IF NOT EXISTS {name} ON {table} ({columns});"
+
+# the columns added to workflow_logs since the original schema (see db_mngr.OPTIONAL_COLUMNS)
+OPTIONAL_COLUMNS = ("duration_ns", "work_bytes", "work_files", "work_items")
+
+INSERT_PATTERN = re.compile(r"INSERT INTO (\w+)\s*\(([^)]*)\)\s*VALUES\s*\(([^)]*)\)", re.IGNORECASE)
+
+
+def _parse_insert(statement):
+    table, columns, placeholders = INSERT_PATTERN.match(statement.strip()).groups()
+    return (table, [column.strip() for column in columns.split(",")],
+            [placeholder.strip() for placeholder in placeholders.split(",")])
+
+
+@functools.lru_cache(maxsize=64)
+def _optional_indexes(statement):
+    # the positions of the optional columns in an INSERT statement
+    if INSERT_PATTERN.match(statement.strip()) is None:
+        return ()
+    _, columns, _ = _parse_insert(statement)
+    return tuple(index for index, column in enumerate(columns) if column in OPTIONAL_COLUMNS)
+
+
+@functools.lru_cache(maxsize=64)
+def _without_columns(statement, dropped):
+    # the statement without the columns at the dropped positions, and the positions of the values kept
+    table, columns, placeholders = _parse_insert(statement)
+    kept = [index for index in range(len(columns)) if index not in dropped]
+    rest = statement.strip()[INSERT_PATTERN.match(statement.strip()).end():]
+    return ("INSERT INTO %s\n  (%s)\n  VALUES\n  (%s)%s" % (table, ", ".join(columns[index] for index in kept),
+                                                            ", ".join(placeholders[index] for index in kept), rest),
+            kept)
+
+
+def without_unset_columns(statement, rows):
+    """
+    Leave the optional columns which are None in every row out of an INSERT statement (and its rows),
+    so that tables created before those columns were added can be written until they are used
+
+    :param statement: INSERT INTO ... (columns) VALUES (placeholders) statement
+    :param rows: sequence of tuples of values, in the statement's column order
+    :return: (statement, rows)
+    """
+    dropped = tuple(index for index in _optional_indexes(statement) if all(row[index] is None for row in rows))
+    if not dropped or not rows:
+        return statement, rows
+    statement, kept = _without_columns(statement, dropped)
+    return statement, [tuple(row[index] for index in kept) for row in rows]
+
+
+class Backend:
+    """Base class for storage backends"""
+
+    name = None
+    dialect = None
+
+    def connect(self):
+        """
+        Open a new connection
+
+        :return: DB-API connection
+        """
+        raise NotImplementedError
+
+    def sql(self, statement):
+        """
+        Adapt a statement using the %s paramstyle to this backend
+
+        :param statement: SQL statement
+        :return: SQL statement
+        """
+        return statement
+
+    def ddl(self, statement):
+        """
+        Adapt a CREATE TABLE statement to this backend
+
+        :param statement: SQL statement
+        :return: SQL statement
+        """
+        return statement
+
+    def insert(self, statement, row):
+        """
+        Write a single row in its own transaction
+
+        The optional columns which are None are left out (see without_unset_columns).
+
+        :param statement: INSERT statement using the %s paramstyle
+        :param row: tuple of values
+        """
+        raise NotImplementedError
+
+    def write_records(self, conn, statement, rows, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        Write many rows over one connection, committing once per batch
+
+        The optional columns which are None in every row of a batch are left out (see without_unset_columns).
+
+        :param conn: DB-API connection from connect()
+        :param statement: INSERT statement using the %s paramstyle
+        :param rows: sequence of tuples of values
+        :param batch_size: number of rows written per transaction
+        :return: number of rows written
+        """
+        statement = self.sql(statement)
+        cursor = conn.cursor()
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            batch_statement, batch = without_unset_columns(statement, batch)
+            with metrics.timer("wflogger_insert_seconds"):
+                cursor.executemany(batch_statement, batch)
+                conn.commit()
+            metrics.observe("wflogger_batch_rows", len(batch))
+            metrics.inc("wflogger_records_inserted_total", len(batch))
+        return len(rows)
+
+    def read_sql(self, query, **kwargs):
+        """
+        Run a query and return the results as a DataFrame
+
+        :param query: SQL query
+        :param kwargs: additional arguments to pandas.read_sql
+        :return: pandas.DataFrame
+        """
+        raise NotImplementedError
+
+    def create_index(self, conn, name, table, columns):
+        """
+        Create an index (and commit) unless it already exists
+
+        :param conn: DB-API connection from connect()
+        :param name: name of the index
+        :param table: name of the table
+        :param columns: comma-separated column names
+        """
+        conn.cursor().execute(CREATE_INDEX_SQL.format(concurrently="", name=name, table=table, columns=columns))
+        conn.commit()
+
+    def for_workflow(self, workflow):
+        """
+        Get the backend holding the rows of a workflow (only differs for a sharded backend)
+
+        :param workflow: the workflow name, or None for all workflows
+        :return: Backend
+        """
+        return self
+
+
+class PostgresBackend(Backend):
+    """The shared postgres database, connecting once per insert"""
+
+    name = "postgres"
+    dialect = "postgres"
+
+    def __init__(self, creds=None):
+        """
+        Constructor
+
+        :param creds: libpq connection string, defaults to the contents of the credentials file
+        """
+        if creds is None:
+            from .credentials import creds
+        self.creds = creds
+
+    def __repr__(self):
+        return "PostgresBackend()"
+
+    def connect(self):
+        import psycopg2
+
+        with metrics.timer("wflogger_connect_seconds", backend=self.name):
+            return psycopg2.connect(self.creds)
+
+    def url(self):
+        creds_dict = dict([item.split("=") for item in self.creds.split()])
+        return "postgresql://{user}:{password}@{host}:{port}/{dbname}".format(**creds_dict)
+
+    def insert(self, statement, row):
+        statement, (row,) = without_unset_columns(statement, [row])
+        conn = self.connect()
+        try:
+            with metrics.timer("wflogger_insert_seconds"):
+                with conn:
+                    with conn.cursor() as curs:
+                        curs.execute(statement, row)
+        finally:
+            conn.close()
+
+        metrics.observe("wflogger_batch_rows", 1)
+        metrics.inc("wflogger_records_inserted_total")
+
+    def read_sql(self, query, **kwargs):
+        import pandas as pd
+
+        return pd.read_sql(query, self.url(), **kwargs)
+
+    def create_index(self, conn, name, table, columns):
+        # a plain CREATE INDEX blocks all writes to the table until it is built, but building it
+        # concurrently cannot be done inside a transaction
+        conn.commit()
+        autocommit = conn.autocommit
+        conn.autocommit = True
+        try:
+            with conn.cursor() as curs:
+                curs.execute(CREATE_INDEX_SQL.format(concurrently="CONCURRENTLY ", name=name, table=table,
+                                                     columns=columns))
+        finally:
+            conn.autocommit = autocommit
+
+
+class SQLiteBackend(Backend):
+    """
+    A local SQLite database file, tuned for high-throughput single-node use
+
+    Uses a write-ahead log (so readers do not block the writer), relaxed syncing (durable at
+    checkpoints, safe against application crashes), in-memory temporary storage and a large page
+    cache. Each thread re-uses one connection for single-row inserts.
+    """
+
+    name = "sqlite"
+    dialect = "sqlite"
+
+    PRAGMAS = {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "temp_store": "MEMORY",
+        "cache_size": -65536,
+        "mmap_size": 268435456,
+    }
+
+    # seconds to wait for another process to release its write lock
+    TIMEOUT = 60
+
+    def __init__(self, path, pragmas=None):
+        """
+        Constructor
+
+        :param path: filesystem path of the database file
+        :param pragmas: dictionary of PRAGMA settings overriding SQLiteBackend.PRAGMAS
+        """
+        self.path = path
+        self.pragmas = dict(self.PRAGMAS, **(pragmas or {}))
+        self._local = threading.local()
+
+    def __repr__(self):
+        return f"SQLiteBackend({self.path!r})"
+
+    def connect(self):
+        with metrics.timer("wflogger_connect_seconds", backend=self.name):
+            # convert timestamp columns back into datetimes when reading
+            conn = sqlite3.connect(self.path, timeout=self.TIMEOUT, detect_types=sqlite3.PARSE_DECLTYPES)
+            for name, value in self.pragmas.items():
+                conn.execute(f"PRAGMA {name} = {value}")
+        return conn
+
+    def sql(self, statement):
+        # Sqlite uses ? rather than %s paramstyle
+        return statement.replace("%s", "?")
+
+    def ddl(self, statement):
+        # Sqlite only auto-assigns ids to INTEGER PRIMARY KEY columns
+        return statement.replace("serial PRIMARY KEY", "INTEGER PRIMARY KEY")
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = self._local.conn = self.connect()
+            self._local.pid = os.getpid()
+        return conn
+
+    def insert(self, statement, row):
+        statement, (row,) = without_unset_columns(self.sql(statement), [row])
+        conn = self._connection()
+        with metrics.timer("wflogger_insert_seconds"):
+            with conn:
+                conn.execute(statement, row)
+
+        metrics.observe("wflogger_batch_rows", 1)
+        metrics.inc("wflogger_records_inserted_total")
+
+    def read_sql(self, query, **kwargs):
+        import pandas as pd
+
+        conn = self.connect()
+        try:
+            return pd.read_sql(query, conn, **kwargs)
+        finally:
+            conn.close()
+
+
+_default_backend = None
+
+
+def get_backend(sqlite_path=None):
+    """
+    Get a backend
+
+    :param sqlite_path: use a SQLite database at this path
+    :return: SQLiteBackend if sqlite_path is given or $WFLOGGER_SQLITE_PATH is set, a ShardedBackend
+             if $WFLOGGER_SHARDS is set, otherwise the (shared) PostgresBackend
+    """
+    global _default_backend
+
+    if sqlite_path:
+        return SQLiteBackend(sqlite_path)
+
+    if _default_backend is None:
+        if os.environ.get(SQLITE_PATH_ENV_VAR):
+            _default_backend = SQLiteBackend(os.environ[SQLITE_PATH_ENV_VAR])
+        elif os.environ.get(SHARDS_ENV_VAR):
+            from .sharding import ShardedBackend, load_shards
+
+            _default_backend = ShardedBackend(load_shards(os.environ[SHARDS_ENV_VAR]))
+        else:
+            _default_backend = PostgresBackend()
+
+    return _default_backend
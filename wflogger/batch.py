@@ -0,0 +1,124 @@
+"""
+Reading and writing batches of workflow log records, as used by `wflogger log-batch`
+
+Each (non-blank) line of the input describes one record, in one of the formats:
+
+    text:  <workflow> | <tag> | <stage_number> | <stage> | <iteration> | <date_time> | <comment> | <flag>
+           | <duration_ns> | <work_bytes> | <work_files> | <work_items>
+    csv:   the same fields, comma-separated (an optional header row naming the fields is skipped)
+    jsonl: a JSON object with (some of) the keys workflow, tag, stage_number, stage, iteration,
+           date_time, comment, flag, duration_ns, work_bytes, work_files and work_items
+
+The first four fields are required, the rest may be blank or omitted. The user id and hostname are
+taken from the credentials, and a blank date-time is replaced by the time the batch is read. Text lines
+containing the WFL_START token are read as complete log file entries, including their own user id
+and hostname.
+
+Every record is validated with the same rules as the LogIngestor (see LogIngestor.parse_fields).
+"""
+
+import csv
+import datetime
+import json
+
+from .backends import get_backend
+from .credentials import user_id, hostname
+from .log_ingestor import LogIngestor, ParsingError, INSERT_SQL
+
+FORMATS = ("text", "csv", "jsonl")
+
+FIELDS = ["workflow", "tag", "stage_number", "stage", "iteration", "date_time", "comment", "flag", "duration_ns",
+          "work_bytes", "work_files", "work_items"]
+
+REQUIRED_FIELDS = 4
+
+
+def _json_fields(line, line_nr):
+    try:
+        record = json.loads(line)
+    except ValueError as ex:
+        raise ParsingError("At line %d: could not parse JSON: %s" % (line_nr, ex), reason="json")
+    if not isinstance(record, dict):
+        raise ParsingError("At line %d: expected a JSON object" % line_nr, reason="json")
+    unknown = set(record) - set(FIELDS)
+    if unknown:
+        raise ParsingError("At line %d: unknown fields %s" % (line_nr, ", ".join(sorted(unknown))),
+                           reason="field_count")
+    return [str(record[field]).strip() if record.get(field) is not None else "" for field in FIELDS]
+
+
+def parse_record(fields, line_nr, now):
+    """
+    Validate and convert the fields of one batch record
+
+    :param fields: list of up to 12 string fields, in the order of FIELDS
+    :param line_nr: the line number of the record, for error messages
+    :param now: datetime.datetime used for a blank date-time
+    :return: 14-tuple, as for LogIngestor.parse_fields
+
+    :raises ParsingError if the record is not valid
+    """
+    if not REQUIRED_FIELDS <= len(fields) <= len(FIELDS) or not all(fields[:REQUIRED_FIELDS]):
+        raise ParsingError("At line %d: record requires the fields %s, and accepts at most %d fields"
+                           % (line_nr, ", ".join(FIELDS[:REQUIRED_FIELDS]), len(FIELDS)), reason="field_count")
+    fields = fields + [""] * (len(FIELDS) - len(fields))
+    if not fields[5]:
+        fields[5] = now.strftime(LogIngestor.DATETIME_FORMAT)
+    return LogIngestor.parse_fields([user_id, hostname] + fields, line_nr)
+
+
+def read_batch(lines, fmt="text", lenient=False):
+    """
+    Read and validate a batch of records
+
+    :param lines: iterable of input lines, e.g. an open file
+    :param fmt: one of FORMATS
+    :param lenient: skip invalid records instead of raising an exception
+    :return: (list-of-14-tuples, list-of-ParsingErrors-for-skipped-records)
+
+    :raises ParsingError if a record is not valid and lenient is False
+    """
+    if fmt not in FORMATS:
+        raise ValueError("Unknown batch format %s, expected one of %s" % (fmt, ", ".join(FORMATS)))
+
+    now = datetime.datetime.now()
+    rows, errors = [], []
+    records = csv.reader(lines) if fmt == "csv" else lines
+
+    for line_nr, line in enumerate(records, start=1):
+        try:
+            if fmt == "csv":
+                fields = [s.strip() for s in line]
+                if not any(fields) or (line_nr == 1 and fields[0] == FIELDS[0]):
+                    continue
+            else:
+                if not line.strip() or line.lstrip().startswith("#"):
+                    continue
+                if fmt == "text" and LogIngestor.START_TOKEN in line:
+                    entry = line[line.find(LogIngestor.START_TOKEN) + len(LogIngestor.START_TOKEN):]
+                    rows.append(LogIngestor.parse_fields([s.strip() for s in entry.split("|")], line_nr))
+                    continue
+                fields = _json_fields(line, line_nr) if fmt == "jsonl" else [s.strip() for s in line.split("|")]
+            rows.append(parse_record(fields, line_nr, now))
+        except ParsingError as ex:
+            if not lenient:
+                raise
+            errors.append(ex)
+
+    return rows, errors
+
+
+def write_batch(rows, backend=None):
+    """
+    Write a batch of records over a single connection
+
+    :param rows: list of 14-tuples, e.g. from read_batch
+    :param backend: wflogger.backends.Backend, defaults to get_backend()
+    :return: number of records written
+    """
+    backend = backend or get_backend()
+    conn = backend.connect()
+    try:
+        return backend.write_records(conn, INSERT_SQL, rows)
+    finally:
+        conn.close()
@@ -11,10 +11,17 @@ import datetime as dt
 from dateutil import parser
 
 import click
-import psycopg2
 
 from .wflogger import insert_record, DEFAULT_ITERATION, DEFAULT_FLAG
-from .credentials import creds, user_id, hostname
+from .backends import get_backend
+from .credentials import user_id, hostname
+from .loadgen import run_load, MODES
+from .batch import read_batch, write_batch, FORMATS
+from .log_ingestor import ParsingError
+from .tail import LogTail, prepare_tail, DEFAULT_POLL_INTERVAL
+
+TAIL_COLUMNS = ["id", "date_time", "user_id", "hostname", "workflow", "tag", "stage_number", "stage",
+                "iteration", "comment", "flag", "duration_ns", "work_bytes", "work_files", "work_items"]
 
 
 @click.group()
@@ -33,8 +40,163 @@ def main():
 @click.option("-d", "--date-time", default=None)
 @click.option("-c", "--comment", default="")
 @click.option("-f", "--flag", default=DEFAULT_FLAG)
-def log(workflow, tag, stage_number, stage, iteration=0, date_time=None, comment="", flag=DEFAULT_FLAG):
-    insert_record(workflow, tag, stage_number, stage, iteration, date_time, comment, flag)
+@click.option("--duration-ns", type=int, default=None, help="Duration of the stage in nanoseconds")
+@click.option("--start-ns", type=int, default=None,
+              help="Start of the stage in nanoseconds of the monotonic clock (on the same host as --end-ns), "
+                   "e.g. from $(python -c 'import time; print(time.monotonic_ns())')")
+@click.option("--end-ns", type=int, default=None,
+              help="End of the stage in nanoseconds of the monotonic clock, used with --start-ns")
+@click.option("--bytes", "work_bytes", type=int, default=None, help="Number of bytes processed by the stage")
+@click.option("--files", "work_files", type=int, default=None, help="Number of files processed by the stage")
+@click.option("--items", "work_items", type=int, default=None, help="Number of items processed by the stage")
+def log(workflow, tag, stage_number, stage, iteration=0, date_time=None, comment="", flag=DEFAULT_FLAG,
+        duration_ns=None, start_ns=None, end_ns=None, work_bytes=None, work_files=None, work_items=None):
+    if (start_ns is None) != (end_ns is None):
+        raise click.UsageError("--start-ns and --end-ns must be given together")
+    if start_ns is not None:
+        duration_ns = end_ns - start_ns
+    insert_record(workflow, tag, stage_number, stage, iteration, date_time, comment, flag, duration_ns=duration_ns,
+                  work_bytes=work_bytes, work_files=work_files, work_items=work_items)
+
+
+@main.command("log-batch")
+@click.argument("input", type=click.File("r"), default="-")
+@click.option("--format", "fmt", type=click.Choice(FORMATS), default="text", help="Format of the input records")
+@click.option("--lenient", is_flag=True, help="Skip invalid records instead of writing nothing")
+@click.option("--sqlite-path", default=None, help="Write to a SQLite database instead of postgres")
+def log_batch(input, fmt, lenient, sqlite_path):
+    """Log many records, read from INPUT (default stdin), over a single connection."""
+    try:
+        rows, errors = read_batch(input, fmt, lenient=lenient)
+    except ParsingError as ex:
+        raise click.ClickException(f"{ex} (no records written)")
+
+    for error in errors:
+        click.echo(f"Skipped: {error}", err=True)
+    n_written = write_batch(rows, backend=get_backend(sqlite_path)) if rows else 0
+    click.echo(f"Logged {n_written} records, skipped {len(errors)}")
+
+
+@main.command()
+@click.argument("workflow", required=False)
+@click.option("-t", "--tag", default=None)
+@click.option("-n", "--stage-number", type=int, default=None)
+@click.option("-s", "--stage", default=None)
+@click.option("-i", "--iteration", type=int, default=None)
+@click.option("-u", "--user-id", default=user_id, show_default=True)
+@click.option("-H", "--hostname", "host", default=None)
+@click.option("-c", "--comment", default="", show_default=True)
+@click.option("-f", "--flag", type=int, default=DEFAULT_FLAG, show_default=True)
+@click.option("--from-id", type=int, default=None, help="Show the rows after this id, rather than only new rows")
+@click.option("--poll-interval", default=DEFAULT_POLL_INTERVAL, help="Maximum seconds between polls")
+@click.option("--sqlite-path", default=None, help="Use a SQLite database instead of postgres")
+@click.option("--compact", is_flag=True, help="The database uses the compact schema")
+@click.option("--setup", is_flag=True, help="Install the postgres trigger which notifies tails of new rows")
+def tail(workflow, tag, stage_number, stage, iteration, user_id, host, comment, flag, from_id, poll_interval,
+         sqlite_path, compact, setup):
+    """Print new workflow log rows (matching the filters) as they are written."""
+    backend = get_backend(sqlite_path)
+    try:
+        if setup:
+            prepare_tail(backend, compact_schema=compact)
+
+        log_tail = LogTail(workflow, tag=tag, stage_number=stage_number, stage=stage, iteration=iteration,
+                           user_id=user_id, hostname=host, comment=comment, flag=flag, backend=backend,
+                           compact_schema=compact, from_id=from_id, poll_interval=poll_interval)
+    except ValueError as ex:
+        raise click.UsageError(str(ex))
+    try:
+        for row in log_tail:
+            click.echo(" | ".join(str(row[column]) for column in TAIL_COLUMNS if column in row))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        log_tail.close()
+
+
+@main.command()
+@click.option("-n", "--nodes", default=1, help="Number of simulated nodes (processes)")
+@click.option("-j", "--jobs", default=4, help="Number of concurrent jobs (threads) per node")
+@click.option("-s", "--stages", default=5, help="Number of stages per iteration")
+@click.option("-i", "--iterations", default=10, help="Number of iterations per job")
+@click.option("-m", "--mode", type=click.Choice(MODES), default="insert",
+              help="Log through insert_record or through the log ingestor")
+@click.option("--sqlite-path", default=None, help="Write to a SQLite database instead of postgres")
+@click.option("--dsn", default=None,
+              help="Write to the (local, stand-in) postgres database with this libpq connection string")
+@click.option("--delay", default=0.0, help="Simulated processing time (s) before each stage is logged")
+@click.option("--force", is_flag=True,
+              help="Allow writing to the default database from the credentials file, usually production")
+def loadgen(nodes, jobs, stages, iterations, mode, sqlite_path, dsn, delay, force):
+    """Simulate the logging traffic of a cluster of jobs for capacity planning."""
+    try:
+        report = run_load(nodes=nodes, jobs=jobs, stages=stages, iterations=iterations,
+                          mode=mode, sqlite_path=sqlite_path, delay=delay, dsn=dsn, force=force)
+    except ValueError as ex:
+        raise click.UsageError(str(ex))
+    click.echo(report.summary())
+
+
+@main.command()
+@click.option("-a", "--max-age-days", type=float, required=True, help="Process rows older than this many days")
+@click.option("-o", "--archive-dir", required=True, help="Directory in which to write the parquet archives")
+@click.option("-b", "--batch-size", default=1000, help="Number of rows deleted per transaction")
+@click.option("--pause", default=0.0, help="Seconds to sleep between batches")
+@click.option("--sqlite-path", default=None, help="Use a SQLite database instead of postgres")
+@click.option("--compact", is_flag=True, help="The database uses the compact schema")
+@click.option("--dry-run", is_flag=True, help="Only report how many rows would be processed")
+def retention(max_age_days, archive_dir, batch_size, pause, sqlite_path, compact, dry_run):
+    """Archive and roll up old workflow log rows, then delete them in small batches."""
+    # pandas is slow to import, so only pay for it when it is needed
+    from .retention import prepare_retention, apply_retention
+
+    backend = get_backend(sqlite_path)
+    prepare_retention(backend, compact_schema=compact)
+    n_deleted, n_rollups = apply_retention(max_age_days, archive_dir, backend=backend,
+                                           batch_size=batch_size, pause=pause, dry_run=dry_run)
+    click.echo(f"{'Would process' if dry_run else 'Archived and deleted'} {n_deleted} rows, "
+               f"wrote {n_rollups} rollup rows")
+
+
+@main.command()
+@click.argument("workflow")
+@click.argument("tag")
+@click.option("-i", "--iteration", "iterations", type=int, multiple=True,
+              help="Only predict this iteration (may be repeated), defaults to all in-progress iterations")
+@click.option("-u", "--user", "user", default=user_id, help="User whose workflow it is")
+@click.option("--refresh/--no-refresh", default=True,
+              help="Add the rows written since the last refresh to the stage statistics first")
+@click.option("--stuck-quantile", type=click.Choice(["0.5", "0.9", "0.99"]), default="0.99",
+              help="Report iterations whose current stage has run for longer than this quantile of its past runs")
+@click.option("--stuck-only", is_flag=True, help="Only show stuck iterations")
+# the default of wflogger.eta.predict_eta, which is not imported here because it imports pandas
+@click.option("--max-age-days", type=float, default=7, show_default=True,
+              help="Skip iterations without a record in this many days, as abandoned (0 for no limit)")
+@click.option("--sqlite-path", default=None, help="Use a SQLite database instead of postgres")
+@click.option("--compact", is_flag=True, help="The database uses the compact schema")
+@click.option("--setup", is_flag=True, help="Create the statistics tables and the index they are refreshed with")
+def eta(workflow, tag, iterations, user, refresh, stuck_quantile, stuck_only, max_age_days, sqlite_path, compact,
+        setup):
+    """Predict the remaining runtime of the in-progress iterations of a workflow tag from past runs."""
+    # pandas is slow to import, so only pay for it when it is needed
+    from .eta import prepare_eta, refresh_stage_stats, predict_eta
+
+    backend = get_backend(sqlite_path)
+    if setup:
+        prepare_eta(backend, compact_schema=compact)
+    if refresh:
+        refresh_stage_stats(backend, compact_schema=compact)
+
+    df = predict_eta(workflow, tag, iterations=list(iterations), user_id=user, backend=backend,
+                     stuck_quantile=float(stuck_quantile), max_age_days=max_age_days or None)
+    if stuck_only:
+        df = df[df["stuck"]]
+
+    click.echo("iteration | next stage | elapsed (s) | eta (s) | eta p90 (s) | expected end | stuck")
+    for row in df.itertuples():
+        click.echo(f"{row.iteration} | {row.next_stage_number}: {row.next_stage} | {row.elapsed:.1f} | "
+                   f"{row.eta:.1f} | {row.eta_p90:.1f} | {row.expected_end:%Y-%m-%d %H:%M:%S} | "
+                   f"{'STUCK' if row.stuck else ''}")
 
 
 if __name__ == "__main__":
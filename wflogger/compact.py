@@ -0,0 +1,248 @@
+"""
+Dictionary-encoded ("compact") schema for the workflow logs
+
+The repeated strings of each workflow log row (user_id, hostname, workflow, tag and stage) are
+stored once in small dimension tables and referenced by integer keys from the
+workflow_log_entries table. A view named workflow_logs joins them back together, so that
+queries written against the original table (e.g. analysis._get_select_statement) keep working.
+INSTEAD OF triggers on the view allow existing INSERT and DELETE statements to keep working too.
+
+Bulk writers should resolve the keys on the client with a DimensionCache and insert directly
+into workflow_log_entries, which avoids a dimension lookup per row.
+
+Supports the "postgres" and "sqlite" dialects.
+"""
+
+DIALECTS = ("postgres", "sqlite")
+
+# (workflow_logs column, dimension table, maximum length)
+DIMENSIONS = [
+    ("user_id", "wfl_user_ids", 32),
+    ("hostname", "wfl_hostnames", 64),
+    ("workflow", "wfl_workflows", 64),
+    ("tag", "wfl_tags", 64),
+    ("stage", "wfl_stages", 64),
+]
+
+PRIMARY_KEY_TYPES = {"postgres": "serial PRIMARY KEY", "sqlite": "INTEGER PRIMARY KEY"}
+
+CREATE_DIMENSION_TABLE_SQL = """CREATE TABLE {table} (
+  id            {pk},
+  value         varchar({length}) NOT NULL UNIQUE
+);"""
+
+CREATE_ENTRIES_TABLE_SQL = """CREATE TABLE workflow_log_entries (
+  id            {pk},
+  user_id_key   integer NOT NULL REFERENCES wfl_user_ids (id),
+  hostname_key  integer NOT NULL REFERENCES wfl_hostnames (id),
+  workflow_key  integer NOT NULL REFERENCES wfl_workflows (id),
+  tag_key       integer NOT NULL REFERENCES wfl_tags (id),
+  stage_number  integer NOT NULL,
+  stage_key     integer NOT NULL REFERENCES wfl_stages (id),
+  iteration     integer DEFAULT 0,
+  date_time     timestamp DEFAULT current_timestamp,
+  comment       varchar(128) DEFAULT '',
+  flag          integer DEFAULT -999,
+  duration_ns   bigint DEFAULT NULL,
+  work_bytes    bigint DEFAULT NULL,
+  work_files    bigint DEFAULT NULL,
+  work_items    bigint DEFAULT NULL
+);"""
+
+CREATE_ENTRIES_INDEX_SQL = """CREATE INDEX workflow_log_entries_workflow_tag_idx
+  ON workflow_log_entries (workflow_key, tag_key);"""
+
+CREATE_VIEW_SQL = """CREATE VIEW workflow_logs AS
+  SELECT e.id, u.value AS user_id, h.value AS hostname, w.value AS workflow, t.value AS tag,
+         e.stage_number, s.value AS stage, e.iteration, e.date_time, e.comment, e.flag,
+         e.duration_ns, e.work_bytes, e.work_files, e.work_items
+  FROM workflow_log_entries e
+  JOIN wfl_user_ids u ON u.id = e.user_id_key
+  JOIN wfl_hostnames h ON h.id = e.hostname_key
+  JOIN wfl_workflows w ON w.id = e.workflow_key
+  JOIN wfl_tags t ON t.id = e.tag_key
+  JOIN wfl_stages s ON s.id = e.stage_key;"""
+
+INSERT_ENTRY_SQL = """INSERT INTO workflow_log_entries
+  (user_id_key, hostname_key, workflow_key, tag_key, stage_number, stage_key,
+  iteration, date_time, comment, flag, duration_ns,
+  work_bytes, work_files, work_items)
+  VALUES
+  (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"""
+
+# a single round trip which returns the key of a value whether or not it already existed
+UPSERT_DIMENSION_SQL = """INSERT INTO {table} (value) VALUES (%s)
+  ON CONFLICT (value) DO UPDATE SET value = EXCLUDED.value RETURNING id"""
+
+POSTGRES_TRIGGER_SQL = [
+    """CREATE OR REPLACE FUNCTION wfl_dimension_key(dimension text, val text) RETURNS integer AS $$
+DECLARE
+  dim_key integer;
+BEGIN
+  EXECUTE format('SELECT id FROM %I WHERE value = $1', dimension) INTO dim_key USING val;
+  IF dim_key IS NULL THEN
+    EXECUTE format('INSERT INTO %I (value) VALUES ($1) ON CONFLICT (value) '
+                   'DO UPDATE SET value = EXCLUDED.value RETURNING id', dimension) INTO dim_key USING val;
+  END IF;
+  RETURN dim_key;
+END;
+$$ LANGUAGE plpgsql;""",
+    """CREATE OR REPLACE FUNCTION wfl_write_workflow_log() RETURNS trigger AS $$
+BEGIN
+  IF TG_OP = 'DELETE' THEN
+    DELETE FROM workflow_log_entries WHERE id = OLD.id;
+    RETURN OLD;
+  END IF;
+  INSERT INTO workflow_log_entries
+    (user_id_key, hostname_key, workflow_key, tag_key, stage_number, stage_key,
+    iteration, date_time, comment, flag, duration_ns, work_bytes, work_files, work_items)
+  VALUES
+    (wfl_dimension_key('wfl_user_ids', NEW.user_id), wfl_dimension_key('wfl_hostnames', NEW.hostname),
+     wfl_dimension_key('wfl_workflows', NEW.workflow), wfl_dimension_key('wfl_tags', NEW.tag),
+     NEW.stage_number, wfl_dimension_key('wfl_stages', NEW.stage),
+     COALESCE(NEW.iteration, 0), COALESCE(NEW.date_time, current_timestamp),
+     COALESCE(NEW.comment, ''), COALESCE(NEW.flag, -999), NEW.duration_ns,
+     NEW.work_bytes, NEW.work_files, NEW.work_items);
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;""",
+    """CREATE TRIGGER workflow_logs_write INSTEAD OF INSERT OR DELETE ON workflow_logs
+  FOR EACH ROW EXECUTE PROCEDURE wfl_write_workflow_log();""",
+]
+
+SQLITE_TRIGGER_SQL = [
+    """CREATE TRIGGER workflow_logs_insert INSTEAD OF INSERT ON workflow_logs
+BEGIN
+  INSERT OR IGNORE INTO wfl_user_ids (value) VALUES (NEW.user_id);
+  INSERT OR IGNORE INTO wfl_hostnames (value) VALUES (NEW.hostname);
+  INSERT OR IGNORE INTO wfl_workflows (value) VALUES (NEW.workflow);
+  INSERT OR IGNORE INTO wfl_tags (value) VALUES (NEW.tag);
+  INSERT OR IGNORE INTO wfl_stages (value) VALUES (NEW.stage);
+  INSERT INTO workflow_log_entries
+    (user_id_key, hostname_key, workflow_key, tag_key, stage_number, stage_key,
+    iteration, date_time, comment, flag, duration_ns, work_bytes, work_files, work_items)
+  VALUES
+    ((SELECT id FROM wfl_user_ids WHERE value = NEW.user_id),
+     (SELECT id FROM wfl_hostnames WHERE value = NEW.hostname),
+     (SELECT id FROM wfl_workflows WHERE value = NEW.workflow),
+     (SELECT id FROM wfl_tags WHERE value = NEW.tag),
+     NEW.stage_number,
+     (SELECT id FROM wfl_stages WHERE value = NEW.stage),
+     COALESCE(NEW.iteration, 0), COALESCE(NEW.date_time, current_timestamp),
+     COALESCE(NEW.comment, ''), COALESCE(NEW.flag, -999), NEW.duration_ns,
+     NEW.work_bytes, NEW.work_files, NEW.work_items);
+END;""",
+    """CREATE TRIGGER workflow_logs_delete INSTEAD OF DELETE ON workflow_logs
+BEGIN
+  DELETE FROM workflow_log_entries WHERE id = OLD.id;
+END;""",
+]
+
+
+def _check_dialect(dialect):
+    if dialect not in DIALECTS:
+        raise ValueError(f"Unknown SQL dialect '{dialect}', must be one of: {DIALECTS}")
+
+
+def _paramstyle(sql, dialect):
+    # Sqlite uses ? rather than %s paramstyle
+    return sql.replace("%s", "?") if dialect == "sqlite" else sql
+
+
+def create_tables_sql(dialect):
+    """
+    Get the statements creating the dimension and entries tables (but not the view)
+
+    :param dialect: "postgres" or "sqlite"
+    :return: list of SQL statements
+    """
+    _check_dialect(dialect)
+    pk = PRIMARY_KEY_TYPES[dialect]
+    statements = [CREATE_DIMENSION_TABLE_SQL.format(table=table, pk=pk, length=length)
+                  for _, table, length in DIMENSIONS]
+    statements.append(CREATE_ENTRIES_TABLE_SQL.format(pk=pk))
+    statements.append(CREATE_ENTRIES_INDEX_SQL)
+    return statements
+
+
+def create_view_sql(dialect):
+    """
+    Get the statements creating the workflow_logs compatibility view and its triggers
+
+    :param dialect: "postgres" or "sqlite"
+    :return: list of SQL statements
+    """
+    _check_dialect(dialect)
+    triggers = POSTGRES_TRIGGER_SQL if dialect == "postgres" else SQLITE_TRIGGER_SQL
+    return [CREATE_VIEW_SQL] + triggers
+
+
+def insert_entry_sql(dialect):
+    """
+    :param dialect: "postgres" or "sqlite"
+    :return: the statement inserting a row of keys into workflow_log_entries
+    """
+    _check_dialect(dialect)
+    return _paramstyle(INSERT_ENTRY_SQL, dialect)
+
+
+class DimensionCache:
+    """
+    Client-side cache of the integer keys of the dimension tables
+
+    All existing keys are loaded with one query per dimension table on first use, after which
+    only values never seen before cost a round trip to the database.
+    """
+
+    def __init__(self, conn, dialect):
+        """
+        Constructor
+
+        :param conn: DB-API connection to a database with the compact schema
+        :param dialect: "postgres" or "sqlite"
+        """
+        _check_dialect(dialect)
+        self.conn = conn
+        self.dialect = dialect
+        self.keys = None
+
+    def load(self):
+        """(Re)load all the keys from the dimension tables"""
+        cursor = self.conn.cursor()
+        self.keys = {}
+        for column, table, _ in DIMENSIONS:
+            cursor.execute(f"SELECT value, id FROM {table}")
+            self.keys[column] = dict(cursor.fetchall())
+
+    def key(self, column, value):
+        """
+        Get the key of a value, adding it to the dimension table if it is new
+
+        :param column: the workflow_logs column name, e.g. "hostname"
+        :param value: the string value
+        :return: integer key
+        """
+        if self.keys is None:
+            self.load()
+        keys = self.keys[column]
+        try:
+            return keys[value]
+        except KeyError:
+            table = dict((c, t) for c, t, _ in DIMENSIONS)[column]
+            cursor = self.conn.cursor()
+            cursor.execute(_paramstyle(UPSERT_DIMENSION_SQL.format(table=table), self.dialect), (value,))
+            keys[value] = cursor.fetchone()[0]
+            return keys[value]
+
+    def encode(self, row):
+        """
+        Convert a row in workflow_logs column order into a row for workflow_log_entries
+
+        :param row: 14-tuple (user_id, hostname, workflow, tag, stage_number, stage,
+                    iteration, date_time, comment, flag, duration_ns, work_bytes, work_files, work_items)
+        :return: 14-tuple with the strings replaced by their keys
+        """
+        (user_id, hostname, workflow, tag, stage_number, stage) = row[:6]
+        return (self.key("user_id", user_id), self.key("hostname", hostname),
+                self.key("workflow", workflow), self.key("tag", tag), stage_number,
+                self.key("stage", stage)) + tuple(row[6:])
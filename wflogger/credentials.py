@@ -7,12 +7,15 @@ creds_file = os.path.join(HOME, ".wflogger")
 user_id = env.get("USER") or os.path.basename(HOME)
 hostname = env["HOSTNAME"]
 
-if not os.path.isfile(creds_file):
-    raise IOError(f"Required credentials file does not exist: {creds_file}")
-
-status = os.stat(creds_file)
-if oct(status.st_mode)[-3:] != "400":
-    raise PermissionError(f"File permissions on credentials file must be read-only for user: 0400")
-
-creds = open(creds_file).read()
+if os.path.isfile(creds_file):
+    status = os.stat(creds_file)
+    if oct(status.st_mode)[-3:] != "400":
+        raise PermissionError(f"File permissions on credentials file must be read-only for user: 0400")
 
+    creds = open(creds_file).read()
+elif env.get("WFLOGGER_SQLITE_PATH") or env.get("WFLOGGER_SHARDS"):
+    # no database server (and so no credentials) is needed to log to a SQLite database, and
+    # each shard of a sharded database has its own connection string
+    creds = None
+else:
+    raise IOError(f"Required credentials file does not exist: {creds_file}")
@@ -1,7 +1,7 @@
 import os
-import psycopg2
 
-from credentials import creds
+from .backends import get_backend
+from . import compact
 
 
 CREATE_TABLE_SQL = """CREATE TABLE workflow_logs (
@@ -15,23 +15,218 @@ CREATE_TABLE_SQL = """CREATE TABLE workflow_logs (
   iteration     integer DEFAULT 0,
   date_time     timestamp DEFAULT current_timestamp,
   comment       varchar(128) DEFAULT '',
-  flag          integer DEFAULT -999
+  flag          integer DEFAULT -999,
+  duration_ns   bigint DEFAULT NULL,
+  work_bytes    bigint DEFAULT NULL,
+  work_files    bigint DEFAULT NULL,
+  work_items    bigint DEFAULT NULL
+);"""
+
+CREATE_SUMMARIES_TABLE_SQL = """CREATE TABLE IF NOT EXISTS workflow_log_summaries (
+  id            serial PRIMARY KEY,
+  user_id       varchar(32) NOT NULL,
+  hostname      varchar(64) NOT NULL,
+  workflow      varchar(64) NOT NULL,
+  tag           varchar(64) NOT NULL,
+  stage_number  integer NOT NULL,
+  stage         varchar(64) NOT NULL,
+  start_time    timestamp NOT NULL,
+  end_time      timestamp NOT NULL,
+  n_records     integer NOT NULL,
+  duration_sum  double precision NOT NULL,
+  duration_min  double precision NOT NULL,
+  duration_max  double precision NOT NULL,
+  histogram     varchar(1024) NOT NULL
 );"""
 
 DROP_TABLE_SQL = "DROP TABLE workflow_logs;"
 
+LEGACY_TABLE = "workflow_logs_legacy"
+
+RENAME_TABLE_SQL = f"ALTER TABLE workflow_logs RENAME TO {LEGACY_TABLE};"
+
+POPULATE_DIMENSION_SQL = """INSERT INTO {table} (value)
+  SELECT DISTINCT {column} FROM workflow_logs;"""
+
+POPULATE_ENTRIES_SQL = """INSERT INTO workflow_log_entries
+  (id, user_id_key, hostname_key, workflow_key, tag_key, stage_number, stage_key,
+  iteration, date_time, comment, flag, duration_ns, work_bytes, work_files, work_items)
+  SELECT l.id, u.id, h.id, w.id, t.id, l.stage_number, s.id, l.iteration, l.date_time, l.comment, l.flag,
+         l.duration_ns, l.work_bytes, l.work_files, l.work_items
+  FROM workflow_logs l
+  JOIN wfl_user_ids u ON u.value = l.user_id
+  JOIN wfl_hostnames h ON h.value = l.hostname
+  JOIN wfl_workflows w ON w.value = l.workflow
+  JOIN wfl_tags t ON t.value = l.tag
+  JOIN wfl_stages s ON s.value = l.stage
+  ORDER BY l.id;"""
+
+# rows inserted with explicit ids do not advance the postgres sequence
+RESET_SEQUENCE_SQL = """SELECT setval(pg_get_serial_sequence('workflow_log_entries', 'id'),
+  COALESCE(MAX(id), 1)) FROM workflow_log_entries;"""
+
+# columns added since the original schema, which upgrade_db adds to existing databases
+OPTIONAL_COLUMNS = [
+    ("duration_ns", "bigint DEFAULT NULL"),
+    ("work_bytes", "bigint DEFAULT NULL"),
+    ("work_files", "bigint DEFAULT NULL"),
+    ("work_items", "bigint DEFAULT NULL"),
+]
+
+ADD_COLUMN_SQL = "ALTER TABLE {table} ADD COLUMN {column} {definition};"
+
+DROP_VIEW_SQL = "DROP VIEW workflow_logs;"
+
+DROP_COMPACT_SQL = [
+    DROP_VIEW_SQL,
+    "DROP TABLE workflow_log_entries;",
+] + [f"DROP TABLE {table};" for _, table, _ in compact.DIMENSIONS]
+
 
-def create_db():
-    with psycopg2.connect(creds) as conn:
-        with conn.cursor() as curs:
-            curs.execute(CREATE_TABLE_SQL)
+def create_db(backend=None):
+    backend = backend or get_backend()
+    conn = backend.connect()
+    with conn:
+        conn.cursor().execute(backend.ddl(CREATE_TABLE_SQL))
+        conn.cursor().execute(backend.ddl(CREATE_SUMMARIES_TABLE_SQL))
+    conn.close()
 
-def drop_db():
-    with psycopg2.connect(creds) as conn:
-        with conn.cursor() as curs:
-            curs.execute(DROP_TABLE_SQL)
+def drop_db(backend=None):
+    backend = backend or get_backend()
+    conn = backend.connect()
+    with conn:
+        conn.cursor().execute(DROP_TABLE_SQL)
+    conn.close()
+
+
+def create_compact_schema(backend=None):
+    """
+    Create the compact (dictionary-encoded) schema and its workflow_logs view in an empty database
+
+    :param backend: wflogger.backends.Backend, defaults to get_backend()
+    """
+    backend = backend or get_backend()
+    conn = backend.connect()
+    curs = conn.cursor()
+    for statement in compact.create_tables_sql(backend.dialect) + compact.create_view_sql(backend.dialect):
+        curs.execute(statement)
+    curs.execute(backend.ddl(CREATE_SUMMARIES_TABLE_SQL))
+    conn.commit()
+    conn.close()
+
+
+def _add_missing_columns(curs, table):
+    curs.execute(f"SELECT * FROM {table} WHERE 1 = 0")
+    existing = set(column[0] for column in curs.description)
+    added = []
+    for column, definition in OPTIONAL_COLUMNS:
+        if column not in existing:
+            curs.execute(ADD_COLUMN_SQL.format(table=table, column=column, definition=definition))
+            added.append(column)
+    return added
+
+
+def upgrade_db(backend=None, compact_schema=False):
+    """
+    Add the optional columns (and tables) missing from a database created by an earlier version of wflogger
+
+    With the compact schema the columns are added to workflow_log_entries, and the workflow_logs
+    view and its triggers are re-created to include them.
+
+    :param backend: wflogger.backends.Backend, defaults to get_backend()
+    :param compact_schema: the database uses the compact schema
+    :return: list of the names of the columns added
+    """
+    backend = backend or get_backend()
+    conn = backend.connect()
+    curs = conn.cursor()
+    try:
+        added = _add_missing_columns(curs, "workflow_log_entries" if compact_schema else "workflow_logs")
+        if compact_schema and added:
+            curs.execute(DROP_VIEW_SQL)
+            for statement in compact.create_view_sql(backend.dialect):
+                curs.execute(statement)
+        curs.execute(backend.ddl(CREATE_SUMMARIES_TABLE_SQL))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return added
+
+
+def migrate_to_compact_schema(backend=None):
+    """
+    Migrate an existing workflow_logs table to the compact schema, in a single transaction
+
+    The dimension and entries tables are populated from the existing rows (keeping their ids),
+    the original table is renamed to workflow_logs_legacy and replaced by the compatibility view.
+    The legacy table can be dropped once the migration has been checked.
+
+    :param backend: wflogger.backends.Backend, defaults to get_backend()
+    """
+    backend = backend or get_backend()
+    dialect = backend.dialect
+    conn = backend.connect()
+    curs = conn.cursor()
+    try:
+        _add_missing_columns(curs, "workflow_logs")
+        for statement in compact.create_tables_sql(dialect):
+            curs.execute(statement)
+        for column, table, _ in compact.DIMENSIONS:
+            curs.execute(POPULATE_DIMENSION_SQL.format(table=table, column=column))
+        curs.execute(POPULATE_ENTRIES_SQL)
+        if dialect == "postgres":
+            curs.execute(RESET_SEQUENCE_SQL)
+        curs.execute(RENAME_TABLE_SQL)
+        for statement in compact.create_view_sql(dialect):
+            curs.execute(statement)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def drop_compact_schema(backend=None):
+    """
+    Drop the compact schema (view, entries and dimension tables)
+
+    :param backend: wflogger.backends.Backend, defaults to get_backend()
+    """
+    backend = backend or get_backend()
+    conn = backend.connect()
+    curs = conn.cursor()
+    for statement in DROP_COMPACT_SQL:
+        curs.execute(statement)
+    conn.commit()
+    conn.close()
 
 
 if __name__ == "__main__":
- #   drop_db()
-    create_db()
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--compact", action="store_true",
+                        help="Create the compact (dictionary-encoded) schema instead of the workflow_logs table")
+    parser.add_argument("--migrate-compact", action="store_true",
+                        help="Migrate the existing workflow_logs table to the compact schema")
+    parser.add_argument("--upgrade", action="store_true",
+                        help="Add the columns introduced by newer versions of wflogger to an existing database "
+                             "(use with --compact for the compact schema)")
+    parser.add_argument("--sqlite-path", default=None,
+                        help="Use a SQLite database with the specified path instead of postgres")
+    args = parser.parse_args()
+    backend = get_backend(args.sqlite_path)
+
+ #   drop_db(backend)
+    if args.upgrade:
+        upgrade_db(backend, compact_schema=args.compact)
+    elif args.migrate_compact:
+        migrate_to_compact_schema(backend)
+    elif args.compact:
+        create_compact_schema(backend)
+    else:
+        create_db(backend)
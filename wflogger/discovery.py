@@ -0,0 +1,110 @@
+"""
+Discovery of log files for the LogIngestor
+
+Walks directory trees with os.scandir (which, on most filesystems, returns file types without a
+stat call per entry) and optionally skips files that have not changed since they were last
+ingested, according to a manifest of their sizes and modification times.
+
+The manifest also records how many lines of each file have been ingested, so a file which has
+grown since (e.g. the log of a job that is still running) is resumed after those lines rather than
+ingested again. A file which has shrunk, or been replaced by another file (inode), is re-ingested
+in full.
+"""
+
+import fnmatch
+import json
+import os
+
+
+class Manifest:
+    """Record of the size, modification time, inode and number of lines of each successfully ingested log file"""
+
+    def __init__(self, path):
+        """
+        Constructor
+
+        :param path: the filesystem path of the manifest (JSON) file, which need not exist yet
+        """
+        self.path = path
+        self.files = {}
+        self._pending = {}
+        if os.path.isfile(path):
+            with open(path) as f:
+                self.files = json.load(f)
+
+    def changed(self, path, stat_result):
+        """
+        Check whether a file is new or has changed since it was recorded
+
+        :param path: the filesystem path of the log file
+        :param stat_result: os.stat_result of the log file
+        :return: True if the file should be ingested
+        """
+        signature = [stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino]
+        if self.files.get(path, [])[:2] == signature[:2]:
+            return False
+        self._pending[path] = signature
+        return True
+
+    def start_line(self, path):
+        """
+        Get the number of lines of a file (previously checked with changed()) which have already been ingested
+
+        :param path: the filesystem path of the log file
+        :return: the number of lines to skip, 0 if the file is new, has shrunk or has been replaced
+        """
+        recorded = self.files.get(path)
+        signature = self._pending.get(path)
+        # manifests written by earlier versions do not record the inode or the number of lines
+        if not recorded or len(recorded) < 4 or signature is None:
+            return 0
+        size, _, inode, n_lines = recorded
+        return n_lines if signature[2] == inode and signature[0] >= size else 0
+
+    def record(self, path, n_lines):
+        """
+        Record that a file (previously checked with changed()) has been ingested
+
+        The size and modification time are those from before the file was read, so lines written
+        while it was being read are picked up by the next run.
+
+        :param path: the filesystem path of the log file
+        :param n_lines: the number of (complete) lines of the file which have been ingested
+        """
+        if path not in self._pending:
+            stat_result = os.stat(path)
+            self._pending[path] = [stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino]
+        self.files[path] = self._pending.pop(path) + [n_lines]
+
+    def save(self):
+        """Write the manifest, replacing the previous version atomically"""
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.files, f)
+        os.replace(tmp_path, self.path)
+
+
+def discover_logs(roots, name_pattern="*", manifest=None):
+    """
+    Recursively find log files under one or more directories
+
+    :param roots: list of directories to search
+    :param name_pattern: only yield files whose names match this fnmatch-style pattern, e.g. "*.log*"
+    :param manifest: skip files that are unchanged according to this Manifest
+    :return: generator of file paths
+    """
+    stack = list(roots)
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+        except OSError:
+            continue
+
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                stack.append(entry.path)
+            elif entry.is_file() and fnmatch.fnmatch(entry.name, name_pattern):
+                if manifest is None or manifest.changed(entry.path, entry.stat()):
+                    yield entry.path
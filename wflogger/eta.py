@@ -0,0 +1,400 @@
+"""
+Predict the remaining runtime of in-progress workflow iterations from past runs
+
+The duration of each stage of past runs is summarised in the workflow_stage_stats table: one row
+per user/workflow/tag/stage holding the count, sum, sum of squares, min and max of the durations,
+and the sum and sum of squares of their logarithms. The sums are additive, so refresh_stage_stats
+only reads the rows written since the last refresh (the ids above a high-water mark kept in the
+workflow_stage_stats_progress table), together with the earlier rows of the same iterations that
+are needed to compute their durations. The statistics outlive the raw rows deleted by retention.
+
+On postgres a row can be committed after rows with higher ids, so the high-water mark stops short
+of any id missing among the newest ids: its row may still be on its way. The missing ids are kept
+in the workflow_stage_stats_gaps table with the time they were first seen, and given up after the
+gap timeout (the ids of rolled back transactions are never used). SQLite commits in id order, so
+nothing is waited for there.
+
+predict_eta then answers from the statistics and one indexed query of the iterations of a
+workflow/tag, rather than by scanning workflow_logs:
+
+    - each stage's durations are modelled as log-normal, fitted from the sums of the logarithms
+    - the ETA of an iteration is the expected time left in its current stage plus the mean
+      durations of its remaining stages, and eta_p90 is the (conservative) sum of their 90th
+      percentiles, e.g. for sizing batch-queue allocations
+    - an iteration is "stuck" when its current stage has already run for longer than the 99th
+      percentile of that stage's past durations
+
+Tags without any history of their own are predicted from the history of the workflow's other tags.
+Iterations without a record in the last max_age_days are taken to be abandoned, not in progress.
+"""
+
+import datetime
+import logging
+import time
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+
+from .analysis import add_duration_column
+from .backends import get_backend
+from .credentials import user_id as default_user_id
+from .retention import COLUMNS, LEAST_GREATEST
+
+DEFAULT_BATCH_SIZE = 100000
+
+# ids missing among this many of the newest ids are taken to belong to transactions still in flight,
+# and older missing ids to rolled back (or deleted) rows
+DEFAULT_LOOKBACK = 10000
+
+# seconds to wait for the row of a missing id to be committed
+DEFAULT_GAP_TIMEOUT = 600
+
+# iterations whose last record is older than this are not predicted
+DEFAULT_MAX_AGE_DAYS = 7
+
+# durations are clamped to this many seconds before taking their logarithms
+MIN_DURATION = 1e-6
+
+# percentiles of the durations of each stage computed by fit_stage_profile
+QUANTILES = (50, 90, 99)
+
+# an iteration is only reported as stuck in a stage with at least this many past durations
+MIN_RECORDS_FOR_STUCK = 5
+
+# identifies a run of a workflow, as compared by analysis.rows_match (less the hostname)
+JOB_COLUMNS = ["user_id", "workflow", "tag", "iteration"]
+
+STATS_KEY_COLUMNS = ["user_id", "workflow", "tag", "stage_number", "stage"]
+
+CREATE_STAGE_STATS_TABLE_SQL = """CREATE TABLE IF NOT EXISTS workflow_stage_stats (
+  user_id         varchar(32) NOT NULL,
+  workflow        varchar(64) NOT NULL,
+  tag             varchar(64) NOT NULL,
+  stage_number    integer NOT NULL,
+  stage           varchar(64) NOT NULL,
+  n_records       integer NOT NULL,
+  duration_sum    double precision NOT NULL,
+  duration_sumsq  double precision NOT NULL,
+  log_sum         double precision NOT NULL,
+  log_sumsq       double precision NOT NULL,
+  duration_min    double precision NOT NULL,
+  duration_max    double precision NOT NULL,
+  PRIMARY KEY (user_id, workflow, tag, stage_number, stage)
+);"""
+
+CREATE_PROGRESS_TABLE_SQL = """CREATE TABLE IF NOT EXISTS workflow_stage_stats_progress (
+  name            varchar(32) PRIMARY KEY,
+  last_id         bigint NOT NULL
+);"""
+
+CREATE_GAPS_TABLE_SQL = """CREATE TABLE IF NOT EXISTS workflow_stage_stats_gaps (
+  id              bigint PRIMARY KEY,
+  first_seen      double precision NOT NULL
+);"""
+
+MAX_ID_SQL = "SELECT MAX(id) FROM {table}"
+
+SELECT_IDS_SQL = "SELECT id FROM {table} WHERE id > %s AND id <= %s ORDER BY id"
+
+SELECT_LAST_ID_SQL = "SELECT last_id FROM workflow_stage_stats_progress WHERE name = 'workflow_logs'"
+
+UPSERT_LAST_ID_SQL = """INSERT INTO workflow_stage_stats_progress (name, last_id) VALUES ('workflow_logs', %s)
+  ON CONFLICT (name) DO UPDATE SET last_id = EXCLUDED.last_id"""
+
+SELECT_GAPS_SQL = "SELECT id, first_seen FROM workflow_stage_stats_gaps"
+
+INSERT_GAP_SQL = "INSERT INTO workflow_stage_stats_gaps (id, first_seen) VALUES (%s, %s)"
+
+DELETE_GAPS_SQL = "DELETE FROM workflow_stage_stats_gaps WHERE id <= %s"
+
+# all the rows of the iterations which have rows in an id range
+SELECT_ITERATIONS_SQL = """SELECT {columns} FROM workflow_logs
+  WHERE id <= %s AND (user_id, workflow, tag, iteration) IN
+  (SELECT user_id, workflow, tag, iteration FROM workflow_logs WHERE id > %s AND id <= %s)"""
+
+UPSERT_STAGE_STATS_SQL = """INSERT INTO workflow_stage_stats
+  (user_id, workflow, tag, stage_number, stage, n_records, duration_sum, duration_sumsq,
+  log_sum, log_sumsq, duration_min, duration_max)
+  VALUES
+  (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+  ON CONFLICT (user_id, workflow, tag, stage_number, stage) DO UPDATE SET
+  n_records = workflow_stage_stats.n_records + EXCLUDED.n_records,
+  duration_sum = workflow_stage_stats.duration_sum + EXCLUDED.duration_sum,
+  duration_sumsq = workflow_stage_stats.duration_sumsq + EXCLUDED.duration_sumsq,
+  log_sum = workflow_stage_stats.log_sum + EXCLUDED.log_sum,
+  log_sumsq = workflow_stage_stats.log_sumsq + EXCLUDED.log_sumsq,
+  duration_min = {least}(workflow_stage_stats.duration_min, EXCLUDED.duration_min),
+  duration_max = {greatest}(workflow_stage_stats.duration_max, EXCLUDED.duration_max)"""
+
+SELECT_STAGE_STATS_SQL = """SELECT tag, stage_number, stage, n_records, duration_sum, duration_sumsq,
+  log_sum, log_sumsq, duration_min, duration_max
+  FROM workflow_stage_stats WHERE user_id = %s AND workflow = %s"""
+
+SELECT_PROGRESS_SQL = """SELECT iteration, MAX(stage_number), MAX(date_time) FROM workflow_logs
+  WHERE user_id = %s AND workflow = %s AND tag = %s{conditions} GROUP BY iteration ORDER BY iteration"""
+
+logger = logging.getLogger("ETA")
+
+
+def _shards(backend):
+    # the statistics of a sharded backend are kept (and refreshed) in each shard
+    return getattr(backend, "shards", [backend])
+
+
+def prepare_eta(backend=None, compact_schema=False):
+    """
+    Create the statistics tables and the index used to find the rows of an iteration
+
+    On postgres the index is built concurrently, so that writes to the table are not blocked while
+    it is built (the first time).
+
+    :param backend: wflogger.backends.Backend, defaults to get_backend()
+    :param compact_schema: the database uses the compact schema, so index the entries table
+    """
+    backend = backend or get_backend()
+    if compact_schema:
+        table, columns = "workflow_log_entries", "workflow_key, tag_key, iteration"
+    else:
+        table, columns = "workflow_logs", "workflow, tag, iteration"
+
+    conn = backend.connect()
+    curs = conn.cursor()
+    curs.execute(CREATE_STAGE_STATS_TABLE_SQL)
+    curs.execute(CREATE_PROGRESS_TABLE_SQL)
+    curs.execute(CREATE_GAPS_TABLE_SQL)
+    conn.commit()
+    backend.create_index(conn, f"{table}_iteration_idx", table, columns)
+    conn.close()
+
+
+def stage_stats(df):
+    """
+    Aggregate the new rows of a set of iterations into additive per-stage statistics
+
+    :param df: pandas.DataFrame of workflow_logs rows, including a duration column and a boolean
+               "new" column marking the rows not yet included in the statistics
+    :return: list of tuples in the column order of UPSERT_STAGE_STATS_SQL
+    """
+    # the first row of an iteration only marks its start, unless the client measured its duration
+    first = df.groupby(JOB_COLUMNS + ["hostname"], sort=False).cumcount() == 0
+    if "duration_ns" in df.columns:
+        first &= df["duration_ns"].isnull()
+    df = df[df["new"] & ~first]
+
+    duration = df["duration"].astype("float64")
+    log_duration = np.log(duration.clip(lower=MIN_DURATION))
+    df = df.assign(duration=duration, duration_sq=duration ** 2, log=log_duration, log_sq=log_duration ** 2)
+    agg = df.groupby(STATS_KEY_COLUMNS, sort=True).agg(
+        n_records=("duration", "size"), duration_sum=("duration", "sum"), duration_sumsq=("duration_sq", "sum"),
+        log_sum=("log", "sum"), log_sumsq=("log_sq", "sum"),
+        duration_min=("duration", "min"), duration_max=("duration", "max"))
+
+    rows = []
+    for key, values in agg.iterrows():
+        (user_id, workflow, tag, stage_number, stage) = key
+        rows.append((user_id, workflow, tag, int(stage_number), stage, int(values.n_records),
+                     float(values.duration_sum), float(values.duration_sumsq), float(values.log_sum),
+                     float(values.log_sumsq), float(values.duration_min), float(values.duration_max)))
+    return rows
+
+
+def _settled_id(backend, curs, table, last_id, top, lookback, gap_timeout):
+    """
+    Record the ids missing among the newest lookback ids, with the time they were first seen
+
+    :return: the highest id (up to top) below which no missing id is still waited for
+    """
+    low = max(last_id, top - lookback)
+    curs.execute(backend.sql(SELECT_IDS_SQL.format(table=table)), (low, top))
+    present = set(row_id for (row_id,) in curs.fetchall())
+    curs.execute(SELECT_GAPS_SQL)
+    first_seen = dict(curs.fetchall())
+
+    now = time.time()
+    settled = top
+    for missing in range(top, low, -1):
+        if missing in present:
+            continue
+        if missing not in first_seen:
+            curs.execute(backend.sql(INSERT_GAP_SQL), (missing, now))
+            first_seen[missing] = now
+        if first_seen[missing] + gap_timeout > now:
+            settled = missing - 1
+    return settled
+
+
+def _refresh_shard(backend, compact_schema, batch_size, lookback, gap_timeout):
+    least, greatest = LEAST_GREATEST[backend.dialect]
+    upsert_sql = backend.sql(UPSERT_STAGE_STATS_SQL.format(least=least, greatest=greatest))
+    select_sql = backend.sql(SELECT_ITERATIONS_SQL.format(columns=", ".join(COLUMNS)))
+    table = "workflow_log_entries" if compact_schema else "workflow_logs"
+
+    conn = backend.connect()
+    curs = conn.cursor()
+    curs.execute(MAX_ID_SQL.format(table=table))
+    top = curs.fetchone()[0] or 0
+    curs.execute(SELECT_LAST_ID_SQL)
+    row = curs.fetchone()
+    last_id = row[0] if row else 0
+    if lookback:
+        top = _settled_id(backend, curs, table, last_id, top, lookback, gap_timeout)
+    n_rows = 0
+
+    for start in range(last_id, top, batch_size):
+        end = min(start + batch_size, top)
+        curs.execute(select_sql, (end, start, end))
+        df = pd.DataFrame(curs.fetchall(), columns=COLUMNS)
+        if len(df):
+            df["date_time"] = pd.to_datetime(df["date_time"])
+            df = add_duration_column(df, sort_by=JOB_COLUMNS + ["hostname", "stage_number"])
+            df["new"] = df["id"] > start
+            curs.executemany(upsert_sql, stage_stats(df))
+            n_rows += int(df["new"].sum())
+
+        # the statistics and the high-water mark are updated in one transaction
+        curs.execute(backend.sql(UPSERT_LAST_ID_SQL), (end,))
+        curs.execute(backend.sql(DELETE_GAPS_SQL), (end,))
+        conn.commit()
+
+    # the gaps first seen by this refresh, also when there were no rows to add
+    conn.commit()
+    conn.close()
+    return n_rows
+
+
+def refresh_stage_stats(backend=None, compact_schema=False, batch_size=DEFAULT_BATCH_SIZE,
+                        lookback=None, gap_timeout=DEFAULT_GAP_TIMEOUT):
+    """
+    Add the rows written since the last refresh to the per-stage statistics
+
+    :param backend: wflogger.backends.Backend, defaults to get_backend()
+    :param compact_schema: the database uses the compact schema
+    :param batch_size: number of ids read per transaction
+    :param lookback: wait for the rows of ids missing among this many of the newest ids, defaults to
+                     DEFAULT_LOOKBACK on postgres and 0 on SQLite (which commits in id order)
+    :param gap_timeout: seconds after which the row of a missing id is no longer waited for
+    :return: number of rows added
+    """
+    backend = backend or get_backend()
+    n_rows = 0
+    for shard in _shards(backend):
+        shard_lookback = lookback
+        if shard_lookback is None:
+            shard_lookback = DEFAULT_LOOKBACK if shard.dialect == "postgres" else 0
+        n_rows += _refresh_shard(shard, compact_schema, batch_size, shard_lookback, gap_timeout)
+    logger.info("Added %d rows to the stage statistics" % n_rows)
+    return n_rows
+
+
+def fit_stage_profile(stats, tag=None):
+    """
+    Fit the distribution of the durations of each stage from the statistics of a workflow
+
+    :param stats: pandas.DataFrame of workflow_stage_stats rows of one workflow
+    :param tag: use the rows of this tag, or of all the tags if it has none (or if tag is None)
+    :return: pandas.DataFrame indexed by stage_number, with the columns stage, n_records, mean,
+             std, duration_min, duration_max, p50, p90 and p99 (durations in seconds)
+    """
+    if tag is not None and (stats["tag"] == tag).any():
+        stats = stats[stats["tag"] == tag]
+
+    profile = stats.groupby(["stage_number", "stage"], sort=True).agg(
+        {"n_records": "sum", "duration_sum": "sum", "duration_sumsq": "sum", "log_sum": "sum",
+         "log_sumsq": "sum", "duration_min": "min", "duration_max": "max"}).reset_index("stage")
+
+    n = profile["n_records"]
+    profile["mean"] = profile["duration_sum"] / n
+    profile["std"] = (profile["duration_sumsq"] / n - profile["mean"] ** 2).clip(lower=0) ** 0.5
+    mu = profile["log_sum"] / n
+    sigma = (profile["log_sumsq"] / n - mu ** 2).clip(lower=0) ** 0.5
+    for q in QUANTILES:
+        # the log-normal tails can overshoot the range of the durations seen, especially for few records
+        quantile = np.exp(mu + sigma * NormalDist().inv_cdf(q / 100))
+        profile[f"p{q}"] = quantile.clip(lower=profile["duration_min"], upper=profile["duration_max"])
+
+    return profile[["stage", "n_records", "mean", "std", "duration_min", "duration_max", "p50", "p90", "p99"]]
+
+
+def stage_profile(workflow, tag=None, user_id=default_user_id, backend=None):
+    """
+    Get the fitted duration distribution of each stage of a workflow (see fit_stage_profile)
+
+    The sums of the mean and p90 columns are the expected and conservative runtimes of a new iteration.
+
+    :return: pandas.DataFrame indexed by stage_number
+    """
+    backend = (backend or get_backend()).for_workflow(workflow)
+    conn = backend.connect()
+    try:
+        curs = conn.cursor()
+        curs.execute(backend.sql(SELECT_STAGE_STATS_SQL), (user_id, workflow))
+        stats = pd.DataFrame(curs.fetchall(), columns=[column[0] for column in curs.description])
+    finally:
+        conn.close()
+    return fit_stage_profile(stats, tag)
+
+
+def _get_progress(backend, workflow, tag, iterations, user_id, since):
+    conditions, params = "", [user_id, workflow, tag]
+    if since is not None:
+        conditions += " AND date_time >= %s"
+        params.append(since)
+    if iterations:
+        conditions += " AND iteration IN (%s)" % ", ".join(["%s"] * len(iterations))
+        params.extend(iterations)
+
+    conn = backend.connect()
+    try:
+        curs = conn.cursor()
+        curs.execute(backend.sql(SELECT_PROGRESS_SQL.format(conditions=conditions)), params)
+        # the aggregated date-times of sqlite are not converted back into datetimes
+        return [(iteration, stage_number, pd.Timestamp(date_time).to_pydatetime())
+                for iteration, stage_number, date_time in curs.fetchall()]
+    finally:
+        conn.close()
+
+
+def predict_eta(workflow, tag, iterations=None, user_id=default_user_id, backend=None, now=None,
+                stuck_quantile=0.99, max_age_days=DEFAULT_MAX_AGE_DAYS):
+    """
+    Predict the remaining runtime of the in-progress iterations of a workflow/tag
+
+    Uses the statistics written by refresh_stage_stats, so refresh them first to include recent runs.
+
+    :param iterations: only these iterations, defaults to all the iterations of the tag
+    :param now: the current time, defaults to datetime.datetime.now()
+    :param stuck_quantile: report an iteration as stuck when its current stage has run for longer
+                           than this quantile (one of 0.5, 0.9 or 0.99) of the stage's past durations
+    :param max_age_days: skip the iterations without a record in this many days before now, as
+                         abandoned (None to include every iteration of the tag)
+    :return: pandas.DataFrame with one row per in-progress iteration and the columns iteration,
+             stage_number (of the last record), next_stage_number, next_stage, elapsed (seconds since
+             the last record), eta and eta_p90 (seconds), expected_end and stuck
+    """
+    if round(stuck_quantile * 100) not in QUANTILES:
+        raise ValueError(f"The stuck quantile must be one of: {[q / 100 for q in QUANTILES]}")
+
+    backend = (backend or get_backend()).for_workflow(workflow)
+    now = now or datetime.datetime.now()
+    profile = stage_profile(workflow, tag, user_id=user_id, backend=backend)
+    stuck_column = f"p{round(stuck_quantile * 100)}"
+
+    rows = []
+    since = None if max_age_days is None else now - datetime.timedelta(days=max_age_days)
+    for iteration, stage_number, last_date_time in _get_progress(backend, workflow, tag, iterations, user_id,
+                                                                 since):
+        remaining = profile[profile.index > stage_number]
+        if remaining.empty:
+            continue
+
+        elapsed = (now - last_date_time).total_seconds()
+        current, later = remaining.iloc[0], remaining.iloc[1:]
+        eta = max(current["mean"] - elapsed, 0.0) + later["mean"].sum()
+        eta_p90 = max(current["p90"] - elapsed, 0.0) + later["p90"].sum()
+        stuck = bool(current["n_records"] >= MIN_RECORDS_FOR_STUCK and elapsed > current[stuck_column])
+        rows.append((iteration, stage_number, remaining.index[0], current["stage"], elapsed, eta, eta_p90,
+                     now + datetime.timedelta(seconds=eta), stuck))
+
+    return pd.DataFrame(rows, columns=["iteration", "stage_number", "next_stage_number", "next_stage",
+                                       "elapsed", "eta", "eta_p90", "expected_end", "stuck"])
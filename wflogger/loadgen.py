@@ -0,0 +1,237 @@
+"""
+Load generator simulating a cluster of jobs logging to the workflow_logs table
+
+Each simulated node is a separate process running a number of concurrent jobs (threads).
+Each job runs a number of iterations of a number of stages, logging one event per stage
+through either the real insert_record path ("insert" mode) or by writing WFL_START log lines
+and ingesting them with the LogIngestor ("ingest" mode).
+
+Use a local postgres database (given by its connection string) or a sqlite3 file as a stand-in
+for capacity planning, never the production database. run_load refuses to write to the default
+database from the credentials file unless it is forced to.
+"""
+
+import datetime
+import multiprocessing
+import os
+import tempfile
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from .backends import get_backend, PostgresBackend
+from .credentials import user_id, hostname
+from .log_ingestor import LogIngestor, CREATE_TABLE_SQL
+from .wflogger import insert_record
+
+# upper bounds (in seconds) of the latency histogram buckets
+LATENCY_BUCKETS = [0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, float("inf")]
+
+MODES = ("insert", "ingest")
+
+
+class LoadReport:
+    """Latencies, errors and throughput collected from a load generator run"""
+
+    def __init__(self, latencies, errors, events, elapsed):
+        """
+        Constructor
+
+        :param latencies: list of latencies (seconds) of each successful write
+        :param errors: Counter mapping exception type name to number of failed writes
+        :param events: number of events successfully written
+        :param elapsed: wall-clock duration of the run (seconds)
+        """
+        self.latencies = sorted(latencies)
+        self.errors = errors
+        self.events = events
+        self.elapsed = elapsed
+
+    @property
+    def throughput(self):
+        return self.events / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def error_rate(self):
+        n_errors = sum(self.errors.values())
+        n_writes = len(self.latencies) + n_errors
+        return n_errors / n_writes if n_writes else 0.0
+
+    def percentile(self, pct):
+        if not self.latencies:
+            return 0.0
+        index = min(len(self.latencies) - 1, int(round(pct / 100 * (len(self.latencies) - 1))))
+        return self.latencies[index]
+
+    def histogram(self):
+        """
+        Bin the latencies into LATENCY_BUCKETS
+
+        :return: list of (bucket-upper-bound, count) tuples
+        """
+        counts = [0] * len(LATENCY_BUCKETS)
+        bucket = 0
+        for latency in self.latencies:
+            while latency > LATENCY_BUCKETS[bucket]:
+                bucket += 1
+            counts[bucket] += 1
+        return list(zip(LATENCY_BUCKETS, counts))
+
+    def summary(self):
+        """
+        Format the report as human-readable text
+
+        :return: multi-line string
+        """
+        lines = ["Events written: %d in %.2fs (%.1f events/s)" % (self.events, self.elapsed, self.throughput),
+                 "Errors: %d (%.2f%%)" % (sum(self.errors.values()), 100 * self.error_rate)]
+        for error_type, count in self.errors.most_common():
+            lines.append("    %-30s %d" % (error_type, count))
+
+        lines.append("Latency (s): p50=%.4f p90=%.4f p99=%.4f max=%.4f" % (
+            self.percentile(50), self.percentile(90), self.percentile(99), self.percentile(100)))
+
+        peak = max([count for _, count in self.histogram()] + [1])
+        for upper, count in self.histogram():
+            label = "<= %gs" % upper if upper != float("inf") else "> %gs" % LATENCY_BUCKETS[-2]
+            lines.append("    %-10s %8d %s" % (label, count, "#" * int(40 * count / peak)))
+
+        return "\n".join(lines)
+
+
+def _run_job(config, node, job):
+    """
+    Run the stages of one simulated job
+
+    :return: (list-of-latencies, Counter-of-errors, number-of-events-written)
+    """
+    workflow = config["workflow"]
+    tag = "node%03d-job%03d" % (node, job)
+    backend = _get_target(config["sqlite_path"], config["dsn"])
+    latencies, errors, events = [], Counter(), 0
+
+    if config["mode"] == "insert":
+        for iteration in range(1, config["iterations"] + 1):
+            for stage_number in range(1, config["stages"] + 1):
+                time.sleep(config["delay"])
+                start = time.perf_counter()
+                try:
+                    insert_record(workflow, tag, stage_number, "stage-%d" % stage_number, iteration,
+                                  backend=backend)
+                except Exception as ex:
+                    errors[type(ex).__name__] += 1
+                else:
+                    latencies.append(time.perf_counter() - start)
+                    events += 1
+        return latencies, errors, events
+
+    # ingest mode: write a log file for the whole job, then ingest it in one go
+    fd, log_path = tempfile.mkstemp(suffix=".log", dir=config["work_dir"])
+    with os.fdopen(fd, "w") as f:
+        for iteration in range(1, config["iterations"] + 1):
+            for stage_number in range(1, config["stages"] + 1):
+                time.sleep(config["delay"])
+                f.write("WFL_START %s | %s | %s | %s | %d | stage-%d | %d | %s | | \n" % (
+                    user_id, hostname, workflow, tag, stage_number, stage_number, iteration,
+                    datetime.datetime.now().strftime(LogIngestor.DATETIME_FORMAT)))
+
+    start = time.perf_counter()
+    try:
+        ingestor = LogIngestor(backend=backend)
+        ingested = ingestor.ingest_log(log_path)
+        ingestor.conn.close()
+    except Exception as ex:
+        errors[type(ex).__name__] += 1
+    else:
+        if ingested:
+            latencies.append(time.perf_counter() - start)
+            events += ingestor.stats()[2]
+        else:
+            errors["IngestFailed"] += 1
+    finally:
+        os.remove(log_path)
+
+    return latencies, errors, events
+
+
+def _run_node(config, node):
+    """
+    Run the concurrent jobs of one simulated node as threads
+
+    :return: (list-of-latencies, Counter-of-errors, number-of-events-written)
+    """
+    latencies, errors, events = [], Counter(), 0
+
+    with ThreadPoolExecutor(max_workers=config["jobs"]) as executor:
+        futures = [executor.submit(_run_job, config, node, job) for job in range(config["jobs"])]
+        for future in futures:
+            job_latencies, job_errors, job_events = future.result()
+            latencies.extend(job_latencies)
+            errors.update(job_errors)
+            events += job_events
+
+    return latencies, errors, events
+
+
+def _get_target(sqlite_path, dsn):
+    if dsn and not sqlite_path:
+        return PostgresBackend(dsn)
+    return get_backend(sqlite_path)
+
+
+def _prepare_sqlite(sqlite_path):
+    backend = get_backend(sqlite_path)
+    conn = backend.connect()
+    with conn:
+        exists = conn.execute("SELECT name FROM sqlite_master WHERE name = 'workflow_logs'").fetchall()
+        if not exists:
+            conn.execute(backend.ddl(CREATE_TABLE_SQL))
+    conn.close()
+
+
+def run_load(nodes=1, jobs=4, stages=5, iterations=10, mode="insert", sqlite_path=None,
+             delay=0.0, workflow=None, dsn=None, force=False):
+    """
+    Simulate N nodes x M concurrent jobs x K stages of logging traffic
+
+    :param nodes: number of simulated nodes (processes)
+    :param jobs: number of concurrent jobs (threads) per node
+    :param stages: number of stages logged per iteration of each job
+    :param iterations: number of iterations run by each job
+    :param mode: "insert" to log through insert_record, "ingest" to log through the LogIngestor
+    :param sqlite_path: write to a sqlite3 database at this path instead of postgres
+    :param dsn: write to the (local, stand-in) postgres database with this libpq connection string
+    :param delay: simulated processing time (seconds) before each stage is logged
+    :param workflow: workflow name to log under, defaults to a unique "loadgen-..." name
+    :param force: allow writing to the default database (from the credentials file), which is
+                  usually the production database
+    :return: LoadReport
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown load generator mode '{mode}', must be one of: {MODES}")
+
+    if not (sqlite_path or dsn or force) and get_backend().name != "sqlite":
+        raise ValueError("Refusing to generate load on the default (production) database, "
+                         "give a SQLite path or the DSN of a local postgres database, or force it")
+
+    if sqlite_path:
+        _prepare_sqlite(sqlite_path)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        config = {"jobs": jobs, "stages": stages, "iterations": iterations, "mode": mode,
+                  "sqlite_path": sqlite_path, "dsn": dsn, "delay": delay, "work_dir": work_dir,
+                  "workflow": workflow or "loadgen-" + uuid.uuid4().hex[:8]}
+
+        start = time.perf_counter()
+        with multiprocessing.Pool(nodes) as pool:
+            results = pool.starmap(_run_node, [(config, node) for node in range(nodes)])
+        elapsed = time.perf_counter() - start
+
+    latencies, errors, events = [], Counter(), 0
+    for node_latencies, node_errors, node_events in results:
+        latencies.extend(node_latencies)
+        errors.update(node_errors)
+        events += node_events
+
+    return LoadReport(latencies, errors, events, elapsed)
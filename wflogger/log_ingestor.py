@@ -8,25 +8,42 @@ Some example usages:
 
 (1) ingest from log file /tmp/log1.txt
 
-python log_ingestor.py /tmp/log1.txt
+python -m wflogger.log_ingestor /tmp/log1.txt
 
 (2) ingest from log files from /tmp/test1/a/*.log and /tmp/test1/b/*.log, writing verbose output
 
-python log_ingestor.py --verbose /tmp/test1/a/*.log /tmp/test1/b/*.log
+python -m wflogger.log_ingestor --verbose /tmp/test1/a/*.log /tmp/test1/b/*.log
 
 (3) clear the database and ingest from log files from /tmp/test1/a/*.log
 
-python log_ingestor.py --reset /tmp/test1/a/*.log
+python -m wflogger.log_ingestor --reset /tmp/test1/a/*.log
 
 (4) using a sqlite3 database rather than postgres, setup the database and ingest from log files from /tmp/test1/b/*.log
 
-python log_ingestor.py --sqlite-path test.db --setup /tmp/test1/b/*.log
+python -m wflogger.log_ingestor --sqlite-path test.db --setup /tmp/test1/b/*.log
+
+(5) ingest from log file /tmp/log1.txt and write wflogger's own timings to a Prometheus textfile
+
+python -m wflogger.log_ingestor --metrics-file /var/lib/node_exporter/wflogger.prom /tmp/log1.txt
+
+(6) ingest from all the (possibly gzip/bz2/xz/zstd-compressed) log files below /tmp/test1, skipping any
+    files which are unchanged since they were last ingested, and resuming files which have grown after
+    the lines already ingested
+
+python -m wflogger.log_ingestor --recursive --name-pattern "*.log*" --manifest /tmp/manifest.json /tmp/test1
+
+(7) ingest the valid entries from log files /tmp/test1/a/*.log, recording any lines which cannot be parsed
+    in /tmp/quarantine.jsonl, then (after correcting the lines in that file) re-ingest only those lines
+
+python -m wflogger.log_ingestor --lenient --quarantine /tmp/quarantine.jsonl /tmp/test1/a/*.log
+python -m wflogger.log_ingestor --reingest-quarantine /tmp/quarantine.jsonl
 
 Log line format:
 
 Log lines that contain the token WFL_START will be interpreted as | delimited workflow log entries after the token:
 
 ... WFL_START <user_id> | <hostname> | <workflow> | <tag> | <stage_number> | <stage> | <iteration> | <date_time> | <comment> | <flag>
+    [| <duration_ns> | <work_bytes> | <work_files> | <work_items>]
 
 where:
     <user_id> is a string username (32 chars max)
@@ -39,20 +56,36 @@ where:
     <date_time> is the date-time including microseconds, formatted exactly thus: 2022-11-28 14:34:27.393315
     <comment> is an additional comment (may be blank)
     <flag> is an additional integer tag (may be blank)
+    <duration_ns> is the duration of the stage in nanoseconds, measured with a monotonic clock by the
+                  client (optional, the field may be omitted or blank)
+    <work_bytes>, <work_files> and <work_items> are integer counts of the work done by the stage, e.g.
+                  the number of bytes read (optional, the fields may be omitted or blank)
 
 Note:
     fields should not contain the | symbol
 """
 
+import bz2
+import gzip
+import io
 import logging
 import datetime
+import itertools
+import json
+import lzma
 import os.path
+import time
+
+from .backends import get_backend, without_unset_columns
+from .metrics import metrics
+from . import compact
 
 INSERT_SQL = """INSERT INTO workflow_logs
   (user_id, hostname, workflow, tag, stage_number, stage,
-  iteration, date_time, comment, flag)
+  iteration, date_time, comment, flag, duration_ns,
+  work_bytes, work_files, work_items)
   VALUES
-  (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"""
+  (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"""
 
 CREATE_TABLE_SQL = """CREATE TABLE workflow_logs (
   id            serial PRIMARY KEY,
@@ -65,19 +98,65 @@ CREATE_TABLE_SQL = """CREATE TABLE workflow_logs (
   iteration     integer DEFAULT 0,
   date_time     timestamp DEFAULT current_timestamp,
   comment       varchar(128) DEFAULT '',
-  flag          integer DEFAULT -999
+  flag          integer DEFAULT -999,
+  duration_ns   bigint DEFAULT NULL,
+  work_bytes    bigint DEFAULT NULL,
+  work_files    bigint DEFAULT NULL,
+  work_items    bigint DEFAULT NULL
 );"""
 
 DELETE_FROM_TABLE_SQL = "DELETE FROM workflow_logs;"
 
+DELETE_FROM_ENTRIES_SQL = "DELETE FROM workflow_log_entries;"
+
 COUNT_QUERY_SQL = "SELECT COUNT(*) FROM workflow_logs;"
 
 
+# leading bytes identifying each supported compression format
+GZIP_MAGIC = b"\x1f\x8b"
+BZIP2_MAGIC = b"BZh"
+XZ_MAGIC = b"\xfd7zXZ\x00"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+def open_log(path):
+    """
+    Open a log file for reading as text, transparently decompressing gzip, bzip2, xz and
+    (if the zstandard package is installed) zstd files as they are streamed
+
+    :param path: the filesystem path of the log file
+    :return: text file object
+    """
+    with open(path, "rb") as f:
+        magic = f.read(6)
+
+    if magic.startswith(GZIP_MAGIC):
+        return gzip.open(path, "rt")
+    if magic.startswith(BZIP2_MAGIC):
+        return bz2.open(path, "rt")
+    if magic.startswith(XZ_MAGIC):
+        return lzma.open(path, "rt")
+    if magic.startswith(ZSTD_MAGIC):
+        try:
+            import zstandard
+        except ImportError:
+            raise IOError(f"The zstandard package is required to read zstd-compressed log file: {path}")
+        reader = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+        return io.TextIOWrapper(reader)
+    return open(path)
+
+
 class ParsingError(ValueError):
     """Exception sub-class to describe an error encountered attempting to parse a log line"""
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, reason="unknown", **kwargs):
+        """
+        Constructor
+
+        :param reason: short category of the error (e.g. field_count, integer, datetime), used in metrics
+        """
         super().__init__(*args, **kwargs)
+        self.reason = reason
 
 
 class LogIngestor:
@@ -90,54 +169,74 @@ class LogIngestor:
 
     DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
 
-    def __init__(self, sqlite_database_path=None, verbose=False):
+    # integer fields which may follow the 10 required fields of an entry
+    OPTIONAL_FIELDS = ("duration_ns", "work_bytes", "work_files", "work_items")
+
+    def __init__(self, sqlite_database_path=None, verbose=False, compact_schema=False, backend=None,
+                 lenient=False, quarantine_path=None):
         """
         Constructor
 
         :param sqlite_database_path: write to an SQL database at this path instead of Postgres
+        :param compact_schema: the database uses the compact (dictionary-encoded) schema, see wflogger.compact
+        :param backend: write to this wflogger.backends.Backend (overrides sqlite_database_path)
+        :param lenient: ingest the valid entries of a log file even if some of its entries cannot be parsed
+                        (requires a quarantine_path, so that the rejected lines can be recovered)
+        :param quarantine_path: in lenient mode, append the rejected lines (with their line numbers and the
+                                reasons) to this file, as JSON lines
         """
         self.logger = logging.getLogger("LogScanner")
-        self.insert_sql = INSERT_SQL
-        if sqlite_database_path:
-            import sqlite3
-            self.conn = sqlite3.connect(sqlite_database_path)
-            # Sqlite uses ? rather than %s paramstyle, customise the insert SQL accordingly
-            self.insert_sql = self.insert_sql.replace("%s", "?")
-            self.logger.info("Writing to Sqlite database file %s" % sqlite_database_path)
-        else:
-            import psycopg2
-            creds_file = os.path.join(os.environ.get("HOME"), ".wflogger")
-            if not os.path.isfile(creds_file):
-                raise IOError(f"Required credentials file does not exist: {creds_file}")
-            status = os.stat(creds_file)
-            if oct(status.st_mode)[-3:] != "400":
-                raise PermissionError(f"File permissions on credentials file must be read-only for user: 0400")
-            creds = open(creds_file).read()
-            self.conn = psycopg2.connect(creds)
-            self.logger.info("Writing to postgres database using credentials in file %s" % creds_file)
+        if lenient and not quarantine_path:
+            raise ValueError("Lenient ingestion requires a quarantine path, or the rejected lines would be lost")
+        self.lenient = lenient
+        self.quarantine_path = quarantine_path
+        self.backend = backend or get_backend(sqlite_database_path)
+        self.dialect = self.backend.dialect
+        self.conn = self.backend.connect()
+        # customise the SQL for the backend, e.g. Sqlite uses ? rather than %s paramstyle
+        self.insert_sql = self.backend.sql(INSERT_SQL)
+        self.create_table_sql = self.backend.ddl(CREATE_TABLE_SQL)
+        self.logger.info("Writing to database %s" % self.backend)
+
+        # with the compact schema, resolve the dimension keys on the client and write the entries table directly
+        self.dimension_cache = None
+        if compact_schema:
+            if self.backend.name == "sharded":
+                raise ValueError("The compact schema cannot be used with a sharded backend")
+            self.dimension_cache = compact.DimensionCache(self.conn, self.dialect)
+            self.insert_sql = compact.insert_entry_sql(self.dialect)
 
         # track some stats
         self.ingested_files = 0
         self.failed_files = 0
         self.entries_ingested = 0
+        self.entries_rejected = 0
+        # the number of complete lines read from the last log file, from which it can be resumed
+        self.last_line_nr = 0
 
     def stats(self):
         """
         Return stats on the processing completed by this instance
 
-        :return: (nr-files-ingested-successfully,nr-files-failed-to-ingest,total-entries-ingested)
+        :return: (nr-files-ingested-successfully,nr-files-failed-to-ingest,total-entries-ingested,
+                  total-entries-rejected)
         """
-        return (self.ingested_files,self.failed_files,self.entries_ingested)
+        return (self.ingested_files,self.failed_files,self.entries_ingested,self.entries_rejected)
 
     def prepare_database(self):
         """
-        Attempt to prepare the database by creating the workflow_logs table
+        Attempt to prepare the database by creating the workflow_logs table (or the compact schema)
 
         Will log and then ignore any errors (for example, table already exists)
         """
         try:
             cursor = self.conn.cursor()
-            cursor.execute(CREATE_TABLE_SQL)
+            if self.dimension_cache:
+                for statement in compact.create_tables_sql(self.dialect) + compact.create_view_sql(self.dialect):
+                    cursor.execute(statement)
+                self.conn.commit()
+            else:
+                cursor.execute(self.create_table_sql)
         except Exception as ex:
             self.logger.exception(ex)
 
@@ -149,7 +248,7 @@ class LogIngestor:
         """
         try:
             curs = self.conn.cursor()
-            curs.execute(DELETE_FROM_TABLE_SQL)
+            curs.execute(DELETE_FROM_ENTRIES_SQL if self.dimension_cache else DELETE_FROM_TABLE_SQL)
         except Exception as ex:
             self.logger.exception(ex)
 
@@ -161,77 +260,256 @@ class LogIngestor:
         """
         try:
             cursor = self.conn.cursor()
-            rs = cursor.execute(COUNT_QUERY_SQL).fetchall()
-            return rs[0][0]
+            cursor.execute(COUNT_QUERY_SQL)
+            rs = cursor.fetchall()
+            # a sharded backend returns the count of each shard
+            return sum(row[0] for row in rs)
         except Exception as ex:
             self.logger.exception(ex)
             return -1
 
-    def ingest_log(self, path):
+    def ingest_logs(self, paths, manifest=None):
+        """
+        Ingest entries from log files into the database, resuming each file after the lines already
+        ingested according to a manifest
+
+        :param paths: iterable of the filesystem paths of the log files (checked with manifest.changed)
+        :param manifest: wflogger.discovery.Manifest in which to record the files ingested, or None
+        """
+        for path in paths:
+            if manifest is None:
+                self.ingest_log(path)
+            elif self.ingest_log(path, manifest.start_line(path), resumable=True):
+                manifest.record(path, self.last_line_nr)
+
+    def ingest_log(self, path, start_line=0, resumable=False):
         """
         Ingest entries from a log file into the database
 
+        In lenient mode, entries which cannot be parsed are written to the quarantine file and the
+        remaining entries are ingested. The rejected lines are only quarantined once the remaining
+        entries have been committed, so a file whose ingestion fails can be retried without
+        quarantining its lines twice.
+
         :param path: the filesystem path of the log file
-        :return: True iff at least one entry was found and ALL found entries were successfully ingested
+        :param start_line: skip this many lines, which have already been ingested
+        :param resumable: the file may still be being written, so leave an incomplete last line (without
+                          a newline) to be ingested when the file is resumed from self.last_line_nr
+        :return: True iff at least one entry was found (counting the skipped lines) and ALL found entries
+                 were successfully ingested (or, in lenient mode, quarantined)
         """
-        with open(path) as f:
+        metrics.inc("wflogger_files_scanned_total")
+        metrics.inc("wflogger_bytes_scanned_total", os.path.getsize(path))
+        self.last_line_nr = start_line
+
+        def numbered_lines():
+            for line_nr, logline in itertools.islice(enumerate(f, start=1), start_line, None):
+                if resumable and not logline.endswith("\n"):
+                    return
+                self.last_line_nr = line_nr
+                yield line_nr, logline
+
+        with open_log(path) as f:
             try:
                 # collect all the entries in the log file
-                entries = []
-                line_nr = 0
-                for logline in f.readlines():
-                    line_nr += 1
-                    if LogIngestor.START_TOKEN in logline:
-                        start_index = logline.find(LogIngestor.START_TOKEN)
-                        entry = self.__parse_entry(logline[start_index + len(LogIngestor.START_TOKEN):], line_nr)
-                        entries.append(entry)
-                # bulk insert the entries
-                nr_entries = len(entries)
-                if nr_entries > 0:
-                    cursor = self.conn.cursor()
-                    cursor.executemany(self.insert_sql, entries)
-                    self.conn.commit()
-                    self.logger.info("Ingested %d entries from log file %s" % (nr_entries, path))
-                    self.ingested_files += 1
-                    self.entries_ingested += nr_entries
-                    return True
-                else:
-                    # no entries found, treat as a fail
-                    self.failed_files += 1
-                    return False
+                entries, rejected = self.__parse_lines(numbered_lines(), path)
             except ParsingError as ex:
                 # if there are problems parsing this log file - rollback any updates
                 self.conn.rollback()
                 self.logger.error("Unable to ingest log file %s due to error: %s" % (path, str(ex)))
                 return False
 
+        # bulk insert the entries (a resumed file had entries before, but may have no new ones)
+        if self.__write_entries(entries, path) or rejected or start_line:
+            if rejected:
+                self.logger.warning("Rejected %d entries from log file %s" % (len(rejected), path))
+                self.__quarantine(rejected)
+            self.ingested_files += 1
+            return True
+        else:
+            # no entries found, treat as a fail
+            self.failed_files += 1
+            return False
+
+    def reingest_quarantine(self, quarantine_path):
+        """
+        Re-ingest the lines recorded in a quarantine file, for example after they have been corrected
+
+        Only the quarantined lines are processed, not the log files they came from. Lines which still
+        cannot be parsed are left in the quarantine file (and not counted as rejected again); the file
+        is removed once it is empty.
+
+        :param quarantine_path: the filesystem path of the quarantine file
+        :return: (nr-entries-ingested, nr-entries-still-rejected)
+        """
+        with open(quarantine_path) as f:
+            records = [json.loads(line) for line in f if line.strip()]
+
+        entries, rejected = [], []
+        for record in records:
+            try:
+                entry = self.__parse_line(record["line"], record["line_nr"])
+            except ParsingError as ex:
+                metrics.inc("wflogger_parse_errors_total", reason=ex.reason)
+                rejected.append(dict(record, reason=ex.reason, error=str(ex)))
+            else:
+                if entry is not None:
+                    entries.append(entry)
+
+        self.__write_entries(entries, quarantine_path)
+
+        if rejected:
+            tmp_path = quarantine_path + ".tmp"
+            with open(tmp_path, "w") as f:
+                for record in rejected:
+                    f.write(json.dumps(record) + "\n")
+            os.replace(tmp_path, quarantine_path)
+        else:
+            os.remove(quarantine_path)
+
+        return (len(entries), len(rejected))
+
+    def __parse_lines(self, numbered_lines, path):
+        """
+        Parse the entries from the lines of a log file
+
+        :param numbered_lines: iterable of (line-number, log-line)
+        :param path: the filesystem path of the log file, recorded against rejected lines
+        :return: (list-of-entries, list-of-rejected-line-records)
+
+        :raises ParserError if a line could not be parsed and this ingestor is not lenient
+        """
+        entries = []
+        rejected = []
+        n_lines = 0
+        parse_start = time.perf_counter()
+        try:
+            for line_nr, logline in numbered_lines:
+                n_lines += 1
+                try:
+                    entry = self.__parse_line(logline, line_nr)
+                except ParsingError as ex:
+                    metrics.inc("wflogger_parse_errors_total", reason=ex.reason)
+                    if not self.lenient:
+                        raise
+                    rejected.append({"path": path, "line_nr": line_nr, "reason": ex.reason,
+                                     "error": str(ex), "line": logline.rstrip("\n")})
+                else:
+                    if entry is not None:
+                        entries.append(entry)
+        finally:
+            metrics.inc("wflogger_parse_seconds_total", time.perf_counter() - parse_start)
+            metrics.inc("wflogger_lines_scanned_total", n_lines)
+
+        return entries, rejected
+
+    def __parse_line(self, logline, line_nr):
+        """
+        Parse a log line
+
+        :param logline: the log line
+        :param line_nr: the line number of the log line
+        :return: 14-tuple containing the parsed entry, or None if the line does not contain the WFL_START token
+
+        :raises ParserError if there was a problem reading the entry
+        """
+        if LogIngestor.START_TOKEN not in logline:
+            return None
+        start_index = logline.find(LogIngestor.START_TOKEN)
+        return self.__parse_entry(logline[start_index + len(LogIngestor.START_TOKEN):], line_nr)
+
+    def __quarantine(self, rejected):
+        """
+        Append records of rejected lines to the quarantine file, one JSON object per line
+
+        :param rejected: list of dictionaries describing each rejected line
+        """
+        with open(self.quarantine_path, "a") as f:
+            for record in rejected:
+                f.write(json.dumps(record) + "\n")
+        self.entries_rejected += len(rejected)
+
+    def __write_entries(self, entries, source):
+        """
+        Bulk insert parsed entries into the database in a single transaction
+
+        :param entries: list of parsed entries
+        :param source: description of where the entries came from, for logging
+        :return: True iff at least one entry was written
+        """
+        nr_entries = len(entries)
+        if nr_entries == 0:
+            return False
+
+        db_start = time.perf_counter()
+        try:
+            if self.dimension_cache:
+                entries = [self.dimension_cache.encode(entry) for entry in entries]
+            # leave out the optional columns if no entry has them, for tables created before they were added
+            insert_sql, entries = without_unset_columns(self.insert_sql, entries)
+            cursor = self.conn.cursor()
+            cursor.executemany(insert_sql, entries)
+            self.conn.commit()
+        except Exception:
+            # keys added in the failed transaction no longer exist
+            self.conn.rollback()
+            if self.dimension_cache:
+                self.dimension_cache.keys = None
+            raise
+        db_elapsed = time.perf_counter() - db_start
+        metrics.inc("wflogger_db_seconds_total", db_elapsed)
+        metrics.observe("wflogger_insert_seconds", db_elapsed)
+        metrics.observe("wflogger_batch_rows", nr_entries)
+        metrics.inc("wflogger_records_inserted_total", nr_entries)
+        self.logger.info("Ingested %d entries from %s" % (nr_entries, source))
+        self.entries_ingested += nr_entries
+        return True
+
     def __parse_entry(self, entry, line_nr):
         """
         Parse an entry from a log line.  The entry is the remainder of the line after the marker WFL_START
 
         :param entry: string containing the log line after the WFL_START token
         :param line_nr: the line number of the log line
-        :return: 10-tuple containing the parsed entry
+        :return: 14-tuple containing the parsed entry
 
         :raises ParserError if there was a problem reading the entry
         """
         components = list(map(lambda s: s.strip(), entry.split("|")))
-        if len(components) != 10:
-            raise ParsingError("At line %d: line does not contain the required 10 |-delimited fields, found %d fields"
-                               % (line_nr, len(components)))
+        return self.parse_fields(components, line_nr)
+
+    @classmethod
+    def parse_fields(cls, components, line_nr):
+        """
+        Validate and convert the fields of an entry, as used for log lines (and by wflogger log-batch)
+
+        :param components: list of the 10 required (and up to 4 optional) stripped string fields of the entry
+        :param line_nr: the line number of the entry, for error messages
+        :return: 14-tuple containing the parsed entry
+
+        :raises ParserError if there was a problem reading the entry
+        """
+        if not 10 <= len(components) <= 10 + len(LogIngestor.OPTIONAL_FIELDS):
+            raise ParsingError("At line %d: line does not contain the required 10 (and at most 14) |-delimited fields, "
+                               "found %d fields" % (line_nr, len(components)), reason="field_count")
         user_id = components[0]
         hostname = components[1]
         workflow = components[2]
         tag = components[3]
-        stage_number = self.__parse_integer(components[4], "stage_number", line_nr)
+        stage_number = cls.__parse_integer(components[4], "stage_number", line_nr)
         stage = components[5]
-        iteration = self.__parse_integer(components[6], "iteration", line_nr) if components[6] else 0
-        date_time = self.__parse_date(components[7], "date_time", line_nr)
+        iteration = cls.__parse_integer(components[6], "iteration", line_nr) if components[6] else 0
+        date_time = cls.__parse_date(components[7], "date_time", line_nr)
         comment = components[8]
-        flag = self.__parse_integer(components[9], "flag", line_nr) if components[9] else -999
-        return (user_id, hostname, workflow, tag, stage_number, stage, iteration, date_time, comment, flag)
-
-    def __parse_integer(self, s, field_name, line_nr):
+        flag = cls.__parse_integer(components[9], "flag", line_nr) if components[9] else -999
+        # duration_ns, work_bytes, work_files, work_items
+        optional = tuple(cls.__parse_integer(value, field_name, line_nr) if value else None
+                         for field_name, value in zip(LogIngestor.OPTIONAL_FIELDS, components[10:]))
+        optional += (None,) * (len(LogIngestor.OPTIONAL_FIELDS) - len(optional))
+        return (user_id, hostname, workflow, tag, stage_number, stage, iteration, date_time, comment, flag) + optional
+
+    @staticmethod
+    def __parse_integer(s, field_name, line_nr):
         """
         Parse an integer from one of the string fields in an entry
 
@@ -246,9 +524,10 @@ class LogIngestor:
             return int(s)
         except ValueError:
             raise ParsingError("At line %d: Could not parse field %s value %s as integer"
-                               % (line_nr, field_name, s))
+                               % (line_nr, field_name, s), reason="integer")
 
-    def __parse_date(self, s, field_name, line_nr):
+    @staticmethod
+    def __parse_date(s, field_name, line_nr):
         """
         Parse a datetime value from one of the string fields in an entry
         The entry must be of the format described by example 2022-11-28 14:34:27.393315
@@ -264,33 +543,69 @@ class LogIngestor:
             return datetime.datetime.strptime(s, LogIngestor.DATETIME_FORMAT)
         except ValueError:
             raise ParsingError("At line %d: Could not parse field %s value %s as datetime with format %s"
-                               % (line_nr, field_name, s, LogIngestor.DATETIME_FORMAT))
+                               % (line_nr, field_name, s, LogIngestor.DATETIME_FORMAT), reason="datetime")
 
 if __name__ == '__main__':
     import argparse
     import glob
 
+    from .discovery import Manifest, discover_logs
+
     parser = argparse.ArgumentParser()
-    parser.add_argument("pattern", nargs="+", default=[], help="Specify one or more patterns to locate log files")
+    parser.add_argument("pattern", nargs="*", default=[], help="Specify one or more patterns to locate log files "
+                                                               "(or directories, with --recursive)")
 
     parser.add_argument("--setup", action="store_true", help="Setup database")
     parser.add_argument("--reset", action="store_true", help="Reset database")
     parser.add_argument("--verbose", action="store_true", help="Log verbose messages to console")
+    parser.add_argument("--compact", action="store_true",
+                        help="The database uses the compact (dictionary-encoded) schema")
 
     parser.add_argument("--sqlite-path", default=None,
                         help="Write to a SQLite database with the specified path - useful for debugging")
+    parser.add_argument("--recursive", action="store_true",
+                        help="Treat the patterns as directories and search them recursively for log files")
+    parser.add_argument("--name-pattern", default="*",
+                        help="With --recursive, only ingest files whose names match this pattern, e.g. '*.log*'")
+    parser.add_argument("--manifest", default=None,
+                        help="Skip log files which are unchanged since they were recorded in this manifest file, "
+                             "and record the files that are ingested")
+    parser.add_argument("--lenient", action="store_true",
+                        help="Ingest the valid entries of log files even if some entries cannot be parsed "
+                             "(requires --quarantine)")
+    parser.add_argument("--quarantine", default=None,
+                        help="In lenient mode, append rejected lines to this file (JSON lines)")
+    parser.add_argument("--reingest-quarantine", default=None,
+                        help="Re-ingest only the lines recorded in this quarantine file")
+    parser.add_argument("--metrics-file", default=None,
+                        help="Write wflogger's own metrics to this path (JSON if it ends in .json, "
+                             "otherwise a Prometheus textfile)")
 
     args = parser.parse_args()
+    if args.lenient and not args.quarantine:
+        parser.error("--lenient requires --quarantine, or the rejected lines would be lost")
     logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
-    ls = LogIngestor(args.sqlite_path)
+    ls = LogIngestor(args.sqlite_path, compact_schema=args.compact,
+                     lenient=args.lenient or bool(args.quarantine), quarantine_path=args.quarantine)
     if args.setup:
         ls.prepare_database()
     if args.reset:
         ls.reset_database()
-    for filepath in args.pattern:
-        matching_paths = glob.glob(filepath)
-        for matching_path in matching_paths:
-            ls.ingest_log(matching_path)
-    (ingested_files,failed_files,entries_ingested) = ls.stats()
-    print("LogIngestor Summary: Ingested %d entries total from %d files, failed to ingest %d files" \
-           % (entries_ingested, ingested_files, failed_files))
+    manifest = Manifest(args.manifest) if args.manifest else None
+    if args.recursive:
+        matching_paths = discover_logs(args.pattern, args.name_pattern, manifest)
+    else:
+        matching_paths = (matching_path for filepath in args.pattern for matching_path in glob.glob(filepath)
+                          if manifest is None or manifest.changed(matching_path, os.stat(matching_path)))
+    ls.ingest_logs(matching_paths, manifest)
+    if manifest:
+        manifest.save()
+    if args.reingest_quarantine:
+        ls.reingest_quarantine(args.reingest_quarantine)
+    (ingested_files,failed_files,entries_ingested,entries_rejected) = ls.stats()
+    print("LogIngestor Summary: Ingested %d entries total from %d files, failed to ingest %d files, "
+          "rejected %d entries" % (entries_ingested, ingested_files, failed_files, entries_rejected))
+    print("LogIngestor Metrics:")
+    print(metrics.summary())
+    if args.metrics_file:
+        metrics.write(args.metrics_file)
@@ -0,0 +1,201 @@
+"""
+Self-instrumentation for wflogger
+
+Keeps counters and histograms of wflogger's own timings (connecting, inserting, parsing,
+batch sizes, bytes scanned...) in a process-wide registry, `metrics`, which can be exported
+as a Prometheus textfile or as a JSON snapshot.
+
+If the environment variable WFLOGGER_METRICS_FILE is set, a snapshot is written to that path
+when the process exits. Paths ending in ".json" are written as JSON, anything else in the
+Prometheus text exposition format. The path may contain "{pid}" so that concurrent processes
+do not overwrite each other's files.
+"""
+
+import atexit
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# upper bounds (in seconds) of the buckets used for latency histograms
+SECONDS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# upper bounds of the buckets used for row count histograms
+ROWS_BUCKETS = (1, 10, 100, 1000, 10000, 100000, 1000000)
+
+DESCRIPTIONS = {
+    "wflogger_connect_seconds": ("histogram", SECONDS_BUCKETS, "Time taken to connect to the database"),
+    "wflogger_insert_seconds": ("histogram", SECONDS_BUCKETS, "Time taken to insert (and commit) records"),
+    "wflogger_batch_rows": ("histogram", ROWS_BUCKETS, "Number of rows written per batch"),
+    "wflogger_records_inserted_total": ("counter", None, "Number of records written to the database"),
+    "wflogger_files_scanned_total": ("counter", None, "Number of log files scanned by the ingestor"),
+    "wflogger_lines_scanned_total": ("counter", None, "Number of log lines scanned by the ingestor"),
+    "wflogger_bytes_scanned_total": ("counter", None, "Number of bytes of log files scanned by the ingestor"),
+    "wflogger_parse_errors_total": ("counter", None, "Number of log entries that could not be parsed"),
+    "wflogger_parse_seconds_total": ("counter", None, "Time spent reading and parsing log files"),
+    "wflogger_db_seconds_total": ("counter", None, "Time spent writing parsed entries to the database"),
+    "wflogger_records_sampled_out_total": ("counter", None, "Number of records skipped by a SampledLogger"),
+    "wflogger_records_aggregated_total": ("counter", None, "Number of durations added to a StageAggregator"),
+}
+
+METRICS_FILE_ENV_VAR = "WFLOGGER_METRICS_FILE"
+
+
+class Histogram:
+    """Cumulative histogram with fixed bucket upper bounds, as used by Prometheus"""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = 0
+        while index < len(self.buckets) and value > self.buckets[index]:
+            index += 1
+        self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self):
+        """
+        :return: list of (upper-bound, cumulative-count) tuples, ending with ("+Inf", total count)
+        """
+        total, result = 0, []
+        for upper, count in zip(list(self.buckets) + ["+Inf"], self.counts):
+            total += count
+            result.append((upper, total))
+        return result
+
+
+class Metrics:
+    """Thread-safe registry of counters and histograms, keyed by metric name and labels"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    @staticmethod
+    def _key(labels):
+        return tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        """Increment the counter `name` (with the given labels) by `value`"""
+        key = self._key(labels)
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """Record `value` in the histogram `name` (with the given labels)"""
+        key = self._key(labels)
+        with self._lock:
+            series = self.histograms.setdefault(name, {})
+            if key not in series:
+                series[key] = Histogram(DESCRIPTIONS.get(name, ("histogram", SECONDS_BUCKETS))[1])
+            series[key].observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Context manager recording the elapsed time of its body in the histogram `name`"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def snapshot(self):
+        """
+        Take a snapshot of all metrics
+
+        :return: JSON-serialisable dictionary
+        """
+        with self._lock:
+            counters = {name: [{"labels": dict(key), "value": value} for key, value in series.items()]
+                        for name, series in self.counters.items()}
+            histograms = {name: [{"labels": dict(key), "count": hist.count, "sum": hist.sum,
+                                  "buckets": [[str(upper), count] for upper, count in hist.cumulative_counts()]}
+                                 for key, hist in series.items()]
+                          for name, series in self.histograms.items()}
+        return {"timestamp": time.time(), "pid": os.getpid(), "counters": counters, "histograms": histograms}
+
+    def to_prometheus(self):
+        """
+        Format all metrics in the Prometheus text exposition format
+
+        :return: string
+        """
+        def fmt_labels(labels, **extra):
+            items = list(labels) + list(extra.items())
+            if not items:
+                return ""
+            return "{%s}" % ",".join('%s="%s"' % (k, str(v).replace('"', '\\"')) for k, v in items)
+
+        lines = []
+        with self._lock:
+            for name, series in sorted(self.counters.items()):
+                lines.append("# HELP %s %s" % (name, DESCRIPTIONS.get(name, ("", None, name))[2]))
+                lines.append("# TYPE %s counter" % name)
+                for key, value in series.items():
+                    lines.append("%s%s %s" % (name, fmt_labels(key), value))
+
+            for name, series in sorted(self.histograms.items()):
+                lines.append("# HELP %s %s" % (name, DESCRIPTIONS.get(name, ("", None, name))[2]))
+                lines.append("# TYPE %s histogram" % name)
+                for key, hist in series.items():
+                    for upper, count in hist.cumulative_counts():
+                        lines.append("%s_bucket%s %d" % (name, fmt_labels(key, le=upper), count))
+                    lines.append("%s_sum%s %s" % (name, fmt_labels(key), hist.sum))
+                    lines.append("%s_count%s %d" % (name, fmt_labels(key), hist.count))
+
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """
+        Write a snapshot to `path`, as JSON if it ends in ".json" or as a Prometheus textfile otherwise
+
+        The file is written to a temporary path and renamed, so that readers never see a partial file.
+        """
+        path = path.format(pid=os.getpid())
+        if path.endswith(".json"):
+            content = json.dumps(self.snapshot(), indent=2)
+        else:
+            content = self.to_prometheus()
+
+        tmp_path = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp_path, "w") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    def summary(self):
+        """
+        Summarise the metrics as human-readable text
+
+        :return: multi-line string
+        """
+        lines = []
+        with self._lock:
+            for name, series in sorted(self.counters.items()):
+                for key, value in series.items():
+                    label = ",".join("%s=%s" % item for item in key)
+                    lines.append("  %-40s %s" % (name + ("[%s]" % label if label else ""),
+                                                 round(value, 6)))
+            for name, series in sorted(self.histograms.items()):
+                for key, hist in series.items():
+                    mean = hist.sum / hist.count if hist.count else 0
+                    lines.append("  %-40s count=%d sum=%.6g mean=%.6g" % (name, hist.count, hist.sum, mean))
+        return "\n".join(lines)
+
+
+metrics = Metrics()
+
+if os.environ.get(METRICS_FILE_ENV_VAR):
+    atexit.register(metrics.write, os.environ[METRICS_FILE_ENV_VAR])
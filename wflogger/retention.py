@@ -0,0 +1,268 @@
+"""
+Retention, rollup and archival of old rows in the workflow_logs table
+
+Raw rows older than a configurable age are:
+    (1) archived to zstd-compressed parquet files (one file per user/workflow/tag per run)
+    (2) rolled up into per-stage, per-day aggregates in the workflow_stage_rollups table
+    (3) deleted from workflow_logs in small batches, each in its own short transaction
+
+The old rows of each user/workflow/tag are read in id order, a chunk at a time, so memory use
+does not grow with the number of rows. They are all archived (each chunk as a row group of the
+parquet file) before any of them are deleted, in a second pass over the same chunks. The rollup
+of each batch is written in the same transaction that deletes its rows, so an interrupted run can
+simply be repeated without double-counting.
+
+A row's duration is the time since the previous row of its iteration, in the same or the
+previous chunk: a row whose predecessor is further back than that is rolled up with a duration of 0.
+
+With a sharded backend, each shard is processed in turn, as a database of its own: its rollups are
+kept in the shard holding the workflows they summarise.
+
+Writing parquet files requires the optional dependency pyarrow.
+"""
+
+import datetime
+import logging
+import os
+import re
+import time
+
+import pandas as pd
+
+from .analysis import add_duration_column
+from .backends import get_backend
+
+DEFAULT_BATCH_SIZE = 1000
+
+# number of rows read (and held in memory) at a time
+DEFAULT_CHUNK_SIZE = 100000
+
+COLUMNS = ["id", "user_id", "hostname", "workflow", "tag", "stage_number", "stage",
+           "iteration", "date_time", "comment", "flag", "duration_ns",
+           "work_bytes", "work_files", "work_items"]
+
+CREATE_ROLLUPS_TABLE_SQL = """CREATE TABLE IF NOT EXISTS workflow_stage_rollups (
+  user_id         varchar(32) NOT NULL,
+  workflow        varchar(64) NOT NULL,
+  tag             varchar(64) NOT NULL,
+  stage_number    integer NOT NULL,
+  stage           varchar(64) NOT NULL,
+  day             date NOT NULL,
+  n_records       integer NOT NULL,
+  duration_sum    double precision NOT NULL,
+  duration_min    double precision NOT NULL,
+  duration_max    double precision NOT NULL,
+  first_date_time timestamp NOT NULL,
+  last_date_time  timestamp NOT NULL,
+  PRIMARY KEY (user_id, workflow, tag, stage_number, stage, day)
+);"""
+
+SELECT_OLD_GROUPS_SQL = """SELECT DISTINCT user_id, workflow, tag FROM workflow_logs
+  WHERE date_time < %s"""
+
+COUNT_OLD_ROWS_SQL = """SELECT COUNT(*) FROM workflow_logs
+  WHERE user_id = %s AND workflow = %s AND tag = %s AND date_time < %s"""
+
+SELECT_OLD_ROWS_SQL = """SELECT {columns} FROM workflow_logs
+  WHERE user_id = %s AND workflow = %s AND tag = %s AND date_time < %s AND id > %s AND id <= %s
+  ORDER BY id LIMIT %s"""
+
+MAX_ID_SQL = "SELECT MAX(id) FROM workflow_logs"
+
+# identifies the rows of one iteration, as compared by analysis.rows_match
+JOB_COLUMNS = ["user_id", "hostname", "workflow", "tag", "iteration"]
+
+# rollups are additive, so that rows arriving late (or later batches) merge into existing aggregates
+UPSERT_ROLLUP_SQL = """INSERT INTO workflow_stage_rollups
+  (user_id, workflow, tag, stage_number, stage, day, n_records, duration_sum,
+  duration_min, duration_max, first_date_time, last_date_time)
+  VALUES
+  (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+  ON CONFLICT (user_id, workflow, tag, stage_number, stage, day) DO UPDATE SET
+  n_records = workflow_stage_rollups.n_records + EXCLUDED.n_records,
+  duration_sum = workflow_stage_rollups.duration_sum + EXCLUDED.duration_sum,
+  duration_min = {least}(workflow_stage_rollups.duration_min, EXCLUDED.duration_min),
+  duration_max = {greatest}(workflow_stage_rollups.duration_max, EXCLUDED.duration_max),
+  first_date_time = {least}(workflow_stage_rollups.first_date_time, EXCLUDED.first_date_time),
+  last_date_time = {greatest}(workflow_stage_rollups.last_date_time, EXCLUDED.last_date_time)"""
+
+DELETE_ROWS_SQL = "DELETE FROM workflow_logs WHERE id IN ({placeholders})"
+
+# sqlite spells LEAST/GREATEST as the multi-argument forms of MIN/MAX
+LEAST_GREATEST = {"postgres": ("LEAST", "GREATEST"), "sqlite": ("MIN", "MAX")}
+
+logger = logging.getLogger("Retention")
+
+
+def _shards(backend):
+    # ids are only unique within a shard, so old rows are found and deleted shard by shard
+    return getattr(backend, "shards", [backend])
+
+
+def prepare_retention(backend=None, compact_schema=False):
+    """
+    Create the rollups table and the date_time index used to find old rows
+
+    On postgres the index is built concurrently, so that writes to the table are not blocked while
+    it is built (the first time).
+
+    :param backend: wflogger.backends.Backend, defaults to get_backend()
+    :param compact_schema: the database uses the compact schema, so index the entries table
+    """
+    backend = backend or get_backend()
+    conn = backend.connect()
+    curs = conn.cursor()
+    curs.execute(CREATE_ROLLUPS_TABLE_SQL)
+    conn.commit()
+    backend.create_index(conn, "workflow_logs_date_time_idx",
+                         "workflow_log_entries" if compact_schema else "workflow_logs", "date_time")
+    conn.close()
+
+
+def rollup(df):
+    """
+    Aggregate raw rows (with a duration column) into per-stage, per-day rollups
+
+    :param df: pandas.DataFrame of workflow_logs rows, including a duration column
+    :return: list of tuples in the column order of UPSERT_ROLLUP_SQL
+    """
+    df = df.assign(day=df["date_time"].dt.date)
+    grouped = df.groupby(["user_id", "workflow", "tag", "stage_number", "stage", "day"], sort=True)
+    agg = grouped.agg(n_records=("duration", "size"), duration_sum=("duration", "sum"),
+                      duration_min=("duration", "min"), duration_max=("duration", "max"),
+                      first_date_time=("date_time", "min"), last_date_time=("date_time", "max"))
+
+    rows = []
+    for key, values in agg.iterrows():
+        (user_id, workflow, tag, stage_number, stage, day) = key
+        rows.append((user_id, workflow, tag, int(stage_number), stage, day.isoformat(),
+                     int(values.n_records), float(values.duration_sum), float(values.duration_min),
+                     float(values.duration_max), values.first_date_time.to_pydatetime(),
+                     values.last_date_time.to_pydatetime()))
+    return rows
+
+
+def _archive_path(archive_dir, user_id, workflow, tag, run_time):
+    name = "_".join(re.sub(r"[^A-Za-z0-9.-]+", "-", part) for part in (user_id, workflow, tag))
+    return os.path.join(archive_dir, "workflow_logs_%s_%s.parquet" % (name, run_time.strftime("%Y%m%dT%H%M%S")))
+
+
+def _archive_schema():
+    import pyarrow as pa
+
+    types = {"date_time": pa.timestamp("us"), "duration": pa.float64()}
+    types.update((column, pa.string()) for column in ("user_id", "hostname", "workflow", "tag", "stage", "comment"))
+    return pa.schema([(column, types.get(column, pa.int64())) for column in COLUMNS + ["duration"]])
+
+
+def _old_chunks(backend, conn, group, cutoff, max_id, chunk_size):
+    """
+    Read the old rows of a user/workflow/tag in id order, a chunk at a time
+
+    :return: generator of pandas.DataFrame of workflow_logs rows, including a duration column
+    """
+    select_sql = backend.sql(SELECT_OLD_ROWS_SQL.format(columns=", ".join(COLUMNS)))
+    curs = conn.cursor()
+    last_id, previous = 0, None
+    while True:
+        curs.execute(select_sql, tuple(group) + (cutoff, last_id, max_id, chunk_size))
+        df = pd.DataFrame(curs.fetchall(), columns=COLUMNS)
+        conn.rollback()
+        if df.empty:
+            return
+        last_id = int(df["id"].max())
+        df["date_time"] = pd.to_datetime(df["date_time"])
+
+        # include the last row of each iteration of the previous chunk, to compute the durations of
+        # the first rows of those iterations in this chunk
+        n_previous = 0 if previous is None else len(previous)
+        if n_previous:
+            df = pd.concat([previous, df], ignore_index=True)
+        df = add_duration_column(df.assign(_previous=[True] * n_previous + [False] * (len(df) - n_previous)))
+        df = df[~df.pop("_previous")].sort_values("id").reset_index(drop=True)
+        previous = df.sort_values(["iteration", "stage_number"], kind="stable") \
+            .groupby(JOB_COLUMNS, sort=False).tail(1)[COLUMNS]
+        yield df
+
+
+def _apply_shard(backend, cutoff, archive_dir, batch_size, pause, dry_run, now, chunk_size):
+    least, greatest = LEAST_GREATEST[backend.dialect]
+    upsert_sql = backend.sql(UPSERT_ROLLUP_SQL.format(least=least, greatest=greatest))
+
+    conn = backend.connect()
+    curs = conn.cursor()
+    curs.execute(backend.sql(SELECT_OLD_GROUPS_SQL), (cutoff,))
+    groups = curs.fetchall()
+    # rows written during the run are left for the next run
+    curs.execute(MAX_ID_SQL)
+    max_id = curs.fetchone()[0] or 0
+    conn.rollback()
+    n_deleted, n_rollups = 0, 0
+
+    for group in groups:
+        user_id, workflow, tag = group
+        if dry_run:
+            curs.execute(backend.sql(COUNT_OLD_ROWS_SQL), tuple(group) + (cutoff,))
+            n_rows = curs.fetchone()[0]
+            conn.rollback()
+            logger.info("Would archive and delete %d rows of %s/%s/%s" % (n_rows, user_id, workflow, tag))
+            n_deleted += n_rows
+            continue
+
+        # archive everything before deleting anything
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        schema = _archive_schema()
+        os.makedirs(archive_dir, exist_ok=True)
+        archive_path = _archive_path(archive_dir, user_id, workflow, tag, now)
+        n_archived = 0
+        with pq.ParquetWriter(archive_path, schema, compression="zstd") as writer:
+            for df in _old_chunks(backend, conn, group, cutoff, max_id, chunk_size):
+                writer.write_table(pa.Table.from_pandas(df, schema=schema, preserve_index=False))
+                n_archived += len(df)
+
+        for df in _old_chunks(backend, conn, group, cutoff, max_id, chunk_size):
+            for start in range(0, len(df), batch_size):
+                batch = df.iloc[start:start + batch_size]
+                rollup_rows = rollup(batch)
+                ids = [int(i) for i in batch["id"]]
+                curs.executemany(upsert_sql, rollup_rows)
+                curs.execute(backend.sql(DELETE_ROWS_SQL.format(placeholders=", ".join(["%s"] * len(ids)))), ids)
+                conn.commit()
+                n_deleted += len(ids)
+                n_rollups += len(rollup_rows)
+                if pause:
+                    time.sleep(pause)
+
+        logger.info("Archived %d rows of %s/%s/%s to %s" % (n_archived, user_id, workflow, tag, archive_path))
+
+    conn.close()
+    return n_deleted, n_rollups
+
+
+def apply_retention(max_age_days, archive_dir, backend=None, batch_size=DEFAULT_BATCH_SIZE,
+                    pause=0.0, dry_run=False, now=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Archive, roll up and delete rows of workflow_logs older than max_age_days
+
+    :param max_age_days: rows with a date_time older than this many days are processed
+    :param archive_dir: directory in which to write the parquet archive files
+    :param backend: wflogger.backends.Backend, defaults to get_backend()
+    :param batch_size: number of rows deleted per transaction
+    :param pause: seconds to sleep between batches, to leave room for other writers
+    :param dry_run: only report the number of rows that would be processed
+    :param now: reference time for the cutoff, defaults to the current time
+    :param chunk_size: number of rows read (and held in memory) at a time
+    :return: (number-of-rows-archived-and-deleted, number-of-rollup-rows-written)
+    """
+    backend = backend or get_backend()
+    now = now or datetime.datetime.now()
+    cutoff = now - datetime.timedelta(days=max_age_days)
+    n_deleted, n_rollups = 0, 0
+    for shard in _shards(backend):
+        shard_deleted, shard_rollups = _apply_shard(shard, cutoff, archive_dir, batch_size, pause, dry_run,
+                                                    now, chunk_size)
+        n_deleted += shard_deleted
+        n_rollups += shard_rollups
+    return n_deleted, n_rollups
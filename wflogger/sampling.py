@@ -0,0 +1,190 @@
+"""
+Client-side sampling and pre-aggregation for stages with very many short iterations
+
+Two ways of reducing the number of rows written for a (workflow, tag, stage):
+
+    (1) SampledLogger logs only 1-in-N iterations (those whose iteration number is a multiple of N)
+        through insert_record. Choosing by iteration number means that every process makes the same
+        choice, and that the stages of a sampled iteration are all logged when they share a rate.
+
+    (2) StageAggregator accumulates the count, sum, min, max and a histogram of the durations
+        of each stage in memory, and writes one summary row per stage per interval to the
+        workflow_log_summaries table (created by db_mngr.create_db, or db_mngr.upgrade_db for
+        existing databases).
+
+analysis.stage_statistics combines the summary rows with the raw rows of workflow_logs.
+"""
+
+import contextlib
+import datetime as dt
+import json
+import time
+
+from .backends import get_backend
+from .credentials import user_id, hostname
+from .metrics import metrics, Histogram
+from .wflogger import insert_record, DEFAULT_FLAG
+
+# upper bounds (in seconds) of the histogram buckets of the summary rows
+DURATION_BUCKETS = (1e-6, 1e-5, 1e-4, 1e-3, 0.01, 0.1, 1.0, 10.0, 100.0, 1000.0)
+
+DEFAULT_INTERVAL = 60.0
+
+INSERT_SUMMARY_SQL = """INSERT INTO workflow_log_summaries
+  (user_id, hostname, workflow, tag, stage_number, stage, start_time, end_time,
+  n_records, duration_sum, duration_min, duration_max, histogram)
+  VALUES
+  (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"""
+
+
+class SampledLogger:
+    """Logs 1-in-N iterations of each (workflow, tag, stage) through insert_record"""
+
+    def __init__(self, sample_every=1, rates=None, backend=None):
+        """
+        Constructor
+
+        :param sample_every: the default N, i.e. log the iterations whose number is a multiple of N
+        :param rates: dictionary of {(workflow, tag, stage): N} overriding sample_every
+        :param backend: write to this wflogger.backends.Backend, defaults to get_backend()
+        """
+        self.sample_every = sample_every
+        self.rates = rates or {}
+        self.backend = backend
+
+    def rate(self, workflow, tag, stage):
+        """
+        :return: the N of 1-in-N for a (workflow, tag, stage)
+        """
+        return self.rates.get((workflow, tag, stage), self.sample_every)
+
+    def log(self, workflow, tag, stage_number, stage, iteration=0,
+            date_time=None, comment="", flag=DEFAULT_FLAG, duration_ns=None,
+            work_bytes=None, work_files=None, work_items=None):
+        """
+        Log a record if its iteration is sampled, arguments are as for wflogger.insert_record
+
+        :return: True iff the record was logged
+        """
+        if iteration % self.rate(workflow, tag, stage) != 0:
+            metrics.inc("wflogger_records_sampled_out_total")
+            return False
+
+        insert_record(workflow, tag, stage_number, stage, iteration, date_time, comment, flag,
+                      backend=self.backend, duration_ns=duration_ns,
+                      work_bytes=work_bytes, work_files=work_files, work_items=work_items)
+        return True
+
+
+class DurationSummary:
+    """Count, sum, min, max and histogram of the durations (in seconds) of one stage"""
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.histogram = Histogram(buckets)
+        self.min = None
+        self.max = None
+
+    def observe(self, duration):
+        self.histogram.observe(duration)
+        self.min = duration if self.min is None else min(self.min, duration)
+        self.max = duration if self.max is None else max(self.max, duration)
+
+    def histogram_json(self):
+        """
+        :return: JSON object of the bucket upper bounds ("le") and the (non-cumulative) count of
+                 each bucket ("counts"), the last count being of durations above the last bound
+        """
+        return json.dumps({"le": list(self.histogram.buckets), "counts": self.histogram.counts})
+
+
+class StageAggregator:
+    """
+    Accumulates stage durations in memory and writes one summary row per stage per interval
+
+    Summaries are written when a duration is observed after the interval has elapsed, and when
+    the aggregator is flushed or closed:
+
+        with StageAggregator(interval=60) as aggregator:
+            for iteration in range(1000000):
+                with aggregator.timed("my-workflow", "v1", 2, "inner"):
+                    step()
+    """
+
+    def __init__(self, interval=DEFAULT_INTERVAL, buckets=DURATION_BUCKETS, backend=None):
+        """
+        Constructor
+
+        :param interval: seconds between summary rows
+        :param buckets: upper bounds (in seconds) of the histogram buckets
+        :param backend: write to this wflogger.backends.Backend, defaults to get_backend()
+        """
+        self.interval = interval
+        self.buckets = buckets
+        self.backend = backend or get_backend()
+        self.summaries = {}
+        self._reset()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _reset(self):
+        self.summaries = {}
+        self.start_time = dt.datetime.now()
+        self._deadline = time.monotonic() + self.interval
+
+    def observe(self, workflow, tag, stage_number, stage, duration_ns):
+        """
+        Add the duration of one iteration of a stage
+
+        :param duration_ns: the duration in nanoseconds, e.g. from time.perf_counter_ns()
+        """
+        key = (workflow, tag, stage_number, stage)
+        summary = self.summaries.get(key)
+        if summary is None:
+            summary = self.summaries[key] = DurationSummary(self.buckets)
+        summary.observe(duration_ns / 1e9)
+        metrics.inc("wflogger_records_aggregated_total")
+
+        if time.monotonic() >= self._deadline:
+            self.flush()
+
+    @contextlib.contextmanager
+    def timed(self, workflow, tag, stage_number, stage):
+        """Time an iteration of a stage with the (monotonic) performance counter and observe its duration"""
+        start_ns = time.perf_counter_ns()
+        yield
+        self.observe(workflow, tag, stage_number, stage, time.perf_counter_ns() - start_ns)
+
+    def summary_rows(self, end_time=None):
+        """
+        :param end_time: the end of the interval, defaults to now
+        :return: list of tuples in the column order of INSERT_SUMMARY_SQL
+        """
+        end_time = end_time or dt.datetime.now()
+        return [(user_id, hostname, workflow, tag, stage_number, stage, self.start_time, end_time,
+                 summary.histogram.count, summary.histogram.sum, summary.min, summary.max,
+                 summary.histogram_json())
+                for (workflow, tag, stage_number, stage), summary in self.summaries.items()]
+
+    def flush(self):
+        """
+        Write a summary row for each stage observed since the last flush, and start a new interval
+
+        :return: number of summary rows written
+        """
+        rows = self.summary_rows()
+        if rows:
+            conn = self.backend.connect()
+            try:
+                self.backend.write_records(conn, INSERT_SUMMARY_SQL, rows)
+            finally:
+                conn.close()
+        self._reset()
+        return len(rows)
+
+    def close(self):
+        """Write the summaries of the final (partial) interval"""
+        self.flush()
@@ -0,0 +1,229 @@
+"""
+Hash-sharded storage across several databases
+
+A ShardedBackend spreads the workflow logs over several databases (shards), each with its own
+workflow_logs table. Every row of a workflow goes to the same shard, chosen by a stable hash of
+the workflow name, so:
+
+    - insert_record, the LogIngestor, write_batch and the asyncio API route each row to its shard.
+    - analysis.get_results reads only the shard of the requested workflow. Queries spanning all
+      workflows run on every shard in parallel, and the results are concatenated.
+    - db_mngr.create_db and upgrade_db apply each statement to every shard.
+
+Each shard is configured as one line of a shards file, named by the environment variable
+WFLOGGER_SHARDS. A line is either "sqlite:<path>" or a postgres (libpq) connection string:
+
+    host=db1.example.org port=5432 dbname=wflogs user=wflogger password=...
+    host=db2.example.org port=5432 dbname=wflogs user=wflogger password=...
+
+The number and order of the shards decide where each workflow's rows live, so changing them
+requires moving the existing rows. Ids are assigned by each shard, so they are only unique within
+a shard. Writes to several shards are committed shard by shard, not in one transaction.
+
+Retention and the runtime statistics process each shard in turn. The compact schema and tail
+need a single database, and refuse a sharded backend.
+"""
+
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from .backends import Backend, PostgresBackend, SQLiteBackend, DEFAULT_BATCH_SIZE
+
+# the position of the workflow in a row in workflow_logs (or workflow_log_summaries) column order
+WORKFLOW_INDEX = 2
+
+
+def shard_index(workflow, n_shards):
+    """
+    :param workflow: the workflow name
+    :param n_shards: the number of shards
+    :return: the index of the shard holding the workflow's rows, the same in every process
+    """
+    return zlib.crc32(workflow.encode("utf-8")) % n_shards
+
+
+def load_shards(path):
+    """
+    Read a shards file, one shard per line (blank lines and lines starting with # are ignored)
+
+    :param path: filesystem path of the shards file
+    :return: list of wflogger.backends.Backend
+    """
+    shards = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if line.startswith("sqlite:"):
+                shards.append(SQLiteBackend(line[len("sqlite:"):]))
+            else:
+                shards.append(PostgresBackend(line))
+    return shards
+
+
+class ShardedCursor:
+    """
+    A cursor over every shard: statements are run on each shard, and rows written with
+    executemany go to the shard of their workflow
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.description = None
+        self._rows = []
+
+    def execute(self, statement, params=None):
+        self._rows = []
+        for index in range(len(self.conn.backend.shards)):
+            cursor = self.conn.shard(index).cursor()
+            if params is None:
+                cursor.execute(statement)
+            else:
+                cursor.execute(statement, params)
+            self.description = cursor.description
+            if cursor.description is not None:
+                self._rows.extend(cursor.fetchall())
+
+    def executemany(self, statement, rows):
+        for index, shard_rows in self.conn.backend.partition(rows).items():
+            self.conn.shard(index).cursor().executemany(statement, shard_rows)
+
+    def fetchall(self):
+        """
+        :return: the rows returned by every shard, in shard order
+        """
+        rows, self._rows = self._rows, []
+        return rows
+
+    def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
+
+
+class ShardedConnection:
+    """A connection to every shard, each opened when it is first used"""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.conns = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+
+    def shard(self, index):
+        """
+        :param index: the index of a shard
+        :return: DB-API connection to the shard
+        """
+        conn = self.conns.get(index)
+        if conn is None:
+            conn = self.conns[index] = self.backend.shards[index].connect()
+        return conn
+
+    def cursor(self):
+        return ShardedCursor(self)
+
+    def commit(self):
+        for conn in self.conns.values():
+            conn.commit()
+
+    def rollback(self):
+        for conn in self.conns.values():
+            conn.rollback()
+
+    def close(self):
+        for conn in self.conns.values():
+            conn.close()
+        self.conns = {}
+
+
+class ShardedBackend(Backend):
+    """Several databases of the same dialect, each holding the rows of a fixed subset of the workflows"""
+
+    name = "sharded"
+
+    def __init__(self, shards):
+        """
+        Constructor
+
+        :param shards: list of wflogger.backends.Backend, all of the same dialect
+        """
+        if not shards:
+            raise ValueError("A sharded backend needs at least one shard")
+        dialects = set(shard.dialect for shard in shards)
+        if len(dialects) > 1:
+            raise ValueError(f"The shards must all use the same SQL dialect, not: {sorted(dialects)}")
+
+        self.shards = list(shards)
+        self.dialect = self.shards[0].dialect
+
+    def __repr__(self):
+        return f"ShardedBackend({self.shards!r})"
+
+    def shard(self, workflow):
+        """
+        :param workflow: the workflow name
+        :return: the wflogger.backends.Backend holding the workflow's rows
+        """
+        return self.shards[shard_index(workflow, len(self.shards))]
+
+    def partition(self, rows):
+        """
+        Split rows by shard, keeping their order
+
+        :param rows: sequence of tuples in workflow_logs column order
+        :return: dictionary of shard index -> list of rows
+        """
+        partitions = {}
+        for row in rows:
+            partitions.setdefault(shard_index(row[WORKFLOW_INDEX], len(self.shards)), []).append(row)
+        return partitions
+
+    def for_workflow(self, workflow):
+        return self if workflow is None else self.shard(workflow)
+
+    def connect(self):
+        return ShardedConnection(self)
+
+    def sql(self, statement):
+        return self.shards[0].sql(statement)
+
+    def ddl(self, statement):
+        return self.shards[0].ddl(statement)
+
+    def insert(self, statement, row):
+        self.shard(row[WORKFLOW_INDEX]).insert(statement, row)
+
+    def create_index(self, conn, name, table, columns):
+        for index, shard in enumerate(self.shards):
+            shard.create_index(conn.shard(index), name, table, columns)
+
+    def write_records(self, conn, statement, rows, batch_size=DEFAULT_BATCH_SIZE):
+        for index, shard_rows in self.partition(rows).items():
+            self.shards[index].write_records(conn.shard(index), statement, shard_rows, batch_size)
+        return len(rows)
+
+    def read_sql(self, query, **kwargs):
+        """
+        Run a query on every shard in parallel and concatenate the results
+
+        :param query: SQL query
+        :param kwargs: additional arguments to pandas.read_sql
+        :return: pandas.DataFrame
+        """
+        import pandas as pd
+
+        with ThreadPoolExecutor(max_workers=len(self.shards)) as executor:
+            frames = list(executor.map(lambda shard: shard.read_sql(query, **kwargs), self.shards))
+
+        # concatenating empty frames would reset the dtypes of the others
+        non_empty = [df for df in frames if len(df)]
+        if len(non_empty) <= 1:
+            return (non_empty or frames)[0]
+        return pd.concat(non_empty, ignore_index=True)
@@ -0,0 +1,232 @@
+"""
+Follow new rows of the workflow_logs table as they are written
+
+Rather than re-running the full query of get_results, a LogTail remembers the highest id it has
+seen (the high-water mark) and only asks for rows above it, up to the current maximum id, and for
+the ids still missing below it (see below). Both queries use the primary key index, so the cost of
+each poll depends on the number of new rows and open gaps, not on the size of the table.
+
+    - On postgres, a statement-level trigger (installed by prepare_tail) sends a NOTIFY when rows
+      are inserted, so the LogTail sleeps until there is something new. Without the trigger it
+      falls back to polling.
+    - On SQLite, the LogTail polls, skipping the queries entirely when PRAGMA data_version shows
+      that nothing has been committed since the last poll.
+
+On postgres, ids are assigned when rows are inserted but become visible when their transaction
+commits, so a row can appear after a higher id has already been read. The ids missing below the
+high-water mark (the gaps) are remembered and re-read until their rows appear, or until the gap
+timeout has passed (the ids of rolled back transactions are never used).
+"""
+
+import select
+import time
+
+from .backends import get_backend
+from .credentials import user_id as default_user_id
+from .wflogger import DEFAULT_FLAG
+
+CHANNEL = "wflogger_workflow_logs"
+
+DEFAULT_POLL_INTERVAL = 0.5
+
+# seconds to wait for the row of a missing id to be committed
+DEFAULT_GAP_TIMEOUT = 60
+
+NOTIFY_FUNCTION_SQL = f"""CREATE OR REPLACE FUNCTION wfl_notify_workflow_logs() RETURNS trigger AS $$
+BEGIN
+  PERFORM pg_notify('{CHANNEL}', '');
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;"""
+
+DROP_NOTIFY_TRIGGER_SQL = "DROP TRIGGER IF EXISTS workflow_logs_notify ON {table};"
+
+CREATE_NOTIFY_TRIGGER_SQL = """CREATE TRIGGER workflow_logs_notify AFTER INSERT ON {table}
+  FOR EACH STATEMENT EXECUTE PROCEDURE wfl_notify_workflow_logs();"""
+
+MAX_ID_SQL = "SELECT MAX(id) FROM {table}"
+
+SELECT_IDS_SQL = "SELECT id FROM {table} WHERE (id > %s AND id <= %s{gaps})"
+
+SELECT_NEW_ROWS_SQL = "SELECT * FROM workflow_logs WHERE (id > %s AND id <= %s{gaps})"
+
+
+def _id_table(compact_schema):
+    # the ids of the compact schema's view come from its entries table, which has the index
+    return "workflow_log_entries" if compact_schema else "workflow_logs"
+
+
+def _check_backend(backend):
+    # the ids of a sharded backend are only unique within a shard, so there is no one high-water mark
+    if backend.name == "sharded":
+        raise ValueError("Tail cannot follow a sharded backend, follow one of its shards instead")
+
+
+def prepare_tail(backend=None, compact_schema=False):
+    """
+    Install the trigger which notifies a postgres LogTail of new rows (nothing to do for SQLite)
+
+    :param backend: wflogger.backends.Backend, defaults to get_backend()
+    :param compact_schema: the database uses the compact schema
+    """
+    backend = backend or get_backend()
+    _check_backend(backend)
+    if backend.dialect != "postgres":
+        return
+
+    table = _id_table(compact_schema)
+    conn = backend.connect()
+    with conn:
+        with conn.cursor() as curs:
+            curs.execute(NOTIFY_FUNCTION_SQL)
+            curs.execute(DROP_NOTIFY_TRIGGER_SQL.format(table=table))
+            curs.execute(CREATE_NOTIFY_TRIGGER_SQL.format(table=table))
+    conn.close()
+
+
+def _get_tail_filter(workflow=None, tag=None, stage_number=None, stage=None, iteration=None,
+                     user_id=default_user_id, hostname=None, comment="", flag=DEFAULT_FLAG):
+    # the same filters as analysis._get_select_statement, as query parameters
+    conditions, params = [], []
+    for name, value in [("user_id", user_id), ("workflow", workflow), ("tag", tag), ("stage", stage),
+                        ("hostname", hostname), ("comment", comment), ("stage_number", stage_number),
+                        ("iteration", iteration), ("flag", flag)]:
+        if value is not None:
+            conditions.append(f"{name} = %s")
+            params.append(value)
+    return "".join(f" AND {condition}" for condition in conditions), params
+
+
+class LogTail:
+    """Follows the new rows of workflow_logs that match a filter"""
+
+    def __init__(self, workflow=None, tag=None, stage_number=None, stage=None, iteration=None,
+                 user_id=default_user_id, hostname=None, comment="", flag=DEFAULT_FLAG,
+                 backend=None, compact_schema=False, from_id=None, poll_interval=DEFAULT_POLL_INTERVAL,
+                 gap_timeout=DEFAULT_GAP_TIMEOUT):
+        """
+        Constructor
+
+        The filter arguments are as for analysis._get_select_statement (None matches any value).
+
+        :param backend: wflogger.backends.Backend, defaults to get_backend()
+        :param compact_schema: the database uses the compact schema
+        :param from_id: follow the rows with ids above this, defaults to the current maximum id
+        :param poll_interval: maximum seconds between polls
+        :param gap_timeout: seconds to keep looking for the row of an id missing below the high-water mark
+        """
+        self.backend = backend or get_backend()
+        _check_backend(self.backend)
+        self.poll_interval = poll_interval
+        self.gap_timeout = gap_timeout
+        self.max_id_sql = MAX_ID_SQL.format(table=_id_table(compact_schema))
+        self.id_table = _id_table(compact_schema)
+        self.conditions, self.params = _get_tail_filter(workflow, tag, stage_number, stage, iteration,
+                                                        user_id, hostname, comment, flag)
+
+        self.conn = self.backend.connect()
+        self.listening = False
+        self.data_version = None
+        if self.backend.dialect == "postgres":
+            # no transaction is held open between polls, and notifications are delivered immediately
+            self.conn.autocommit = True
+            self.conn.cursor().execute(f"LISTEN {CHANNEL}")
+            self.listening = True
+        else:
+            self.conn.isolation_level = None
+
+        # missing id -> time.monotonic() after which it is given up. The ids missing from the rows
+        # written before the tail started (e.g. deleted by retention) are not looked for.
+        self.gaps = {}
+        self.gap_floor = self._max_id()
+        self.high_water = self.gap_floor if from_id is None else from_id
+
+    def __iter__(self):
+        while True:
+            for row in self.poll():
+                yield row
+            self.wait()
+
+    def _max_id(self):
+        curs = self.conn.cursor()
+        curs.execute(self.max_id_sql)
+        return curs.fetchone()[0] or 0
+
+    def _statements(self, n_gaps):
+        # the new ids, and the open gaps by their ids: the cost does not depend on how far back they are
+        gaps = f" OR id IN ({', '.join(['%s'] * n_gaps)})" if n_gaps else ""
+        ids_sql = SELECT_IDS_SQL.format(table=self.id_table, gaps=gaps)
+        select_sql = SELECT_NEW_ROWS_SQL.format(gaps=gaps) + self.conditions + " ORDER BY id"
+        return self.backend.sql(ids_sql), self.backend.sql(select_sql)
+
+    def _unchanged(self):
+        # sqlite's data_version changes whenever another connection commits
+        if self.backend.dialect != "sqlite":
+            return False
+        data_version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        unchanged = data_version == self.data_version
+        self.data_version = data_version
+        return unchanged
+
+    def poll(self):
+        """
+        Get the matching rows written since the last poll
+
+        :return: list of dictionaries of column name -> value, in id order
+        """
+        if self._unchanged():
+            return []
+
+        now = time.monotonic()
+        self.gaps = {gap: expiry for gap, expiry in self.gaps.items() if expiry > now}
+        top = max(self._max_id(), self.high_water)
+        if top == self.high_water and not self.gaps:
+            return []
+
+        # read the ids above the high-water mark and the open gaps, and remember the ids still missing
+        open_gaps = sorted(self.gaps)
+        ids_sql, select_sql = self._statements(len(open_gaps))
+        curs = self.conn.cursor()
+        curs.execute(ids_sql, [self.high_water, top] + open_gaps)
+        present = set(row[0] for row in curs.fetchall())
+        for missing in range(max(self.high_water, self.gap_floor) + 1, top + 1):
+            if missing not in present:
+                self.gaps[missing] = now + self.gap_timeout
+
+        # every row selected is new or fills a gap, so none has been returned before
+        curs.execute(select_sql, [self.high_water, top] + open_gaps + self.params)
+        columns = [column[0] for column in curs.description]
+        rows = [dict(zip(columns, row)) for row in curs.fetchall()]
+        # the gaps filled by rows which do not match the filter, or committed between the two queries
+        for gap in present.union(row["id"] for row in rows):
+            self.gaps.pop(gap, None)
+        self.high_water = top
+        return rows
+
+    def wait(self, timeout=None):
+        """
+        Block until there may be new rows: until a notification arrives (postgres) or for at most
+        the poll interval
+
+        :param timeout: maximum seconds to wait, defaults to the poll interval
+        """
+        timeout = self.poll_interval if timeout is None else timeout
+        if not self.listening:
+            time.sleep(timeout)
+            return
+
+        if self.conn.notifies or select.select([self.conn], [], [], timeout)[0]:
+            self.conn.poll()
+            del self.conn.notifies[:]
+
+    def close(self):
+        self.conn.close()
+
+
+def tail(*args, **kwargs):
+    """
+    Iterate forever over the new rows of workflow_logs, arguments are as for LogTail
+
+    :return: generator of dictionaries of column name -> value
+    """
+    return iter(LogTail(*args, **kwargs))
@@ -1,32 +1,55 @@
+import contextlib
 import datetime as dt
-import psycopg2
+import time
+from dateutil import parser
 
-
-from .credentials import creds, user_id, hostname
+from .backends import get_backend
+from .credentials import user_id, hostname
 
 
 INSERT_SQL = """INSERT INTO workflow_logs
   (user_id, hostname, workflow, tag, stage_number, stage,
-  iteration, date_time, comment, flag)
+  iteration, date_time, comment, flag, duration_ns,
+  work_bytes, work_files, work_items)
   VALUES
-  (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"""
+  (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"""
 
 DEFAULT_ITERATION = 0
 DEFAULT_FLAG = -999
 
 
 def insert_record(workflow, tag, stage_number, stage, iteration=0,
-                  date_time=None, comment="", flag=DEFAULT_FLAG):
+                  date_time=None, comment="", flag=DEFAULT_FLAG, backend=None, duration_ns=None,
+                  work_bytes=None, work_files=None, work_items=None):
 
     if date_time:
         date_time = parser.parse(date_time)
     else:
         date_time = dt.datetime.now()
 
-    with psycopg2.connect(creds) as conn:
-        with conn.cursor() as curs:
-            curs.execute(INSERT_SQL,
-                (user_id, hostname, workflow, tag, stage_number,
-                 stage, iteration, date_time, comment, flag))
-
-
+    backend = backend or get_backend()
+    backend.insert(INSERT_SQL,
+        (user_id, hostname, workflow, tag, stage_number,
+         stage, iteration, date_time, comment, flag, duration_ns,
+         work_bytes, work_files, work_items))
+
+
+@contextlib.contextmanager
+def timed_stage(workflow, tag, stage_number, stage, iteration=0, comment="", flag=DEFAULT_FLAG, backend=None):
+    """
+    Time a stage with the (monotonic, high-resolution) performance counter and log it when it ends
+
+    The record is written when the block exits, with the measured duration in nanoseconds, which
+    analysis prefers to the difference between the date-times of consecutive records. The block
+    may record the work done by the stage in the yielded dictionary, under the keys "bytes",
+    "files" and "items":
+
+        with timed_stage("my-workflow", "v1", 2, "model", iteration) as work:
+            work["items"] = run_model()
+    """
+    work = {}
+    start_ns = time.perf_counter_ns()
+    yield work
+    insert_record(workflow, tag, stage_number, stage, iteration, comment=comment, flag=flag,
+                  backend=backend, duration_ns=time.perf_counter_ns() - start_ns,
+                  work_bytes=work.get("bytes"), work_files=work.get("files"), work_items=work.get("items"))